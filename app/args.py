@@ -11,6 +11,41 @@ class Args:
         parser.add_argument("--port", type=int, default=29500)
         parser.add_argument("--master", action="store_true")
         parser.add_argument("--num_shards", type=int, default=1)
+        parser.add_argument("--orchestrator", type=str, default="simple", choices=["simple", "capacity", "network"], help="How the master places shards on nodes. capacity uses the cores, memory and speed nodes report; network measures the links between nodes and keeps large activations on the fastest ones.")
+        parser.add_argument("--num_nodes", type=int, default=None, help="Nodes the master waits for, defaults to --num_shards. Extra nodes run copies of the slowest shards.")
+        parser.add_argument("--max_batch_size", type=int, default=1, help="Largest number of requests to run through the model in one call. 1 disables micro-batching.")
+        parser.add_argument("--max_batch_wait_ms", type=float, default=2.0, help="How long to wait for a micro-batch to fill before running it.")
+        parser.add_argument("--max_in_flight", type=int, default=4, help="Most concurrent requests (and pooled connections) to any one peer node.")
+        parser.add_argument("--trace_sample_rate", type=float, default=0.0, help="Fraction of requests whose spans are recorded on every node, see /trace on the master.")
+        parser.add_argument("--max_output_mb", type=float, default=None, help="Memory budget for intermediate outputs awaiting delivery. Unlimited by default.")
+        parser.add_argument("--max_final_output_mb", type=float, default=None, help="Memory budget for final outputs on the master. Unlimited by default.")
+        parser.add_argument("--final_output_ttl", type=float, default=None, help="Seconds final outputs are kept on the master. Forever by default.")
+        parser.add_argument("--spill_dir", type=str, default=None, help="Spill outputs over budget to memory-mapped files here instead of dropping them. Spill files left in it are removed on startup.")
+        parser.add_argument("--max_spill_mb", type=float, default=None, help="Disk budget of the spilled intermediate outputs, and again of the spilled final outputs, beyond which they are dropped. Unlimited by default.")
+        parser.add_argument("--edge_codec", type=str, default="fp32", help="How tensors are sent between shards: a precision (fp32, fp16, bf16, int8) and/or compression (zstd, lz4, zlib), e.g. \"bf16+zstd\".")
+        parser.add_argument("--edge_codec_min_kb", type=float, default=0, help="Only use --edge_codec on shard edges predicted to send at least this many KB.")
+        parser.add_argument("--send_retries", type=int, default=3, help="How many times to retry a failed send to a peer node.")
+        parser.add_argument("--num_workers", type=int, default=1, help="Number of inference worker threads.")
+        parser.add_argument("--num_senders", type=int, default=2, help="Number of threads sending finished requests downstream.")
+        parser.add_argument("--partitioner", type=str, default="spectral", choices=["simple", "spectral", "cost_aware"], help="How the master splits the model into shards.")
+        parser.add_argument("--shard_cache_dir", type=str, default=None, help="Where the master caches shards between runs. Defaults to shard_cache/ next to the model.")
+        parser.add_argument("--shard_cache_gb", type=float, default=20, help="Disk budget of the shard cache.")
+        parser.add_argument("--no_shard_cache", action="store_true", help="Always re-shard the model.")
+        parser.add_argument("--profile_runs", type=int, default=0, help="After distributing the shards, profile every shard's operators over this many runs and save the timings to --op_profile.")
+        parser.add_argument("--op_profile", type=str, default=None, help="Per-operator timings from an earlier --profile_runs, used to balance shards by measured time. Defaults to <model_path>.op_profile.json, used if it exists.")
+        parser.add_argument("--out_of_core_sharding", action="store_true", help="Shard without loading weights into memory. Always done for models with external data.")
+        parser.add_argument("--intra_op_threads", type=int, default=0, help="ONNX Runtime threads per operator, 0 for one per core.")
+        parser.add_argument("--inter_op_threads", type=int, default=0, help="ONNX Runtime threads running operators concurrently, with --execution_mode parallel.")
+        parser.add_argument("--execution_mode", type=str, default="sequential", choices=["sequential", "parallel"])
+        parser.add_argument("--optimization_level", type=str, default="all", choices=["disable", "basic", "extended", "all"], help="ONNX Runtime graph optimization level.")
+        parser.add_argument("--no_mem_arena", action="store_true", help="Return freed memory instead of keeping it in ONNX Runtime's arena.")
+        parser.add_argument("--optimized_model_dir", type=str, default=None, help="Where optimized models are cached. Defaults to next to the model.")
+        parser.add_argument("--no_optimized_model_cache", action="store_true", help="Optimize the model on every start.")
+        parser.add_argument("--io_binding", action="store_true", help="Run into preallocated output buffers. Outputs are then dropped once sent, so /output no longer serves them.")
+        parser.add_argument("--replicas", type=int, default=1, help="Session replicas per node, each with an even share of the cores unless --intra_op_threads is set.")
+        parser.add_argument("--no_warmup", action="store_true", help="Don't run the model on dummy inputs before reporting ready.")
+        parser.add_argument("--max_queue_size", type=int, default=64, help="Most pending requests before new ones are refused with 503.")
+        parser.add_argument("--pending_timeout", type=float, default=60, help="Seconds a request may wait for its remaining inputs before it is dropped and reported to the master as failed.")
 
         args = parser.parse_args()
 
@@ -21,5 +56,40 @@ class Args:
         self.master = args.master or (self.master_ip == self.ip and self.master_port == self.port)
         self.model_path = args.model_path
         self.num_shards = args.num_shards
+        self.num_nodes = args.num_nodes or args.num_shards
+        self.orchestrator = args.orchestrator
+        self.max_batch_size = args.max_batch_size
+        self.max_batch_wait = args.max_batch_wait_ms / 1000
+        self.max_in_flight = args.max_in_flight
+        self.trace_sample_rate = args.trace_sample_rate
+        self.max_output_bytes = int(args.max_output_mb * 2**20) if args.max_output_mb is not None else None
+        self.max_final_output_bytes = int(args.max_final_output_mb * 2**20) if args.max_final_output_mb is not None else None
+        self.final_output_ttl = args.final_output_ttl
+        self.spill_dir = args.spill_dir
+        self.max_spill_bytes = int(args.max_spill_mb * 2**20) if args.max_spill_mb is not None else None
+        self.edge_codec = args.edge_codec
+        self.edge_codec_min_kb = args.edge_codec_min_kb
+        self.send_retries = args.send_retries
+        self.num_workers = args.num_workers
+        self.num_senders = args.num_senders
+        self.max_queue_size = args.max_queue_size
+        self.pending_timeout = args.pending_timeout
+        self.partitioner = args.partitioner
+        self.shard_cache_dir = args.shard_cache_dir
+        self.shard_cache_bytes = int(args.shard_cache_gb * 2**30)
+        self.use_shard_cache = not args.no_shard_cache
+        self.out_of_core_sharding = True if args.out_of_core_sharding else None
+        self.profile_runs = args.profile_runs
+        self.op_profile = args.op_profile or f"{args.model_path}.op_profile.json"
+        self.intra_op_threads = args.intra_op_threads
+        self.inter_op_threads = args.inter_op_threads
+        self.execution_mode = args.execution_mode
+        self.optimization_level = args.optimization_level
+        self.enable_mem_arena = not args.no_mem_arena
+        self.optimized_model_dir = args.optimized_model_dir
+        self.cache_optimized_model = not args.no_optimized_model_cache
+        self.io_binding = args.io_binding
+        self.replicas = args.replicas
+        self.warmup = not args.no_warmup
 
         print(f"num shards: {self.num_shards}, {args.num_shards}")
@@ -1,14 +1,44 @@
-from periphery.model.model import PeriModel
+from periphery.distributed.peer_pool import PeerPool
+from periphery.model.model import PeriModel, SessionConfig
+from periphery.model.shard_cache import ShardCache
 import periphery.model.shard as shard
+import periphery.utils.codec as codec
 
+import json
 import os
 
 import pathlib
 
+def configure_task_manager(server, args):
+    server.task_manager.set_batching(args.max_batch_size, args.max_batch_wait)
+    server.task_manager.peers = PeerPool(max_in_flight=args.max_in_flight, retries=args.send_retries)
+    server.task_manager.set_queue_size(args.max_queue_size)
+    server.task_manager.pending_timeout = args.pending_timeout
+    server.task_manager.tracer.sample_rate = args.trace_sample_rate
+    server.task_manager.set_result_limits(args.max_output_bytes, args.max_final_output_bytes, args.final_output_ttl, args.spill_dir, args.max_spill_bytes)
+    # at least one worker per replica, so that every replica can be busy
+    server.task_manager.start(num_workers=max(args.num_workers, args.replicas), num_senders=args.num_senders)
+
+def configure_sessions(server, args):
+    server.session_config = SessionConfig(
+        intra_op_threads=args.intra_op_threads,
+        inter_op_threads=args.inter_op_threads,
+        execution_mode=args.execution_mode,
+        optimization_level=args.optimization_level,
+        enable_mem_arena=args.enable_mem_arena,
+        cache_optimized_model=args.cache_optimized_model,
+        optimized_model_dir=args.optimized_model_dir,
+        io_binding=args.io_binding,
+        replicas=args.replicas,
+    )
+    server.warmup = args.warmup
+
 def wait_for_network(server, args):
     if args.master:
-        server.wait_for_nodes(args.num_shards)
+        server.orchestrator = args.orchestrator
+        server.wait_for_nodes(args.num_nodes)
     else:
+        server.model_path = args.model_path
         master_url = f"http://{args.master_ip}:{args.master_port}"
         server.wait_for_master(master_url)
         server.register_self(master_url)
@@ -17,19 +47,46 @@ def wait_for_network(server, args):
 
 def shard_and_distribute_model(server, args):
     if not args.master:
-        server.task_manager.model = PeriModel(args.model_path)
+        # the master uploads this node's shard to model_path, see /model_commit
         return
 
     model = PeriModel(args.model_path)
 
     model_dir = os.path.dirname(os.path.realpath(args.model_path))
-    shard_dir = os.path.join(model_dir, "shards")
-    pathlib.Path(shard_dir).mkdir(parents=True, exist_ok=True)
+    node_times = load_op_profile(args.op_profile)
+    shard_fn = lambda paths: shard.shard_onnx_model(model, args.num_shards, paths, partitioner=args.partitioner, out_of_core=args.out_of_core_sharding, node_times=node_times)
 
-    shard_paths = [os.path.join(shard_dir, f"shard_{i}.onnx") for i in range(args.num_shards)]
+    if args.use_shard_cache:
+        cache = ShardCache(args.shard_cache_dir or os.path.join(model_dir, "shard_cache"), args.shard_cache_bytes)
+        settings = {"partitioner": args.partitioner, "out_of_core": args.out_of_core_sharding, "op_profile": node_times}
+        shard_paths, shard_graph = cache.get_or_shard(model, args.num_shards, settings, shard_fn)
+    else:
+        shard_dir = os.path.join(model_dir, "shards")
+        pathlib.Path(shard_dir).mkdir(parents=True, exist_ok=True)
 
-    shard_graph = shard.shard_onnx_model(model, args.num_shards, shard_paths)
+        shard_paths = [os.path.join(shard_dir, f"shard_{i}.onnx") for i in range(args.num_shards)]
+        shard_graph = shard_fn(shard_paths)
     
     submodels = [PeriModel(shard_path) for shard_path in shard_paths]
 
+    if args.edge_codec != "fp32":
+        n_edges = codec.assign_edge_codecs(shard_graph, args.edge_codec, args.edge_codec_min_kb * 1024)
+        print(f"Sending {args.edge_codec} over {n_edges} shard edges")
+
     server.assign_shards(submodels, shard_graph)
+
+    if args.profile_runs > 0:
+        profile = server.profile_cluster(args.profile_runs)
+        with open(args.op_profile, "w") as f:
+            json.dump(profile, f)
+        print(f"Saved operator timings to {args.op_profile}, the next sharding balances them")
+
+def load_op_profile(path):
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        node_times = json.load(f)["node_times"]
+    print(f"Balancing shards by the operator timings in {path}")
+
+    return node_times
@@ -13,6 +13,8 @@ if __name__ == "__main__":
 
     node = Node(args.ip, args.port)
     server = Server(node, protocol="http")
+    peri_setup.configure_task_manager(server, args)
+    peri_setup.configure_sessions(server, args)
     
     server.run(host=args.ip, port=args.port)
 
@@ -0,0 +1,31 @@
+import os
+import time
+
+import numpy as np
+import psutil
+
+def matmul_score(size=256, duration=0.2):
+    """
+    FLOP/s of float32 matrix multiplication on this machine, measured for about duration seconds.
+    A rough proxy for how fast a node runs the MatMul-heavy shards of a model.
+    """
+    rng = np.random.default_rng(0)
+    a = rng.random((size, size), dtype=np.float32)
+    b = rng.random((size, size), dtype=np.float32)
+    a @ b
+
+    runs = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        a @ b
+        runs += 1
+
+    return 2 * size ** 3 * runs / (time.perf_counter() - start)
+
+def measure_capabilities():
+    # What a node reports when registering with the master
+    return {
+        "cores": os.cpu_count() or 1,
+        "free_memory": psutil.virtual_memory().available,
+        "matmul_flops": matmul_score(),
+    }
@@ -1,18 +1,30 @@
 from fastapi import FastAPI, BackgroundTasks, UploadFile, File, HTTPException, Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, RedirectResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from typing import Optional, List
 import uvicorn
 import numpy as np
 import threading
+import asyncio
+import base64
 import requests
 import pickle
 import io
 import os
+import pathlib
+import shutil
 import signal
 import psutil
 import time
 
+from periphery.distributed import transfer
+from periphery.distributed.task_manager import QueueFullError
+from periphery.model.model import PeriModel, SessionConfig
 from periphery.orchestration.simple_orchestrator import SimpleOrchestrator
+from periphery.orchestration.capacity_orchestrator import CapacityOrchestrator
+from periphery.orchestration.network_orchestrator import NetworkOrchestrator
+from periphery.distributed.capabilities import measure_capabilities
+from periphery.utils import wire, tracing, codec
 
 class Server:
     def __init__(self, node, protocol="https"):
@@ -24,11 +36,43 @@ class Server:
 
         self.registered_nodes = []
         self.registration_condition = threading.Condition()
+        # Resources each node reported when registering, see capabilities.measure_capabilities
+        self.node_capabilities = {}
+
+        # How shards are placed on nodes: "simple", "capacity" or "network"
+        self.orchestrator = "simple"
+
+        # Measured links between nodes, {source: {target: {"rtt": s, "bandwidth": bytes/s}}}, and
+        # the payload used to measure them
+        self.link_costs = {}
+        self.probe_size = 1 << 20
+        self.probe_rounds = 3
+
+        # Nodes running each shard, as last assigned by this master
+        self.placement = {}
+        self.predicted_transfer_time = None
+
+        # Per-operator timings of every shard, gathered by profile_cluster
+        self.op_profile = {}
 
         self.master_url = None
         self.is_master = False
 
+        # Where assigned models are written; defaults to the path of the current model
+        self.model_path = None
+        # How assigned models are run, and whether they are warmed up before the node reports ready
+        self.session_config = SessionConfig()
+        self.warmup = True
+
         self.parent_nodes = {}
+        # Session replicas per node url, as reported by /replicas when shards are assigned
+        self.node_replicas = {}
+
+        # Seconds an overloaded node asks senders to wait before retrying
+        self.retry_after = 1
+        # Longest a /final_output long-poll is held, and the keepalive period of result streams
+        self.max_poll_timeout = 60
+        self.stream_keepalive = 15
 
         # Register routes
         self.add_routes()
@@ -46,6 +90,53 @@ class Server:
             with self.registration_condition:
                 self.registration_condition.wait()
             print(f"{self.world_size()}/{target_world_size}")
+
+        if self.orchestrator == "network":
+            self.link_costs = self.measure_links()
+
+    def probe_links(self, targets, size, rounds):
+        """
+        Measure the round trip time and bandwidth from this node to each target: the fastest of
+        rounds empty requests, and the fastest of rounds uploads of size bytes less a round trip.
+        """
+        payload = bytes(size)
+        links = {}
+        for target in targets:
+            rtts = []
+            uploads = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                self.task_manager.peers.get(f"{target}/", retries=0).raise_for_status()
+                rtts.append(time.perf_counter() - start)
+
+            for _ in range(rounds):
+                start = time.perf_counter()
+                self.task_manager.peers.post(f"{target}/probe_payload", data=payload, retries=0).raise_for_status()
+                uploads.append(time.perf_counter() - start)
+
+            rtt = min(rtts)
+            links[target] = {"rtt": rtt, "bandwidth": size / max(min(uploads) - rtt, 1e-6)}
+
+        return links
+
+    def measure_links(self):
+        # Every node probes every other node in turn, so that probes don't compete for the links
+        nodes = [self.node.get_url(self.protocol)] + list(self.registered_nodes)
+        link_costs = {}
+        for node in nodes:
+            targets = [x for x in nodes if x != node]
+            try:
+                if node == nodes[0]:
+                    link_costs[node] = self.probe_links(targets, self.probe_size, self.probe_rounds)
+                else:
+                    payload = {"targets": targets, "size": self.probe_size, "rounds": self.probe_rounds}
+                    response = self.task_manager.peers.post(f"{node}/probe_links", json=payload)
+                    response.raise_for_status()
+                    link_costs[node] = response.json()
+            except Exception as e:
+                print(f"Probing links from {node} failed: {str(e)}")
+
+        return link_costs
     
     def wait_for_master(self, master_url):
         print("Waiting on master node...")
@@ -54,27 +145,38 @@ class Server:
         self.is_master = False
 
         while True:
-            response = requests.get(f"{master_url}/")
-            if response.status_code == 200:
-                return True
+            try:
+                response = self.task_manager.peers.get(f"{master_url}/", retries=0)
+                if response.status_code == 200:
+                    return True
+            except requests.exceptions.ConnectionError:
+                pass
 
             time.sleep(1)
 
     def assign_shards(self, submodels, shard_graph):
+        """
+        Place the shards on the registered nodes, the master keeping one. Nodes beyond one per
+        shard run copies of the most expensive shards that can be replicated, see Orchestrator.
+        """
         if len(submodels) > self.world_size():
             raise Exception("Too many submodels for world size.")
         if len(submodels) == 0:
             raise Exception("No submodels included.")
         
         self.master_url = self.node.get_url(self.protocol)
+        self.task_manager.master_url = self.master_url
         self.is_master = True
 
         self.task_manager.clear_model()
         self.task_manager.clear_children()
 
+        self.node_replicas = self.get_node_replicas(self.registered_nodes)
+        print(f"Session replicas per node: {self.node_replicas}")
+
         parent_models = shard_graph.get_parent_nodes()
 
-        orchestrator = SimpleOrchestrator(submodels, shard_graph, self.registered_nodes)
+        orchestrator = self.make_orchestrator(submodels, shard_graph)
 
         own_model_id, assigned_models, assigned_nodes = orchestrator.get_assignments()
 
@@ -85,31 +187,240 @@ class Server:
                 assigned_nodes[x]: list(shard_graph.nodes[x].external_inputs) for x in parent_models
                 }
 
-        self.task_manager.model = submodels[own_model_id]
+        self.load_model(submodels[own_model_id].path)
 
-        for node, model_id in assigned_models.items():
-            url = f"{node}/model_assign"
-            with open(submodels[model_id].path, "rb") as file:
-                print(f"sending {submodels[model_id].path}")
-                requests.post(url, files={"file": (submodels[model_id].path, file, "application/octet-stream")})
+        # Upload every shard at once, each over its node's pooled connection
+        uploads = [
+            self.task_manager.peers.submit(node, self.upload_model, node, submodels[model_id])
+            for node, model_id in assigned_models.items()
+        ]
+        self.wait_for_requests(uploads)
         
+        # every copy of a replicated shard, its primary node first
+        model_nodes = lambda x: [assigned_nodes[x]] + orchestrator.replicas.get(x, [])
+
+        self.placement = {x: model_nodes(x) for x in range(len(submodels))}
+        self.predicted_transfer_time = getattr(orchestrator, "predicted_transfer_time", None)
+
         # update each node with their children, including the proper inputs
         for connection in shard_graph.nodes[own_model_id].connection_set:
             outputs = shard_graph.nodes[own_model_id].connection_labels[connection]
 
-            self.task_manager.children.append(assigned_nodes[connection.index])
-            self.task_manager.child_output_mappings[assigned_nodes[connection.index]] += outputs
+            edge_codec = shard_graph.nodes[own_model_id].edge_codecs.get(connection.index)
+            self.task_manager.add_child(assigned_nodes[connection.index], outputs, model_nodes(connection.index), edge_codec)
             
+        child_assignments = []
         for node_ip, model_id in assigned_models.items():
             for connection in shard_graph.nodes[model_id].connection_set:
                 outputs = shard_graph.nodes[model_id].connection_labels[connection]
-                url = f"{next_node}/child_assign"
-                requests.post(url, {"outputs": outputs, "host_ip": node_ip})
+                url = f"{node_ip}/child_assign"
+                payload = {
+                    "outputs": sorted(outputs),
+                    "host_ip": assigned_nodes[connection.index],
+                    "replicas": model_nodes(connection.index),
+                    "codec": shard_graph.nodes[model_id].edge_codecs.get(connection.index),
+                }
+                child_assignments.append(self.task_manager.peers.submit_request("POST", url, json=payload))
+        self.wait_for_requests(child_assignments)
+
+    def make_orchestrator(self, submodels, shard_graph):
+        if self.orchestrator == "capacity":
+            self.node_capabilities[self.master_url] = measure_capabilities()
+            return CapacityOrchestrator(submodels, shard_graph, self.registered_nodes, self.node_capabilities, self.master_url, self.node_replicas)
+        if self.orchestrator == "network":
+            return NetworkOrchestrator(submodels, shard_graph, self.registered_nodes, self.link_costs, self.master_url, self.node_replicas)
+        if self.orchestrator == "simple":
+            return SimpleOrchestrator(submodels, shard_graph, self.registered_nodes, self.node_replicas)
+
+        raise ValueError(f"Orchestrator {self.orchestrator} not supported")
+
+    def load_model(self, path):
+        model = PeriModel(path, session_config=self.session_config)
+        if self.warmup:
+            print(f"Warmed up {path} in {model.warmup():.3f}s")
+        self.task_manager.set_model(model)
+
+    def upload_model(self, node, model):
+        print(f"sending {model.path}")
+        return transfer.upload_model(self.task_manager.peers, node, model.path, model.get_external_data_files())
+
+    def get_model_path(self):
+        if self.model_path is None:
+            return self.task_manager.model.path
+        return self.model_path
+
+    def get_model_dir(self):
+        model_dir = os.path.dirname(os.path.realpath(self.get_model_path()))
+        os.makedirs(model_dir, exist_ok=True)
+        return model_dir
+
+    def wait_for_requests(self, futures):
+        for future in futures:
+            response = future.result()
+            if response.status_code != 200:
+                raise Exception(f"Request to {response.url} failed with status {response.status_code}")
+
+    def replica_info(self):
+        model = self.task_manager.model
+        return {
+            "replicas": self.session_config.replicas,
+            "intra_op_threads": self.session_config.replica_threads(),
+            "busy": model.busy_replicas() if model is not None else 0,
+        }
+
+    def get_node_replicas(self, nodes):
+        node_replicas = {self.node.get_url(self.protocol): self.session_config.replicas}
+        for node in nodes:
+            try:
+                response = self.task_manager.peers.get(f"{node}/replicas")
+                response.raise_for_status()
+                node_replicas[node] = response.json()["replicas"]
+            except Exception as e:
+                # nodes that predate /replicas run a single session
+                print(f"Reading replicas of {node} failed: {str(e)}")
+                node_replicas[node] = 1
+
+        return node_replicas
+
+    def profile_cluster(self, runs):
+        """
+        Profile every shard of the current placement on its primary node and gather the timings:
+        the median seconds per node name over all shards, and the measured time of each stage.
+        """
+        stage_nodes = {model_id: nodes[0] for model_id, nodes in self.placement.items()}
+
+        profiles = {
+            model_id: self.task_manager.peers.submit_request("POST", f"{node}/profile", json={"runs": runs}, timeout=None)
+            for model_id, node in stage_nodes.items() if node != self.master_url
+        }
+
+        node_times = {}
+        stage_times = {}
+        for model_id, node in stage_nodes.items():
+            if model_id in profiles:
+                response = profiles[model_id].result()
+                response.raise_for_status()
+                times = response.json()["node_times"]
+            else:
+                times = self.task_manager.model.profile_ops(runs)
+
+            node_times.update(times)
+            stage_times[model_id] = sum(times.values())
+            print(f"shard {model_id} on {node}: {stage_times[model_id] * 1000:.3g}ms of kernel time per inference")
+
+        self.op_profile = {"runs": runs, "node_times": node_times, "stage_times": stage_times}
+        return self.op_profile
+
+    def collect_trace(self, infer_id=None):
+        """
+        Gather the spans of every node (of one request, or all that nodes still hold) into a
+        Chrome trace / Perfetto timeline.
+        """
+        node_spans = {self.master_url or "local": self.task_manager.tracer.get_spans(infer_id)}
+        params = {"infer_id": infer_id} if infer_id is not None else {}
+        fetches = {node: self.task_manager.peers.submit_request("GET", f"{node}/spans", params=params) for node in self.registered_nodes}
+        for node, future in fetches.items():
+            try:
+                response = future.result()
+                response.raise_for_status()
+                node_spans[node] = response.json()
+            except Exception as e:
+                print(f"Reading spans of {node} failed: {str(e)}")
+
+        return tracing.to_chrome_trace(node_spans)
 
     def register_self(self, master_url):
         url = f"{master_url}/register_node"
         self.master_url = master_url
-        requests.post(url, json={"ip": self.node.get_url(self.protocol)})
+        self.task_manager.peers.post(url, json={"ip": self.node.get_url(self.protocol), "capabilities": measure_capabilities()})
+
+    async def read_tensors(self, request):
+        # Accept the binary tensor format, or the legacy npz multipart upload as a fallback
+        content_type = request.headers.get("content-type", "")
+
+        if content_type.startswith(wire.CONTENT_TYPE):
+            contents = await request.body()
+            decode = wire.decode_tensors
+            spec = request.headers.get(codec.CODEC_HEADER)
+            if spec is not None:
+                if not codec.can_decode(spec):
+                    # the sender falls back to plain tensors on a 415
+                    raise HTTPException(status_code=415, detail=f"Codec {spec} not supported")
+                decode = lambda x: codec.decode(x, spec)
+        elif content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            file = form.get("file")
+            if file is None or isinstance(file, str):
+                raise HTTPException(status_code=400, detail="Field 'file' missing")
+            contents = await file.read()
+            decode = wire.decode_npz
+        else:
+            raise HTTPException(status_code=415, detail=f"Unsupported content type {content_type}")
+
+        try:
+            with self.task_manager.stage_seconds.time(stage="decode"):
+                return decode(contents)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail="Malformed tensor upload")
+
+    def tensor_response(self, request, tensors, infer_id):
+        if wire.accepts_wire_format(request.headers.get("accept")):
+            # an async iterator is sent from the event loop, where a sync one would take a worker thread
+            async def frames():
+                for frame in wire.encode_tensors(tensors):
+                    yield frame
+
+            return StreamingResponse(frames(), media_type=wire.CONTENT_TYPE)
+
+        buffer, output_filename = wire.encode_npz(tensors), f"output_{infer_id}.npz"
+        return StreamingResponse(
+                buffer,
+                media_type=wire.NPZ_CONTENT_TYPE,
+                headers={
+                    "Content-Disposition": f"attachment; filename={output_filename}"
+                    }
+                )
+
+    async def final_output_events(self, wanted, include_data):
+        # An async generator, so that streams wait on the event loop rather than each holding a thread
+        subscriber = self.task_manager.subscribe_final_outputs()
+        try:
+            # Wanted outputs that landed before the subscription are sent first. Open-ended streams
+            # only carry outputs that land from now on, so they keep no per-id state.
+            pending = [] if wanted is None else [x for x in wanted if x in self.task_manager.final_outputs or x in self.task_manager.failed_requests]
+            sent = set()
+
+            while wanted is None or len(sent) < len(wanted):
+                if pending:
+                    infer_id = pending.pop(0)
+                else:
+                    try:
+                        infer_id = await asyncio.wait_for(subscriber.get(), self.stream_keepalive)
+                    except asyncio.TimeoutError:
+                        yield ": keepalive\n\n"
+                        continue
+
+                if wanted is not None:
+                    if infer_id in sent or infer_id not in wanted:
+                        continue
+                    sent.add(infer_id)
+
+                tensors = self.task_manager.final_outputs.get(infer_id)
+                reason = self.task_manager.failed_requests.get(infer_id)
+                if tensors is None and reason is not None:
+                    yield f"event: final_output_failed\nid: {infer_id}\ndata: {reason}\n\n"
+                    continue
+                if tensors is None:
+                    # expired or evicted before it could be streamed
+                    yield f"event: final_output_evicted\nid: {infer_id}\ndata: \n\n"
+                    continue
+
+                data = ""
+                if include_data:
+                    data = await run_in_threadpool(lambda: base64.b64encode(wire.pack_tensors(tensors)).decode())
+                yield f"event: final_output\nid: {infer_id}\ndata: {data}\n\n"
+        finally:
+            self.task_manager.unsubscribe_final_outputs(subscriber)
 
     def add_routes(self):
         @self.app.get("/")
@@ -123,12 +434,63 @@ class Server:
                 raise HTTPException(status_code=400, detail="Only .onnx files are allowed.")
 
             try:
-                with open(self.task_manager.model.path, "wb") as f:
-                    f.write(await file.read())
+                with open(self.get_model_path(), "wb") as f:
+                    shutil.copyfileobj(file.file, f, transfer.CHUNK_SIZE)
                 return {"message": f"ONNX model saved as {file.filename}"}
             except Exception as e:
                 raise HTTPException(status_code=400, detail=f"Request failed (Internal Server Error)")
 
+        @self.app.get("/model_chunk/{filename}")
+        async def model_chunk_status(filename: str):
+            path = transfer.part_path(self.get_model_dir(), filename)
+            return {"received": os.path.getsize(path) if os.path.exists(path) else 0}
+
+        @self.app.post("/model_chunk/{filename}")
+        async def model_chunk(request: Request, filename: str, offset: int):
+            # Chunks are appended in order; offset 0 restarts the file
+            path = transfer.part_path(self.get_model_dir(), filename)
+            received = os.path.getsize(path) if os.path.exists(path) else 0
+
+            if offset != 0 and offset != received:
+                raise HTTPException(status_code=409, detail={"received": received})
+
+            with open(path, "wb" if offset == 0 else "ab") as f:
+                async for chunk in request.stream():
+                    f.write(chunk)
+
+            return {"received": os.path.getsize(path)}
+
+        @self.app.post("/model_commit")
+        async def model_commit(request: Request):
+            data = await request.json()
+            model_dir = self.get_model_dir()
+
+            # Check every file before installing any of them
+            for entry in data["files"]:
+                path = transfer.part_path(model_dir, entry["name"])
+                if entry["size"] == 0 and not os.path.exists(path):
+                    open(path, "wb").close()
+
+                if not os.path.exists(path) or os.path.getsize(path) != entry["size"] or await run_in_threadpool(transfer.file_sha256, path) != entry["sha256"]:
+                    for x in data["files"]:
+                        pathlib.Path(transfer.part_path(model_dir, x["name"])).unlink(missing_ok=True)
+                    raise HTTPException(status_code=400, detail=f"Checksum mismatch for {entry['name']}")
+
+            for entry in data["files"]:
+                name = os.path.basename(entry["name"])
+                # the model takes this node's model path; external data keeps its name, as the model refers to it
+                destination = self.get_model_path() if name == os.path.basename(data["model"]) else os.path.join(model_dir, name)
+                os.replace(transfer.part_path(model_dir, name), destination)
+
+            try:
+                # Only returns once the model is warm, so the master's first requests run at full speed
+                await run_in_threadpool(self.load_model, self.get_model_path())
+            except Exception as e:
+                print(f"Loading model failed: {str(e)}")
+                raise HTTPException(status_code=500, detail="Model could not be loaded")
+
+            return {"message": f"Model installed as {self.get_model_path()}"}
+
         @self.app.post("/child_assign")
         async def assign_child(request: Request):
             data = await request.json()
@@ -136,8 +498,10 @@ class Server:
             outputs = data.get("outputs")
             host_ip = data.get("host_ip")
 
-            self.task_manager.children.append(host_ip)
-            self.task_manager.child_output_mappings[host_ip] += outputs
+            try:
+                self.task_manager.add_child(host_ip, outputs, data.get("replicas"), data.get("codec"))
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
 
         @self.app.post("/register_node")
         async def register_node(request: Request):
@@ -149,26 +513,33 @@ class Server:
                 raise HTTPException(status_code=400, detail=f"Field 'ip' missing")
 
             self.registered_nodes.append(node_address)
+            if data.get("capabilities"):
+                self.node_capabilities[node_address] = data["capabilities"]
             with self.registration_condition:
                 self.registration_condition.notify()
 
             return {"message": "Node registered successfully"}
 
         @self.app.post("/submit_input/{infer_id}")
-        async def submit_input(background_tasks: BackgroundTasks, infer_id: int, file: UploadFile = File(...)):
-            try:
-                contents = await file.read()
-
-                flo = io.BytesIO(contents)
-
-                with np.load(flo) as np_contents:
-                    data = {k: np_contents[k] for k in np_contents}
+        async def submit_input(request: Request, background_tasks: BackgroundTasks, infer_id: int):
+            start = time.time()
+            self.task_manager.tracer.begin(infer_id, request.headers.get(tracing.TRACE_HEADER))
+            data = await self.read_tensors(request)
 
+            try:
                 self.task_manager.submit_input(data, infer_id)
-                
-                background_tasks.add_task(self.task_manager.check_for_completion)
+            except QueueFullError as e:
+                raise HTTPException(status_code=503, detail=f"Node is overloaded: {str(e)}", headers={"Retry-After": str(self.retry_after)})
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"Request failed (Internal Server Error)")
+            self.task_manager.tracer.record(infer_id, "receive", start, time.time(), inputs=sorted(data))
+
+            # Without worker threads, inference runs after the response is sent
+            if not self.task_manager.is_running():
+                background_tasks.add_task(self.task_manager.check_for_completion)
+
+            # lets senders routing between replicas of this shard pick the least loaded one
+            return {"pending": self.task_manager.pending_requests()}
 
         @self.app.get("/inputs")
         async def get_inputs():
@@ -179,35 +550,39 @@ class Server:
                     } for x in self.task_manager.model.get_inputs()]
 
         @self.app.get("/output/{infer_id}")
-        async def output(infer_id: int):
-            if infer_id not in self.task_manager.outputs:
+        async def output(request: Request, infer_id: int):
+            # a single lookup, as the output may be dropped at any time
+            tensors = self.task_manager.outputs.get(infer_id)
+            if tensors is None:
                 if infer_id not in self.task_manager.input_requests:
                     raise HTTPException(status_code=404, detail=f"Inference id {infer_id} not found")
                 else:
                     raise HTTPException(status_code=202, detail=f"Inference id {infer_id} is still processing...")
 
             try:
-                buffer, output_filename = self.task_manager.get_buffer(infer_id)
-                return StreamingResponse(
-                        buffer,
-                        media_type="application/octet-stream",
-                        headers={
-                            "Content-Disposition": f"attachment; filename={output_filename}"
-                            }
-                        )
+                return self.tensor_response(request, tensors, infer_id)
             except Exception as e:
                 print(f"found exception... {str(e)}")
                 raise HTTPException(status_code=500, detail=f"Request failed (Internal Server Error)")
 
 
         @self.app.get("/final_output/{infer_id}")
-        async def final_output(infer_id: int):
+        async def final_output(request: Request, infer_id: int, timeout: float = 0):
+            # A positive timeout long-polls: the request is held until the output lands or timeout passes
+            timeout = min(max(timeout, 0), self.max_poll_timeout)
+
             if not self.is_master:
+                if timeout > 0:
+                    # Forwarded, a long-poll would hold one of the few connections to the master that
+                    # this node also sends its results over, so the client waits on the master instead
+                    return RedirectResponse(f"{self.master_url}/final_output/{infer_id}?timeout={timeout}")
+
                 # If we aren't the master node, forward it on to the master node as apppropriate.
                 url = f"{self.master_url}/final_output/{infer_id}"
 
                 try:
-                    response = requests.get(url, stream=True)
+                    headers = {"Accept": request.headers.get("accept", "*/*")}
+                    response = await run_in_threadpool(self.task_manager.peers.get, url, headers=headers, timeout=30, retries=0)
                     if response.status_code == 202:
                         raise HTTPException(status_code=202, detail=response.json().get("detail"))
                     elif response.status_code == 500:
@@ -216,44 +591,119 @@ class Server:
                         # Pass through the response
                         headers = {
                             "Content-Disposition": response.headers.get("Content-Disposition", ""),
-                            "Content-Type": response.headers.get("Content-Type", "application/octet-stream")
+                            "Content-Type": response.headers.get("Content-Type", wire.NPZ_CONTENT_TYPE)
                         }
-                        return StreamingResponse(BytesIO(response.content), headers=headers)
+                        return StreamingResponse(io.BytesIO(response.content), headers=headers)
                     else:
                         raise HTTPException(status_code=response.status_code, detail="Unexpected response from master node")
                 except requests.exceptions.RequestException as e:
                     print(f"Error forwarding request to master node: {e}")
                     raise HTTPException(status_code=500, detail="Failed to forward request to master node")
 
-            if infer_id not in self.task_manager.final_outputs:
+            if timeout > 0:
+                await self.task_manager.wait_for_final_output(infer_id, timeout)
+
+            tensors = self.task_manager.final_outputs.get(infer_id)
+            if tensors is None:
+                reason = self.task_manager.failed_requests.get(infer_id)
+                if reason is not None:
+                    raise HTTPException(status_code=500, detail=f"Inference id {infer_id} failed: {reason}")
                 raise HTTPException(status_code=202, detail=f"Inference id {infer_id} is still processing...")
 
             try:
-                buffer, output_filename = self.task_manager.get_final_output_buffer(infer_id)
-                return StreamingResponse(
-                        buffer,
-                        media_type="application/octet-stream",
-                        headers={
-                            "Content-Disposition": f"attachment; filename={output_filename}"
-                            }
-                        )
+                return self.tensor_response(request, tensors, infer_id)
             except Exception as e:
                 print(f"found exception... {str(e)}")
                 raise HTTPException(status_code=500, detail=f"Request failed (Internal Server Error)")
 
         @self.app.post("/final_output/{infer_id}")
-        async def submit_input(infer_id: int, file: UploadFile = File(...)):
+        async def submit_final_output(request: Request, infer_id: int):
+            start = time.time()
+            tracer = self.task_manager.tracer
+            tracer.begin(infer_id, request.headers.get(tracing.TRACE_HEADER))
+            data = await self.read_tensors(request)
+
+            try:
+                self.task_manager.set_final_output(infer_id, data)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Request failed (Internal Server Error)")
+
+            tracer.record(infer_id, "final_output", start, time.time())
+            if infer_id not in self.task_manager.input_requests:
+                tracer.end(infer_id)
+
+        @self.app.post("/failed_request/{infer_id}")
+        async def failed_request(request: Request, infer_id: int):
+            # A node dropped the request, see TaskManager.report_failure
+            data = await request.json()
+            self.task_manager.set_failed(infer_id, data.get("reason", "unknown"))
+
+        @self.app.get("/final_output_stream")
+        async def final_output_stream(ids: Optional[str] = None, include_data: bool = True):
+            # Server-sent events, one per final output. With ids, the stream ends once all of them
+            # are sent; without, it carries every final output from the moment it is opened.
+            if not self.is_master:
+                query = f"?ids={ids}&include_data={str(include_data).lower()}" if ids else f"?include_data={str(include_data).lower()}"
+                return RedirectResponse(f"{self.master_url}/final_output_stream{query}")
+
             try:
-                contents = await file.read()
+                wanted = None if ids is None else {int(x) for x in ids.split(",") if x}
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Field 'ids' must be a comma separated list of integers")
+
+            return StreamingResponse(self.final_output_events(wanted, include_data), media_type="text/event-stream")
 
-                flo = io.BytesIO(contents)
+        @self.app.get("/replicas")
+        async def get_replicas():
+            return self.replica_info()
 
-                with np.load(flo) as np_contents:
-                    data = {k: np_contents[k] for k in np_contents}
+        @self.app.post("/probe_payload")
+        async def probe_payload(request: Request):
+            received = 0
+            async for chunk in request.stream():
+                received += len(chunk)
+            return {"received": received}
 
-                self.task_manager.final_outputs[infer_id] = data
+        @self.app.post("/probe_links")
+        async def probe_links(request: Request):
+            data = await request.json()
+            try:
+                return await run_in_threadpool(self.probe_links, data["targets"], data.get("size", self.probe_size), data.get("rounds", self.probe_rounds))
             except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Request failed (Internal Server Error)")
+                raise HTTPException(status_code=502, detail=f"Probing failed: {str(e)}")
+
+        @self.app.get("/network")
+        async def network():
+            return {
+                "links": self.link_costs,
+                "placement": self.placement,
+                "predicted_transfer_time": self.predicted_transfer_time,
+            }
+
+        @self.app.post("/profile")
+        async def profile(request: Request):
+            data = await request.json()
+            if self.task_manager.model is None:
+                raise HTTPException(status_code=409, detail="No model assigned")
+
+            node_times = await run_in_threadpool(self.task_manager.model.profile_ops, data.get("runs", 10))
+            return {"node_times": node_times}
+
+        @self.app.get("/op_profile")
+        async def op_profile():
+            return self.op_profile
+
+        @self.app.get("/metrics")
+        async def metrics():
+            return PlainTextResponse(self.task_manager.metrics.render(), media_type="text/plain; version=0.0.4")
+
+        @self.app.get("/spans")
+        async def spans(infer_id: Optional[int] = None):
+            return self.task_manager.tracer.get_spans(infer_id)
+
+        @self.app.get("/trace")
+        async def trace(infer_id: Optional[int] = None):
+            return await run_in_threadpool(self.collect_trace, infer_id)
 
         @self.app.get("/parents")
         async def get_parents():
@@ -274,6 +724,8 @@ class Server:
         signal.signal(signal.SIGTERM, self.stop)
 
     def stop(self, sig=None, frame=None):
+        self.task_manager.stop()
+
         if self.server_thread and self.server_thread.is_alive():
             parent_pid = os.getpid()
             parent = psutil.Process(parent_pid)
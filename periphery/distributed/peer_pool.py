@@ -0,0 +1,122 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import threading
+import time
+
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+class PeerPool:
+    """
+    Keep-alive HTTP connections to every peer node, with bounded retries and per-peer concurrency.
+
+    Each peer gets its own requests.Session (so connections are reused) and its own small executor,
+    sized to the in-flight limit, so work queued for a slow peer never holds up other peers.
+    """
+    def __init__(self, max_in_flight=4, retries=3, backoff=0.05, max_backoff=2.0, timeout=60):
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+        self.sessions = {}
+        self.executors = {}
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def peer_of(url):
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def get_peer(self, peer):
+        with self.lock:
+            if peer not in self.sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+
+                self.sessions[peer] = session
+                self.executors[peer] = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix=f"peer-{peer}")
+                self.in_flight[peer] = threading.BoundedSemaphore(self.max_in_flight)
+
+            return self.sessions[peer], self.executors[peer], self.in_flight[peer]
+
+    def retry_delay(self, attempt, response=None):
+        delay = self.backoff * (2 ** attempt)
+
+        if response is not None and "Retry-After" in response.headers:
+            try:
+                delay = float(response.headers["Retry-After"])
+            except ValueError:
+                pass
+
+        return min(delay, self.max_backoff)
+
+    @staticmethod
+    def rewind(kwargs):
+        # Uploads are re-read on every attempt, so file-like bodies go back to the start
+        files = kwargs.get("files") or {}
+        for value in list(files.values()) + [kwargs.get("data")]:
+            body = value[1] if isinstance(value, tuple) else value
+            if hasattr(body, "seek"):
+                body.seek(0)
+
+    def request(self, method, url, retries=None, **kwargs):
+        """
+        Send a request to a peer over its pooled session, retrying failed connections and
+        overloaded (429/502/503/504) responses with capped exponential backoff.
+        """
+        if retries is None:
+            retries = self.retries
+        kwargs.setdefault("timeout", self.timeout)
+
+        session, _, in_flight = self.get_peer(self.peer_of(url))
+
+        attempt = 0
+        while True:
+            response = None
+            try:
+                with in_flight:
+                    response = session.request(method, url, **kwargs)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= retries:
+                    return response
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt >= retries:
+                    raise
+
+            time.sleep(self.retry_delay(attempt, response))
+            self.rewind(kwargs)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def submit(self, url, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) on the executor of the peer owning url, returning a Future.
+        """
+        _, executor, _ = self.get_peer(self.peer_of(url))
+        return executor.submit(fn, *args, **kwargs)
+
+    def submit_request(self, method, url, **kwargs):
+        return self.submit(url, self.request, method, url, **kwargs)
+
+    def close(self):
+        with self.lock:
+            for executor in self.executors.values():
+                executor.shutdown(wait=False)
+            for session in self.sessions.values():
+                session.close()
+
+            self.sessions = {}
+            self.executors = {}
+            self.in_flight = {}
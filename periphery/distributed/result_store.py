@@ -0,0 +1,186 @@
+import collections
+import collections.abc
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+class Entry:
+    def __init__(self, tensors, pinned):
+        self.tensors = tensors
+        self.nbytes = sum(getattr(x, "nbytes", 0) for x in tensors.values())
+        self.created = time.monotonic()
+        self.pinned = pinned
+        # directory holding the tensors once spilled to disk
+        self.spill_dir = None
+
+class ResultStore(collections.abc.MutableMapping):
+    """
+    Tensor dicts per infer_id, kept within a memory budget.
+
+    Used like a dict. Entries older than ttl seconds expire. While the tensors in memory exceed
+    max_bytes, the least recently used entries are spilled to .npy files under spill_dir (and read
+    back memory-mapped), or evicted without a spill_dir; spilled entries are in turn evicted
+    beyond max_spill_bytes. Pinned entries (e.g. outputs still being sent) are never spilled or
+    evicted. Evictions, expirations and spills are counted.
+    """
+    def __init__(self, max_bytes=None, ttl=None, spill_dir=None, max_spill_bytes=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+
+        self.entries = collections.OrderedDict()
+        self.lock = threading.RLock()
+
+        # bytes of tensors in memory, and in spill files
+        self.nbytes = 0
+        self.spilled_bytes = 0
+
+        self.evictions = 0
+        self.expirations = 0
+        self.spills = 0
+
+        # expired entries are looked for at most this often, as that scans every entry
+        self.expiry_interval = 1.0
+        self.last_expiry = time.monotonic()
+
+    def configure(self, max_bytes=None, ttl=None, spill_dir=None, max_spill_bytes=None):
+        with self.lock:
+            if spill_dir is not None and spill_dir != self.spill_dir:
+                # spill files left by a process that didn't exit cleanly belong to no entry
+                shutil.rmtree(spill_dir, ignore_errors=True)
+
+            self.max_bytes = max_bytes
+            self.ttl = ttl
+            self.spill_dir = spill_dir
+            self.max_spill_bytes = max_spill_bytes
+            self.enforce()
+
+    def put(self, key, tensors, pinned=False):
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+
+            entry = Entry(tensors, pinned)
+            self.entries[key] = entry
+            self.nbytes += entry.nbytes
+            self.enforce()
+
+    def unpin(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries[key].pinned = False
+                self.enforce()
+
+    def expired(self, entry):
+        return self.ttl is not None and not entry.pinned and time.monotonic() - entry.created > self.ttl
+
+    def __setitem__(self, key, tensors):
+        self.put(key, tensors)
+
+    def __getitem__(self, key):
+        with self.lock:
+            entry = self.entries[key]
+            if self.expired(entry):
+                self.remove(key)
+                self.expirations += 1
+                raise KeyError(key)
+
+            self.entries.move_to_end(key)
+            return entry.tensors
+
+    def __contains__(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and not self.expired(entry)
+
+    def __delitem__(self, key):
+        with self.lock:
+            if key not in self.entries:
+                raise KeyError(key)
+            self.remove(key)
+
+    def pop(self, key, *default):
+        with self.lock:
+            if key not in self.entries:
+                if default:
+                    return default[0]
+                raise KeyError(key)
+
+            tensors = self.entries[key].tensors
+            self.remove(key)
+            return tensors
+
+    def __iter__(self):
+        with self.lock:
+            return iter([key for key, entry in self.entries.items() if not self.expired(entry)])
+
+    def __len__(self):
+        # like iteration, expired entries that are yet to be dropped don't count
+        with self.lock:
+            return sum(1 for entry in self.entries.values() if not self.expired(entry))
+
+    def remove(self, key):
+        entry = self.entries.pop(key)
+        if entry.spill_dir is None:
+            self.nbytes -= entry.nbytes
+        else:
+            self.spilled_bytes -= entry.nbytes
+            shutil.rmtree(entry.spill_dir, ignore_errors=True)
+
+    def spill(self, key):
+        # Returns False for tensors that can't be memory-mapped, such as object arrays
+        entry = self.entries[key]
+        if not all(isinstance(x, np.ndarray) and not x.dtype.hasobject for x in entry.tensors.values()):
+            return False
+
+        os.makedirs(self.spill_dir, exist_ok=True)
+        spill_dir = tempfile.mkdtemp(prefix=f"{key}_", dir=self.spill_dir)
+        tensors = {}
+        for i, (name, tensor) in enumerate(entry.tensors.items()):
+            path = os.path.join(spill_dir, f"{i}.npy")
+            np.save(path, tensor)
+            tensors[name] = np.load(path, mmap_mode="r")
+
+        entry.tensors = tensors
+        entry.spill_dir = spill_dir
+        self.nbytes -= entry.nbytes
+        self.spilled_bytes += entry.nbytes
+        self.spills += 1
+        return True
+
+    def enforce(self):
+        # Least recently used first: drop the expired entries, then spill or evict until within budget
+        if self.ttl is not None and time.monotonic() - self.last_expiry > self.expiry_interval:
+            self.last_expiry = time.monotonic()
+            for key, entry in list(self.entries.items()):
+                if self.expired(entry):
+                    self.remove(key)
+                    self.expirations += 1
+
+        if self.max_bytes is not None and self.nbytes > self.max_bytes:
+            for key, entry in list(self.entries.items()):
+                if self.nbytes <= self.max_bytes:
+                    break
+                if entry.pinned or entry.spill_dir is not None:
+                    continue
+                if self.spill_dir is None or not self.spill(key):
+                    self.remove(key)
+                    self.evictions += 1
+
+        if self.max_spill_bytes is not None and self.spilled_bytes > self.max_spill_bytes:
+            for key, entry in list(self.entries.items()):
+                if self.spilled_bytes <= self.max_spill_bytes:
+                    break
+                if entry.spill_dir is not None:
+                    self.remove(key)
+                    self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries):
+                self.remove(key)
@@ -1,90 +1,622 @@
 from io import BytesIO
 import numpy as np
 
-import requests
+import asyncio
 import collections
+import os
+import queue
+import threading
+import time
+
+from periphery.distributed.peer_pool import PeerPool
+from periphery.distributed.result_store import ResultStore
+from periphery.model.model import BoundOutputs
+from periphery.utils import wire
+from periphery.utils.codec import Codec
+from periphery.utils.metrics import Registry
+from periphery.utils.tracing import Tracer
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+def held_bytes(store):
+    # bytes of the arrays held in a dict of tensor dicts
+    return sum(getattr(x, "nbytes", 0) for tensors in list(store.values()) for x in list(tensors.values()))
+
+def notify(loop, callback, *args):
+    # Run callback on an event loop from any thread; a loop that has since closed has no one to wake
+    try:
+        loop.call_soon_threadsafe(callback, *args)
+    except RuntimeError:
+        pass
+
+def resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+class QueueFullError(Exception):
+    pass
 
 class TaskManager:
-    def __init__(self, model=None):
+    def __init__(self, model=None, max_batch_size=1, max_batch_wait=0.0, max_queue_size=64):
         self.model = model
         self.input_requests = {}
-        self.outputs = {}
-        self.final_outputs = {}
+        # Outputs stay pinned until sent, and are dropped once every child acknowledged them
+        self.outputs = ResultStore()
+        self.final_outputs = ResultStore()
+
+        # Result delivery, awaited on the server's event loop so that waiting holds no thread: the
+        # futures of the long-polls awaiting each infer_id, and an asyncio queue per subscriber
+        # that is pushed every infer_id as its final output lands. Both are paired with their loop,
+        # as outputs land from any thread.
+        self.final_output_lock = threading.Lock()
+        self.final_output_waiters = {}
+        self.final_output_subscribers = []
+        # Why each request failed, for the most recent max_failed_requests, so that clients
+        # waiting on them are answered instead of timing out
+        self.failed_requests = collections.OrderedDict()
+        self.max_failed_requests = 10000
+
+        # Micro-batching: ready requests are gathered for up to max_batch_wait seconds
+        # (or until max_batch_size are ready) and run through the model in one call.
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait = max_batch_wait
+        self.batch_condition = threading.Condition()
+        self.collecting_batch = False
+
+        # Readiness index: inputs still missing per pending request, and requests ready to run
+        self.missing_inputs = {}
+        self.ready_ids = collections.deque()
+        # When (wall clock) each pending request got its first input, and when it became ready
+        self.arrival_times = {}
+        self.ready_times = {}
+        # Seconds a request may wait for its remaining inputs, e.g. after a parent's send failed,
+        # before it is dropped and reported as failed
+        self.pending_timeout = 60.0
+
+        # Pipeline stages: inference workers take ready requests, while sender threads ship
+        # finished ones downstream. New requests are refused once max_queue_size are pending.
+        self.max_queue_size = max_queue_size
+        self.send_queue = queue.Queue(maxsize=max_queue_size)
+        self.workers = []
+        self.senders = []
+        self.stopping = False
 
         if model is None:
             self.input_names = []
         else:
             self.input_names = [x.name for x in self.model.get_inputs()]
+        self.input_name_set = set(self.input_names)
 
         self.children = []
         self.child_output_mappings = collections.defaultdict(list)
         self.master_url = None
 
+        # Replicated children: every copy per child url. Each request goes to the copy with the
+        # fewest outstanding requests, i.e. sends in flight plus the queue it last reported.
+        self.child_replicas = {}
+        self.replica_pending = {}
+        self.replica_in_flight = collections.Counter()
+        self.routed = 0
+        self.routing_lock = threading.Lock()
+
+        # Codec per child url (and replica) whose edge sends compressed or reduced precision tensors
+        self.edge_codecs = {}
+
+        # Peers that rejected the binary tensor format, and get npz uploads instead.
+        self.npz_peers = set()
+        self.peers = PeerPool()
+
         self.output_names = ["output"]
 
+        self.setup_metrics()
+        self.tracer = Tracer()
+
+    def setup_metrics(self):
+        """
+        Register the node's metrics, served by the /metrics route: seconds per request in every
+        stage (decode of uploads, wait for missing inputs, queue, run, encode and send of outputs),
+        request counts, queue depths, and bytes held in the request and output stores.
+        """
+        self.metrics = Registry()
+        self.stage_seconds = self.metrics.histogram("periphery_stage_seconds", "Seconds spent in each stage of the pipeline.", ["stage"])
+        self.batch_size = self.metrics.histogram("periphery_batch_size", "Requests per model run.", buckets=BATCH_SIZE_BUCKETS)
+        self.requests_total = self.metrics.counter("periphery_requests_total", "Requests per pipeline event.", ["event"])
+        self.sent_bytes = self.metrics.counter("periphery_sent_bytes_total", "Tensor bytes sent to other nodes.")
+        self.codec_bytes = self.metrics.counter("periphery_codec_bytes_total", "Tensor bytes sent over edges with a codec, before and after encoding.", ["codec", "stage"])
+
+        queue_depth = self.metrics.gauge("periphery_queue_depth", "Requests waiting in each queue.", ["queue"])
+        queue_depth.set_function(lambda: len(self.input_requests), queue="pending")
+        queue_depth.set_function(lambda: len(self.ready_ids), queue="ready")
+        queue_depth.set_function(lambda: self.send_queue.qsize(), queue="send")
+
+        memory = self.metrics.gauge("periphery_held_bytes", "Bytes of tensors held per store.", ["store"])
+        memory.set_function(lambda: held_bytes(self.input_requests), store="input_requests")
+        spilled = self.metrics.gauge("periphery_spilled_bytes", "Bytes of tensors spilled to disk per store.", ["store"])
+        evictions = self.metrics.counter("periphery_store_evictions_total", "Entries dropped from a store before being read, by reason.", ["store", "reason"])
+        spills = self.metrics.counter("periphery_store_spills_total", "Entries spilled to disk per store.", ["store"])
+        for name in ("outputs", "final_outputs"):
+            store = getattr(self, name)
+            memory.set_function(lambda store=store: store.nbytes, store=name)
+            spilled.set_function(lambda store=store: store.spilled_bytes, store=name)
+            evictions.set_function(lambda store=store: store.evictions, store=name, reason="budget")
+            evictions.set_function(lambda store=store: store.expirations, store=name, reason="ttl")
+            spills.set_function(lambda store=store: store.spills, store=name)
+
+        busy = self.metrics.gauge("periphery_busy_replicas", "Session replicas running a request.")
+        busy.set_function(lambda: self.model.busy_replicas() if self.model is not None else 0)
+
     def clear_model(self):
         self.model = None
 
     def set_model(self, model):
         self.model = model
         self.input_names = [x.name for x in self.model.get_inputs()]
+        self.input_name_set = set(self.input_names)
+
+    def set_batching(self, max_batch_size, max_batch_wait):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1.")
+
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait = max_batch_wait
+
+    def set_queue_size(self, max_queue_size):
+        if self.is_running():
+            raise Exception("Can't resize the queues of a running TaskManager.")
+
+        self.max_queue_size = max_queue_size
+        self.send_queue = queue.Queue(maxsize=max_queue_size)
+
+    def set_result_limits(self, max_output_bytes=None, max_final_output_bytes=None, final_output_ttl=None, spill_dir=None, max_spill_bytes=None):
+        """
+        Bound the memory of stored outputs: intermediates that children didn't acknowledge and
+        final outputs are spilled to spill_dir, or dropped without one, least recently used first
+        once over budget. Spilled intermediates, and spilled final outputs, are each dropped beyond
+        max_spill_bytes. Final outputs also expire after final_output_ttl seconds.
+
+        Spill files already in spill_dir, left by an earlier process, are removed.
+        """
+        self.outputs.configure(max_bytes=max_output_bytes, spill_dir=spill_dir and os.path.join(spill_dir, "outputs"), max_spill_bytes=max_spill_bytes)
+        self.final_outputs.configure(max_bytes=max_final_output_bytes, ttl=final_output_ttl, spill_dir=spill_dir and os.path.join(spill_dir, "final_outputs"), max_spill_bytes=max_spill_bytes)
+
+    def batching_enabled(self):
+        return self.max_batch_size > 1
 
     def clear_children(self):
         self.children = []
         self.child_output_mappings = collections.defaultdict(list)
+        self.child_replicas = {}
+        self.edge_codecs = {}
+
+    def add_child(self, child, outputs, replicas=None, codec=None):
+        self.children.append(child)
+        self.child_output_mappings[child] += outputs
+        if replicas and len(replicas) > 1:
+            self.child_replicas[child] = list(replicas)
+
+        codec = Codec(codec) if codec else None
+        if codec is not None and not codec.is_identity():
+            for url in [child] + list(replicas or []):
+                self.edge_codecs[url] = codec
+
+    def route(self, child):
+        # The copy of child that receives the next request
+        replicas = self.child_replicas.get(child)
+        if not replicas:
+            return child
+
+        with self.routing_lock:
+            # ties go round robin
+            self.routed += 1
+            start = self.routed % len(replicas)
+            candidates = replicas[start:] + replicas[:start]
+            target = min(candidates, key=lambda x: self.replica_in_flight[x] + self.replica_pending.get(x, 0))
+            self.replica_in_flight[target] += 1
+
+        return target
+
+    def pending_requests(self):
+        return len(self.input_requests) + self.send_queue.qsize()
 
     def submit_input(self, input_tensors, infer_id):
-        if infer_id in input_tensors:
-            self.input_requests[infer_id].update(input_tensors)
-        else:
-            self.input_requests[infer_id] = input_tensors
+        """
+        Store the given input tensors for infer_id, queueing the request once its last input arrives.
 
-    def check_for_completion(self):
-        to_remove = set()
-        for infer_id in self.input_requests.keys():
-            for iname in self.input_names:
-                if iname not in self.input_requests[infer_id]:
-                    return
-
-            self.outputs[infer_id] = self.model.infer(self.input_requests[infer_id])
-            self.send_to_children(infer_id, self.children, self.child_output_mappings)
-            self.update_master(infer_id)
-            to_remove.add(infer_id)
-
-        for infer_id in to_remove:
+        missing_inputs counts down the inputs each request still needs, so readiness is decided in
+        constant time, without rescanning other pending requests. Raises QueueFullError instead of
+        accepting a new infer_id while max_queue_size requests are already pending. Requests missing
+        inputs for over pending_timeout seconds are dropped first, so they can't fill the queue for good.
+        """
+        stale = []
+        with self.batch_condition:
+            if infer_id not in self.input_requests:
+                stale = self.drop_stale_requests()
+                if len(self.input_requests) >= self.max_queue_size:
+                    raise QueueFullError(f"{len(self.input_requests)} requests already pending.")
+
+                self.input_requests[infer_id] = {}
+                self.missing_inputs[infer_id] = len(self.input_names)
+                self.arrival_times[infer_id] = time.time()
+                self.requests_total.inc(event="received")
+                was_ready = False
+            else:
+                was_ready = self.missing_inputs[infer_id] == 0
+
+            request = self.input_requests[infer_id]
+            for name, tensor in input_tensors.items():
+                if name in self.input_name_set and name not in request:
+                    self.missing_inputs[infer_id] -= 1
+                request[name] = tensor
+
+            if not was_ready and self.missing_inputs[infer_id] == 0:
+                now = time.time()
+                arrival = self.arrival_times.pop(infer_id, now)
+                self.stage_seconds.observe(now - arrival, stage="wait_inputs")
+                self.tracer.record(infer_id, "wait_inputs", arrival, now)
+                self.ready_times[infer_id] = now
+                self.ready_ids.append(infer_id)
+                self.batch_condition.notify_all()
+
+        if stale:
+            self.report_failure(stale, f"Inputs missing after {self.pending_timeout}s")
+
+    def drop_stale_requests(self):
+        # arrival_times only holds requests still missing inputs, oldest first, so this stops at the
+        # first that isn't stale. Called with batch_condition held; returns the dropped ids.
+        stale = []
+        cutoff = time.time() - self.pending_timeout
+        for infer_id, arrival in list(self.arrival_times.items()):
+            if arrival > cutoff:
+                break
+            del self.arrival_times[infer_id]
+            del self.missing_inputs[infer_id]
             del self.input_requests[infer_id]
+            stale.append(infer_id)
 
-    def get_buffer(self, infer_id):
-        buffer = BytesIO()
-        np.savez(buffer, **self.outputs[infer_id])
-        buffer.seek(0)
+        return stale
 
-        return buffer, f"output_{infer_id}.npz"
+    def pop_ready(self, limit):
+        ready = []
+        now = time.time()
+        while self.ready_ids and len(ready) < limit:
+            infer_id = self.ready_ids.popleft()
+            del self.missing_inputs[infer_id]
+            ready_at = self.ready_times.pop(infer_id, now)
+            self.stage_seconds.observe(now - ready_at, stage="queue")
+            self.tracer.record(infer_id, "queue", ready_at, now)
+            ready.append((infer_id, self.input_requests.pop(infer_id)))
 
-    def get_final_output_buffer(self, infer_id):
-        buffer = BytesIO()
-        np.savez(buffer, **self.final_outputs[infer_id])
-        buffer.seek(0)
+        return ready
+
+    def collect_batch(self, block=False):
+        """
+        Pop up to max_batch_size ready requests, waiting up to max_batch_wait for the batch to fill.
 
-        return buffer, f"output_{infer_id}.npz"
+        Only one caller collects at a time. Other callers return immediately, or with block=True
+        wait until the collecting caller is done and requests are ready (or the manager stops).
+        """
+        with self.batch_condition:
+            while block and not self.stopping and (self.collecting_batch or not self.ready_ids):
+                self.batch_condition.wait()
+
+            if self.collecting_batch or self.stopping:
+                return []
+
+            batch = self.pop_ready(self.max_batch_size)
+            if self.batching_enabled() and 0 < len(batch) < self.max_batch_size:
+                self.collecting_batch = True
+                deadline = time.monotonic() + self.max_batch_wait
+
+                while len(batch) < self.max_batch_size and not self.stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.batch_condition.wait(remaining)
+                    batch += self.pop_ready(self.max_batch_size - len(batch))
+
+                self.collecting_batch = False
+                self.batch_condition.notify_all()
+
+            return batch
+
+    def check_for_completion(self):
+        while True:
+            batch = self.collect_batch()
+            if not batch:
+                return
+
+            if not self.try_run_batch(batch):
+                continue
+            for infer_id, _ in batch:
+                self.forward(infer_id)
+
+    def run_batch(self, batch):
+        self.batch_size.observe(len(batch))
+        start = time.time()
+        if len(batch) > 1:
+            batch_outputs = self.model.infer_batch([tensors for _, tensors in batch])
+        else:
+            batch_outputs = [self.model.infer(tensors) for _, tensors in batch]
+        end = time.time()
+
+        self.stage_seconds.observe(end - start, stage="run")
+        self.requests_total.inc(len(batch), event="inferred")
+        for infer_id, _ in batch:
+            self.tracer.record(infer_id, "run", start, end, batch_size=len(batch))
+
+        for (infer_id, _), outputs in zip(batch, batch_outputs):
+            self.outputs.put(infer_id, outputs, pinned=True)
+
+    def try_run_batch(self, batch):
+        # Returns False if inference failed, after reporting the batch's requests as failed
+        try:
+            self.run_batch(batch)
+            return True
+        except Exception as e:
+            print(f"Inference of {[x for x, _ in batch]} failed: {str(e)}")
+            self.report_failure([x for x, _ in batch], f"Inference failed: {str(e)}")
+            return False
+
+    def report_failure(self, infer_ids, reason):
+        """
+        Count the requests as failed and tell the master, which answers the clients waiting on them.
+        """
+        self.requests_total.inc(len(infer_ids), event="failed")
+        for infer_id in infer_ids:
+            self.tracer.end(infer_id)
+        if self.master_url is None:
+            return
+
+        for infer_id in infer_ids:
+            self.peers.submit_request("POST", f"{self.master_url}/failed_request/{infer_id}", json={"reason": reason})
+
+    def start(self, num_workers=1, num_senders=2):
+        """
+        Start the inference worker and sender threads.
+
+        Once running, inference no longer happens in check_for_completion: workers pull batches
+        from the ready queue and hand finished requests to the senders, so a node can compute
+        request k+1 while request k is still being shipped downstream.
+        """
+        if self.is_running():
+            return
+
+        self.stopping = False
+        self.workers = [threading.Thread(target=self.inference_worker, daemon=True) for _ in range(num_workers)]
+        self.senders = [threading.Thread(target=self.sender_worker, daemon=True) for _ in range(num_senders)]
+
+        for thread in self.workers + self.senders:
+            thread.start()
+
+    def stop(self):
+        with self.batch_condition:
+            self.stopping = True
+            self.batch_condition.notify_all()
+
+        # Workers may still be queueing finished requests, which the senders must keep draining,
+        # so the senders are only told to stop once no worker is left to block on a full queue
+        for thread in self.workers:
+            thread.join()
+        for _ in self.senders:
+            self.send_queue.put(None)
+        for thread in self.senders:
+            thread.join()
+
+        self.workers = []
+        self.senders = []
+
+    def is_running(self):
+        return len(self.workers) > 0
+
+    def queue_depth(self):
+        return len(self.ready_ids)
+
+    def inference_worker(self):
+        while True:
+            batch = self.collect_batch(block=True)
+            if self.stopping:
+                return
+            if not batch:
+                continue
+
+            if not self.try_run_batch(batch):
+                continue
+
+            # Blocks while the senders are backed up, which in turn fills the ready queue
+            # and pushes back on new submissions.
+            for infer_id, _ in batch:
+                self.send_queue.put(infer_id)
+
+    def sender_worker(self):
+        while True:
+            infer_id = self.send_queue.get()
+            if infer_id is None:
+                return
+
+            self.forward(infer_id)
+
+    def forward(self, infer_id):
+        # Fan out to every child (and the master) at once, so their latencies overlap
+        start = time.perf_counter()
+        sends = self.send_to_children(infer_id, self.children, self.child_output_mappings)
+        sends += self.update_master(infer_id)
+
+        acknowledged = len(sends) > 0
+        for send in sends:
+            try:
+                response = send.result()
+                if response.status_code != 200:
+                    acknowledged = False
+                    self.requests_total.inc(event="send_failed")
+                    print(f"Sending outputs of {infer_id} failed with status {response.status_code}")
+            except Exception as e:
+                acknowledged = False
+                self.requests_total.inc(event="send_failed")
+                print(f"Sending outputs of {infer_id} failed: {str(e)}")
+
+        self.stage_seconds.observe(time.perf_counter() - start, stage="forward")
+        self.requests_total.inc(event="forwarded")
+        self.release_outputs(infer_id, acknowledged)
+        self.tracer.end(infer_id)
+
+    def release_outputs(self, infer_id, acknowledged=True):
+        # Outputs every receiver acknowledged are no longer needed, and outputs in a model's reusable
+        # buffers are dropped once sent either way, so the buffers can be reused. Others stay
+        # (e.g. for /output) until the store's budget pushes them out.
+        outputs = self.outputs.get(infer_id)
+        if isinstance(outputs, BoundOutputs):
+            self.model.release_outputs(self.outputs.pop(infer_id))
+        elif acknowledged:
+            self.outputs.pop(infer_id, None)
+        else:
+            self.outputs.unpin(infer_id)
+
+    def set_final_output(self, infer_id, tensors):
+        self.requests_total.inc(event="completed")
+        with self.final_output_lock:
+            self.final_outputs[infer_id] = tensors
+            self.failed_requests.pop(infer_id, None)
+            waiters = self.final_output_waiters.pop(infer_id, [])
+            subscribers = list(self.final_output_subscribers)
+
+        for loop, future in waiters:
+            notify(loop, resolve, future)
+        for loop, subscriber in subscribers:
+            notify(loop, subscriber.put_nowait, infer_id)
+
+    def set_failed(self, infer_id, reason):
+        # Answers whoever waits on infer_id, like set_final_output, but with the reason it failed
+        with self.final_output_lock:
+            self.failed_requests[infer_id] = reason
+            while len(self.failed_requests) > self.max_failed_requests:
+                self.failed_requests.popitem(last=False)
+            waiters = self.final_output_waiters.pop(infer_id, [])
+            subscribers = list(self.final_output_subscribers)
+
+        for loop, future in waiters:
+            notify(loop, resolve, future)
+        for loop, subscriber in subscribers:
+            notify(loop, subscriber.put_nowait, infer_id)
+
+    async def wait_for_final_output(self, infer_id, timeout):
+        """
+        Wait until the final output of infer_id is available, or the request failed (see
+        failed_requests), or timeout seconds pass.
+
+        Returns True unless timed out.
+        """
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self.final_output_lock:
+            if infer_id in self.final_outputs or infer_id in self.failed_requests:
+                return True
+            self.final_output_waiters.setdefault(infer_id, []).append(waiter)
+
+        try:
+            return await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self.final_output_lock:
+                waiters = self.final_output_waiters.get(infer_id, [])
+                if waiter in waiters:
+                    waiters.remove(waiter)
+                    if not waiters:
+                        del self.final_output_waiters[infer_id]
+
+    def subscribe_final_outputs(self):
+        # Must be called on the event loop the subscriber's queue is read from
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self.final_output_lock:
+            self.final_output_subscribers.append(subscriber)
+
+        return subscriber[1]
+
+    def unsubscribe_final_outputs(self, subscriber):
+        with self.final_output_lock:
+            self.final_output_subscribers = [x for x in self.final_output_subscribers if x[1] is not subscriber]
 
     def send_to_children(self, infer_id, children, child_output_mappings):
+        sends = []
         for child, outputs in child_output_mappings.items():
-            url = f"{child}/submit_input/{infer_id}"
-            file = self.get_selected_buffer(infer_id, outputs, child)
-            requests.post(url, files={"file": file})
+            if child in self.child_replicas:
+                target = self.route(child)
+                url = f"{target}/submit_input/{infer_id}"
+                sends.append(self.peers.submit(url, self.post_to_replica, target, url, infer_id, outputs))
+            else:
+                url = f"{child}/submit_input/{infer_id}"
+                sends.append(self.peers.submit(url, self.post_tensors, child, url, infer_id, outputs, child))
+
+        return sends
+
+    def post_to_replica(self, target, url, infer_id, output_names):
+        response = None
+        try:
+            response = self.post_tensors(target, url, infer_id, output_names, target)
+            return response
+        finally:
+            with self.routing_lock:
+                self.replica_in_flight[target] -= 1
+                if response is not None and response.status_code == 200:
+                    try:
+                        self.replica_pending[target] = response.json()["pending"]
+                    except (ValueError, KeyError, TypeError):
+                        pass
 
     def update_master(self, infer_id):
         if "output" in self.outputs[infer_id]:
             url = f"{self.master_url}/final_output/{infer_id}"
-            file = self.get_selected_buffer(infer_id, ["output"], "master")
-            requests.post(url, files={"file": file})
+            return [self.peers.submit(url, self.post_tensors, self.master_url, url, infer_id, ["output"], "master")]
+
+        return []
+
+    def post_tensors(self, peer, url, infer_id, output_names, output_id):
+        trace_headers = self.tracer.header(infer_id)
+        start = time.time()
+
+        if peer not in self.npz_peers:
+            codec = self.edge_codecs.get(peer)
+            with self.stage_seconds.time(stage="encode"):
+                tensors = self.get_selected_tensors(infer_id, output_names)
+                if codec is None:
+                    body, headers = wire.pack_tensors(tensors), {"Content-Type": wire.CONTENT_TYPE}
+                else:
+                    body, headers = codec.encode(tensors)
+                    self.codec_bytes.inc(sum(getattr(x, "nbytes", 0) for x in tensors.values()), codec=codec.spec, stage="raw")
+                    self.codec_bytes.inc(len(body), codec=codec.spec, stage="encoded")
+            with self.stage_seconds.time(stage="send"):
+                response = self.peers.post(url, data=body, headers={**headers, **trace_headers})
+
+            # Peers that can't decode the codec (e.g. lack its compressor) get plain tensors instead
+            if codec is not None and response.status_code == 415:
+                print(f"{peer} can't decode {codec.spec}, sending it plain tensors")
+                self.edge_codecs.pop(peer, None)
+                return self.post_tensors(peer, url, infer_id, output_names, output_id)
+
+            # Nodes that predate the binary format reject the raw body, so fall back to npz.
+            if response.status_code not in (415, 422):
+                self.sent_bytes.inc(len(body))
+                self.tracer.record(infer_id, "send", start, time.time(), target=peer, bytes=len(body), status=response.status_code)
+                return response
+            self.npz_peers.add(peer)
+
+        with self.stage_seconds.time(stage="encode"):
+            file = self.get_selected_buffer(infer_id, output_names, output_id)
+        with self.stage_seconds.time(stage="send"):
+            response = self.peers.post(url, files={"file": file}, headers=trace_headers)
+        self.sent_bytes.inc(file[1].getbuffer().nbytes)
+        self.tracer.record(infer_id, "send", start, time.time(), target=peer, bytes=file[1].getbuffer().nbytes, status=response.status_code)
+
+        return response
+
+    def get_selected_tensors(self, infer_id, output_names):
+        return {k: v for k,v in self.outputs[infer_id].items() if k in output_names}
     
     def get_selected_buffer(self, infer_id, output_names, output_id):
         buffer = BytesIO()
-        selected_output = {k: v for k,v in self.outputs[infer_id].items() if k in output_names}
+        selected_output = self.get_selected_tensors(infer_id, output_names)
 
         np.savez(buffer, **selected_output)
         buffer.seek(0)
 
-        return f"output_{infer_id}_{output_id}.npz", buffer, "application/octet-stream"
+        return f"output_{infer_id}_{output_id}.npz", buffer, wire.NPZ_CONTENT_TYPE
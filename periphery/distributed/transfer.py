@@ -0,0 +1,62 @@
+import hashlib
+import os
+
+# Shards are streamed in chunks of this size, so neither side holds a whole file in memory
+CHUNK_SIZE = 8 << 20
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def part_path(directory, filename):
+    # only plain file names are accepted, so uploads can't escape the model directory
+    return os.path.join(directory, os.path.basename(filename) + ".part")
+
+def upload_file(peers, node, path, chunk_size=CHUNK_SIZE):
+    """
+    Stream a file to a node's /model_chunk route, resuming from whatever the node already has.
+
+    Returns the file's name, size and sha256, as expected by /model_commit.
+    """
+    filename = os.path.basename(path)
+    size = os.path.getsize(path)
+
+    response = peers.get(f"{node}/model_chunk/{filename}")
+    response.raise_for_status()
+    offset = response.json()["received"]
+    if offset > size:
+        offset = 0
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while offset < size:
+            chunk = f.read(chunk_size)
+            response = peers.post(f"{node}/model_chunk/{filename}", params={"offset": offset}, data=chunk, headers={"Content-Type": "application/octet-stream"})
+            if response.status_code == 409:
+                # the node holds a different amount than we thought; continue from there
+                offset = response.json()["detail"]["received"]
+                f.seek(offset)
+                continue
+            response.raise_for_status()
+
+            offset += len(chunk)
+
+    return {"name": filename, "size": size, "sha256": file_sha256(path)}
+
+def upload_model(peers, node, model_path, data_paths):
+    """
+    Upload a model and its external data files to a node, then have the node verify and install them.
+    """
+    files = [upload_file(peers, node, x) for x in data_paths + [model_path]]
+
+    response = peers.post(f"{node}/model_commit", json={"model": os.path.basename(model_path), "files": files})
+    if response.status_code == 400:
+        # a checksum failed and the node dropped its partial files, so send everything once more
+        files = [upload_file(peers, node, x) for x in data_paths + [model_path]]
+        response = peers.post(f"{node}/model_commit", json={"model": os.path.basename(model_path), "files": files})
+
+    return response
@@ -1,8 +1,175 @@
 import onnxruntime as ort
 import onnx
+import numpy as np
 from transformers import AutoTokenizer, AutoConfig
 
+import collections
+import contextlib
+import glob
+import hashlib
+import json
 import os
+import queue
+import tempfile
+import threading
+import time
+
+# numpy dtypes of ONNX Runtime input types, for building warmup inputs
+ORT_DTYPES = {
+    "tensor(float)": np.float32,
+    "tensor(float16)": np.float16,
+    "tensor(double)": np.float64,
+    "tensor(int8)": np.int8,
+    "tensor(int16)": np.int16,
+    "tensor(int32)": np.int32,
+    "tensor(int64)": np.int64,
+    "tensor(uint8)": np.uint8,
+    "tensor(bool)": np.bool_,
+}
+
+class SessionConfig:
+    """
+    How a node's ONNX Runtime sessions are set up.
+
+    Parameters:
+    - intra_op_threads: Threads used within an operator, 0 lets ONNX Runtime pick (one per core).
+    - inter_op_threads: Threads running independent operators, only used in parallel execution mode.
+    - execution_mode: "sequential" or "parallel".
+    - optimization_level: One of OPTIMIZATION_LEVELS.
+    - enable_mem_arena: Keep freed CPU memory in ONNX Runtime's arena for reuse.
+    - cache_optimized_model: Save the optimized graph next to the model (or in optimized_model_dir)
+      and load it on later runs, skipping graph optimization.
+    - io_binding: Run through IOBinding into output buffers that are reused per input shape signature.
+      Outputs then stay valid only until passed to PeriModel.release_outputs.
+    - replicas: Sessions per model, each run by one thread at a time. Unless intra_op_threads is set,
+      the cores are split evenly between them. Every replica holds its own copy of the weights.
+    """
+    OPTIMIZATION_LEVELS = {
+        "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    EXECUTION_MODES = {
+        "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+        "parallel": ort.ExecutionMode.ORT_PARALLEL,
+    }
+
+    def __init__(self, intra_op_threads=0, inter_op_threads=0, execution_mode="sequential", optimization_level="all",
+                 enable_mem_arena=True, cache_optimized_model=True, optimized_model_dir=None, io_binding=False, replicas=1):
+        if execution_mode not in self.EXECUTION_MODES:
+            raise ValueError(f"Execution mode {execution_mode} not supported, use one of {list(self.EXECUTION_MODES)}")
+        if optimization_level not in self.OPTIMIZATION_LEVELS:
+            raise ValueError(f"Optimization level {optimization_level} not supported, use one of {list(self.OPTIMIZATION_LEVELS)}")
+        if replicas < 1:
+            raise ValueError("replicas must be at least 1.")
+
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.execution_mode = execution_mode
+        self.optimization_level = optimization_level
+        self.enable_mem_arena = enable_mem_arena
+        self.cache_optimized_model = cache_optimized_model
+        self.optimized_model_dir = optimized_model_dir
+        self.io_binding = io_binding
+        self.replicas = replicas
+
+    def replica_threads(self):
+        if self.intra_op_threads > 0 or self.replicas == 1:
+            return self.intra_op_threads
+        return max(1, (os.cpu_count() or 1) // self.replicas)
+
+    def to_dict(self):
+        return {
+            "intra_op_threads": self.intra_op_threads,
+            "inter_op_threads": self.inter_op_threads,
+            "execution_mode": self.execution_mode,
+            "optimization_level": self.optimization_level,
+            "enable_mem_arena": self.enable_mem_arena,
+        }
+
+    def session_options(self, optimized=False):
+        """
+        Build SessionOptions. With optimized=True the model was already optimized offline, so
+        graph optimization is skipped.
+        """
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.replica_threads()
+        options.inter_op_num_threads = self.inter_op_threads
+        options.execution_mode = self.EXECUTION_MODES[self.execution_mode]
+        options.enable_cpu_mem_arena = self.enable_mem_arena
+        if optimized:
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        else:
+            options.graph_optimization_level = self.OPTIMIZATION_LEVELS[self.optimization_level]
+
+        return options
+
+class TensorInfo:
+    """
+    Name, shape and type of a model input or output, as ONNX Runtime's NodeArg reports them:
+    shape entries are ints, symbolic dimension names or None, type is e.g. "tensor(float)".
+    """
+    def __init__(self, name, shape, type):
+        self.name = name
+        self.shape = shape
+        self.type = type
+
+    @classmethod
+    def from_value_info(cls, value_info):
+        tensor_type = value_info.type.tensor_type
+        shape = []
+        for dim in tensor_type.shape.dim:
+            if dim.HasField("dim_value"):
+                shape.append(dim.dim_value)
+            elif dim.HasField("dim_param"):
+                shape.append(dim.dim_param)
+            else:
+                shape.append(None)
+        elem_type = onnx.TensorProto.DataType.Name(tensor_type.elem_type).lower()
+
+        return cls(value_info.name, shape, f"tensor({elem_type})")
+
+    def to_dict(self):
+        return {"name": self.name, "shape": self.shape, "type": self.type}
+
+def read_metadata(path):
+    """
+    Read a model's inputs, outputs and external data files from its graph, without loading weights
+    or creating a session.
+    """
+    model = onnx.load(path, load_external_data=False)
+    graph = model.graph
+
+    # Initializers listed as graph inputs only provide defaults, ONNX Runtime doesn't report them
+    initializers = set(x.name for x in graph.initializer)
+
+    locations = set()
+    for init in graph.initializer:
+        if init.data_location == onnx.TensorProto.EXTERNAL:
+            locations.update(x.value for x in init.external_data if x.key == "location")
+
+    return {
+        "inputs": [TensorInfo.from_value_info(x).to_dict() for x in graph.input if x.name not in initializers],
+        "outputs": [TensorInfo.from_value_info(x).to_dict() for x in graph.output],
+        "external_data": sorted(locations),
+    }
+
+class OutputBuffers:
+    # Output arrays preallocated for one input shape signature, with an IOBinding writing into them
+    def __init__(self, signature, binding, arrays):
+        self.signature = signature
+        self.binding = binding
+        self.arrays = arrays
+
+class BoundOutputs(dict):
+    """
+    Outputs of an IOBinding run. The arrays are the model's reusable buffers, so they are only valid
+    until handed back with PeriModel.release_outputs.
+    """
+    def __init__(self, buffers):
+        super().__init__(buffers.arrays)
+        self.buffers = buffers
 
 class ModelSupplement:
     def __init__(self):
@@ -29,22 +196,69 @@ class LLMSupplement(ModelSupplement):
         supplement.config = AutoConfig.from_pretrained(model_name)
 
 class PeriModel:
-    def __init__(self, path, supplement=None):
+    def __init__(self, path, supplement=None, session_config=None):
         self.path = path
         self.supplement = supplement
+        self.session_config = session_config or SessionConfig()
 
         self.inputs = None
         self.outputs = None
+        self.metadata = None
         self.loaded_model = None
+
+        # One session per replica, the first also answering metadata queries. Threads take a free
+        # replica from free_replicas for every run, so requests spread over all of them.
         self.session = None
+        self.sessions = []
+        self.free_replicas = queue.LifoQueue()
+        self.session_lock = threading.Lock()
+        self.output_names = None
+
+        # Free OutputBuffers per input shape signature, least recently used first
+        self.free_buffers = collections.OrderedDict()
+        self.buffer_lock = threading.Lock()
+        self.max_buffer_signatures = 8
+
+    def get_metadata_path(self):
+        return self.path + ".meta.json"
+
+    def get_metadata(self):
+        """
+        Inputs, outputs and external data files of the model, read from the graph and cached in
+        <path>.meta.json, which is reused for as long as the model file is unchanged.
+        """
+        if self.metadata is not None:
+            return self.metadata
+
+        stat = os.stat(self.path)
+        version = [stat.st_size, stat.st_mtime_ns]
+
+        try:
+            with open(self.get_metadata_path()) as f:
+                cached = json.load(f)
+            if cached["version"] == version:
+                self.metadata = cached["metadata"]
+                return self.metadata
+        except (OSError, ValueError, KeyError):
+            pass
+
+        self.metadata = read_metadata(self.path)
+        try:
+            temp_path = f"{self.get_metadata_path()}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump({"version": version, "metadata": self.metadata}, f)
+            os.replace(temp_path, self.get_metadata_path())
+        except OSError as e:
+            print(f"Caching metadata of {self.path} failed: {str(e)}")
+
+        return self.metadata
 
     def get_inputs(self):
         if not self.inputs:
             if self.session:
                 self.inputs = self.session.get_inputs()
             else:
-                session = ort.InferenceSession(self.path)
-                self.inputs = session.get_inputs()
+                self.inputs = [TensorInfo(**x) for x in self.get_metadata()["inputs"]]
 
         return self.inputs
 
@@ -53,8 +267,7 @@ class PeriModel:
             if self.session:
                 self.outputs = self.session.get_outputs()
             else:
-                session = ort.InferenceSession(self.path)
-                self.outputs = session.get_outputs()
+                self.outputs = [TensorInfo(**x) for x in self.get_metadata()["outputs"]]
 
         return self.outputs
 
@@ -71,11 +284,302 @@ class PeriModel:
         
         return self.loaded_model
 
+    def get_optimized_model_path(self):
+        # Named after everything the optimized graph depends on, so a changed model, setting or
+        # ONNX Runtime version never picks up a stale file
+        digest = hashlib.sha256()
+        digest.update(json.dumps(self.session_config.to_dict(), sort_keys=True).encode())
+        digest.update(ort.__version__.encode())
+        for path in [self.path] + self.get_external_data_files():
+            stat = os.stat(path)
+            digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+        model_dir = self.session_config.optimized_model_dir or os.path.dirname(os.path.realpath(self.path))
+        return os.path.join(model_dir, f"{os.path.basename(self.path)}.opt-{digest.hexdigest()[:16]}.onnx")
+
+    def clear_optimized_models(self):
+        """
+        Remove every optimized graph cached for this model, with its external data, whatever
+        settings or ONNX Runtime version it was made for. Sessions never clean these up on their
+        own, since other processes sharing the directory may still be using them, so call this
+        only when no node runs the model. Returns the removed paths.
+        """
+        model_dir = self.session_config.optimized_model_dir or os.path.dirname(os.path.realpath(self.path))
+        removed = glob.glob(os.path.join(glob.escape(model_dir), f"{glob.escape(os.path.basename(self.path))}.opt-*"))
+        for path in removed:
+            os.remove(path)
+
+        return removed
+
+    def create_session(self):
+        config = self.session_config
+        if not config.cache_optimized_model:
+            return ort.InferenceSession(self.path, config.session_options())
+
+        optimized_path = self.get_optimized_model_path()
+        if os.path.exists(optimized_path):
+            return ort.InferenceSession(optimized_path, config.session_options(optimized=True))
+
+        # Graphs cached for other settings or versions are left alone, as other processes may be
+        # running them; see clear_optimized_models
+        # Written under a temporary name first, so a crash never leaves a half-written model behind
+        temp_path = f"{optimized_path}.{os.getpid()}.tmp"
+        options = config.session_options()
+        options.optimized_model_filepath = temp_path
+        if self.get_external_data_files():
+            options.add_session_config_entry("session.optimized_model_external_initializers_file_name", os.path.basename(optimized_path) + ".data")
+            options.add_session_config_entry("session.optimized_model_external_initializers_min_size_in_bytes", "1024")
+
+        try:
+            session = ort.InferenceSession(self.path, options)
+            os.replace(temp_path, optimized_path)
+        except Exception as e:
+            print(f"Caching the optimized model failed: {str(e)}")
+            return ort.InferenceSession(self.path, config.session_options())
+
+        return session
+
+    def get_session(self):
+        if self.session is None:
+            with self.session_lock:
+                if self.session is None:
+                    # the first replica writes the optimized model cache, the others load it
+                    sessions = [self.create_session() for _ in range(self.session_config.replicas)]
+                    for replica in range(len(sessions)):
+                        self.free_replicas.put(replica)
+                    self.sessions = sessions
+                    self.session = sessions[0]
+        return self.session
+
+    @contextlib.contextmanager
+    def acquire_replica(self):
+        # Wait for a free replica and hand out its index for the duration of one run
+        self.get_session()
+        replica = self.free_replicas.get()
+        try:
+            yield replica
+        finally:
+            self.free_replicas.put(replica)
+
+    def busy_replicas(self):
+        return len(self.sessions) - self.free_replicas.qsize()
+
+    def get_output_names(self):
+        if self.output_names is None:
+            self.output_names = [x.name for x in self.get_outputs()]
+        return self.output_names
+
     def infer(self, input_dict):
-        if not self.session:
-            self.session = ort.InferenceSession(self.path)
-        output_names = [x.name for x in self.get_outputs()]
-        return {name: res for name, res in zip (output_names, self.session.run(output_names, input_dict))}
+        if self.session_config.io_binding:
+            return self.infer_bound(input_dict)
+        return self.run_session(input_dict)
+
+    def run_session(self, input_dict):
+        output_names = self.get_output_names()
+        with self.acquire_replica() as replica:
+            results = self.sessions[replica].run(output_names, input_dict)
+        return {name: res for name, res in zip (output_names, results)}
+
+    def get_buffers(self, signature):
+        with self.buffer_lock:
+            free = self.free_buffers.get(signature)
+            if free:
+                self.free_buffers.move_to_end(signature)
+                return free.pop()
+
+        return None
+
+    def allocate_buffers(self, replica, signature, input_dict):
+        """
+        Run once with ONNX Runtime allocating the outputs, to learn their shapes for this signature,
+        then preallocate matching arrays and bind them. Returns the buffers, holding this run's outputs.
+        """
+        session = self.sessions[replica]
+        binding = session.io_binding()
+        for name, tensor in input_dict.items():
+            binding.bind_cpu_input(name, tensor)
+        for name in self.get_output_names():
+            binding.bind_output(name)
+        session.run_with_iobinding(binding)
+
+        arrays = dict(zip(self.get_output_names(), binding.copy_outputs_to_cpu()))
+        binding.clear_binding_outputs()
+        for name, array in arrays.items():
+            binding.bind_output(name, "cpu", 0, array.dtype, array.shape, array.ctypes.data)
+
+        return OutputBuffers(signature, binding, arrays)
+
+    def infer_bound(self, input_dict):
+        input_dict = {name: np.require(x, requirements="C") for name, x in input_dict.items()}
+
+        with self.acquire_replica() as replica:
+            # bindings belong to one session, so each replica has buffers of its own
+            signature = (replica,) + tuple((name, x.dtype.str, x.shape) for name, x in sorted(input_dict.items()))
+
+            buffers = self.get_buffers(signature)
+            if buffers is None:
+                return BoundOutputs(self.allocate_buffers(replica, signature, input_dict))
+
+            # Inputs are bound in place, outputs land in the preallocated arrays
+            binding = buffers.binding
+            binding.clear_binding_inputs()
+            for name, tensor in input_dict.items():
+                binding.bind_cpu_input(name, tensor)
+
+            try:
+                self.sessions[replica].run_with_iobinding(binding)
+            except Exception:
+                # e.g. outputs whose shape depends on input values; these buffers no longer fit
+                return BoundOutputs(self.allocate_buffers(replica, signature, input_dict))
+
+        return BoundOutputs(buffers)
+
+    def release_outputs(self, outputs):
+        """
+        Return the buffers of outputs from infer_bound, to be reused by later requests of the same
+        input shapes. Other outputs are ignored.
+        """
+        if not isinstance(outputs, BoundOutputs):
+            return
+
+        buffers = outputs.buffers
+        with self.buffer_lock:
+            self.free_buffers.setdefault(buffers.signature, []).append(buffers)
+            self.free_buffers.move_to_end(buffers.signature)
+            while len(self.free_buffers) > self.max_buffer_signatures:
+                self.free_buffers.popitem(last=False)
+
+    def get_dummy_inputs(self, batch_size=1):
+        # Zeros of each input's type, with every symbolic dimension set to batch_size
+        return {
+            x.name: np.zeros([d if isinstance(d, int) and d > 0 else batch_size for d in x.shape], dtype=ORT_DTYPES.get(x.type, np.float32))
+            for x in self.get_inputs()
+        }
+
+    def warmup(self, runs=1):
+        """
+        Create the sessions and run each replica on dummy inputs, so the first real request doesn't
+        pay for graph optimization and memory allocation. Returns the seconds taken.
+        """
+        start = time.perf_counter()
+        self.get_session()
+        try:
+            dummy_inputs = self.get_dummy_inputs()
+            for _ in range(runs):
+                for session in self.sessions:
+                    session.run(self.get_output_names(), dummy_inputs)
+        except Exception as e:
+            # Dummy shapes don't suit every model; the session is created either way
+            print(f"Warmup of {self.path} failed: {str(e)}")
+
+        return time.perf_counter() - start
+
+    def profile_ops(self, runs=10, batch_size=1):
+        """
+        Run the model on dummy inputs with ONNX Runtime's per-operator profiling and return the
+        median kernel time of every node in seconds, keyed by node name.
+
+        Profiling uses its own session with graph optimization disabled, so that every timing
+        belongs to a node of this graph rather than to a fused one.
+        """
+        options = self.session_config.session_options()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        options.enable_profiling = True
+
+        with tempfile.TemporaryDirectory() as profile_dir:
+            options.profile_file_prefix = os.path.join(profile_dir, "profile")
+            session = ort.InferenceSession(self.path, options)
+
+            dummy_inputs = self.get_dummy_inputs(batch_size)
+            for _ in range(runs):
+                session.run(None, dummy_inputs)
+
+            with open(session.end_profiling()) as f:
+                events = json.load(f)
+
+        durations = collections.defaultdict(list)
+        for event in events:
+            if event.get("cat") == "Node" and event["name"].endswith("_kernel_time"):
+                durations[event["name"][:-len("_kernel_time")]].append(event["dur"])
+
+        # durations are in microseconds
+        return {name: float(np.median(x)) / 1e6 for name, x in durations.items()}
+
+    def can_batch(self, input_dicts):
+        """
+        Return True if the given requests can be concatenated along the batch (first) dimension.
+
+        Every request must provide the same input names, with matching dtypes and matching
+        shapes past the first dimension, and the model must not fix the size of its batch dimension,
+        nor have outputs without one.
+        """
+        if len(input_dicts) < 2:
+            return False
+
+        names = set(input_dicts[0].keys())
+        if any(set(x.keys()) != names for x in input_dicts[1:]):
+            return False
+
+        for model_input in self.get_inputs():
+            if model_input.name not in names:
+                continue
+            if not model_input.shape or isinstance(model_input.shape[0], int):
+                return False
+
+        # outputs of a fixed size (e.g. reduced over the batch) couldn't be split between requests.
+        # Outputs of unknown rank, as shards declare them without shape inference, look like
+        # scalars, so those are left to the check after the run.
+        for model_output in self.get_outputs():
+            if model_output.shape and isinstance(model_output.shape[0], int):
+                return False
+
+        for name in names:
+            first = input_dicts[0][name]
+            if np.ndim(first) == 0:
+                return False
+            for x in input_dicts[1:]:
+                if x[name].dtype != first.dtype or x[name].shape[1:] != first.shape[1:]:
+                    return False
+
+        return True
+
+    def infer_batch(self, input_dicts):
+        """
+        Run several requests with a single session call, returning one output dict per request.
+
+        Requests that can't be stacked (see can_batch), or whose outputs of unknown shape turn out
+        not to carry the batch dimension, fall back to running each request on its own.
+        """
+        if not self.can_batch(input_dicts):
+            return [self.infer(x) for x in input_dicts]
+
+        batch_sizes = [next(iter(x.values())).shape[0] for x in input_dicts]
+        if any(x[name].shape[0] != size for x, size in zip(input_dicts, batch_sizes) for name in x):
+            return [self.infer(x) for x in input_dicts]
+
+        total = sum(batch_sizes)
+        stacked = {name: np.concatenate([x[name] for x in input_dicts]) for name in input_dicts[0]}
+        outputs = self.infer(stacked)
+        if isinstance(outputs, BoundOutputs):
+            # the requests' outputs would be views of one set of buffers, but are released one by one.
+            # Copy before releasing: once released, another run may write into the buffers
+            bound = outputs
+            outputs = {name: res.copy() for name, res in bound.items()}
+            self.release_outputs(bound)
+
+        if any(np.ndim(x) == 0 or x.shape[0] != total for x in outputs.values()):
+            # outputs of unknown shape that turned out not to follow the batch
+            return [self.infer(x) for x in input_dicts]
+
+        split_points = np.cumsum(batch_sizes)[:-1]
+        split_outputs = {name: np.split(res, split_points) for name, res in outputs.items()}
+
+        return [{name: split_outputs[name][i] for name in outputs} for i in range(len(input_dicts))]
 
     def get_data_file(self):
         return self.path + ".data"
+
+    def get_external_data_files(self):
+        # Paths of every external data file the model's initializers point to, without loading them
+        model_dir = os.path.dirname(self.path)
+        return [os.path.join(model_dir, x) for x in self.get_metadata()["external_data"]]
@@ -1,13 +1,111 @@
-from onnx import helper
+from onnx import helper, numpy_helper
 import onnx
 
+import collections
+import mmap
+import os
+
 from periphery.model.model import PeriModel
 import periphery.utils.dag as dag
 
-from periphery.utils.partition import get_partitions_spectral
+from periphery.utils.partition import get_partitions_simple, get_partitions_spectral, get_partitions_cost_aware, estimate_costs, partition_report, node_key, profile_node_weights
 from periphery.utils.topology import infer_topology
 
-def shard_onnx_model(peri_model, n_shards, output_paths):
+PARTITIONERS = ["simple", "spectral", "cost_aware"]
+
+CHUNK_SIZE = 8 << 20
+
+def get_partitions(model, n_shards, partitioner, costs, node_weights=None):
+    if partitioner == "simple":
+        return get_partitions_simple(model.graph.node, n_shards, node_weights=node_weights, costs=costs)
+    if partitioner == "spectral":
+        return get_partitions_spectral(model.graph.node, n_shards, node_weights=node_weights, costs=costs)
+    if partitioner == "cost_aware":
+        return get_partitions_cost_aware(model, n_shards, node_weights=node_weights, costs=costs)
+
+    raise ValueError(f"Partitioner {partitioner} not supported, use one of {PARTITIONERS}")
+
+def value_info(name, costs):
+    # The inferred type and shape where known, so shards declare real dtypes and callers (e.g. warmup)
+    # can build inputs; otherwise a float tensor of unknown shape
+    if name in costs.tensor_types and costs.tensor_types[name].tensor_type.elem_type:
+        result = onnx.ValueInfoProto()
+        result.name = name
+        result.type.CopyFrom(costs.tensor_types[name])
+        return result
+
+    return helper.make_tensor_value_info(name, onnx.TensorProto.FLOAT, None)
+
+class ExternalDataWriter:
+    """
+    Copies initializers into a shard's own external data file, reading them from memory-mapped
+    source data files so that no more than one chunk of weights is in memory at a time.
+    """
+    def __init__(self, source_dir, output_path, size_threshold=1024):
+        self.source_dir = source_dir
+        self.location = os.path.basename(output_path) + ".data"
+        self.output = open(os.path.join(os.path.dirname(output_path), self.location), "wb")
+        self.size_threshold = size_threshold
+        self.sources = {}
+
+    def source(self, location):
+        if location not in self.sources:
+            f = open(os.path.join(self.source_dir, location), "rb")
+            self.sources[location] = (f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        return self.sources[location][1]
+
+    def write(self, data_source, offset, length):
+        # keep every tensor page aligned, as onnx does when saving external data
+        position = self.output.seek(0, os.SEEK_END)
+        padding = -position % mmap.ALLOCATIONGRANULARITY
+        self.output.write(bytes(padding))
+        position += padding
+
+        for start in range(offset, offset + length, CHUNK_SIZE):
+            self.output.write(data_source[start:min(start + CHUNK_SIZE, offset + length)])
+
+        return position
+
+    def add(self, init):
+        """
+        Return a copy of the initializer whose data lives in this shard's external data file.
+        Small inline initializers are kept inline.
+        """
+        shard_init = onnx.TensorProto()
+        shard_init.CopyFrom(init)
+
+        if init.data_location == onnx.TensorProto.EXTERNAL:
+            info = {x.key: x.value for x in init.external_data}
+            data_source = self.source(info["location"])
+            offset = int(info.get("offset", 0))
+            length = int(info["length"]) if "length" in info else len(data_source) - offset
+        else:
+            data_source = init.raw_data if init.HasField("raw_data") else numpy_helper.to_array(init).tobytes()
+            offset, length = 0, len(data_source)
+            if length < self.size_threshold:
+                return shard_init
+
+        position = self.write(data_source, offset, length)
+
+        shard_init.ClearField("raw_data")
+        for field in ("float_data", "int32_data", "int64_data", "double_data", "uint64_data", "string_data"):
+            shard_init.ClearField(field)
+        del shard_init.external_data[:]
+        shard_init.data_location = onnx.TensorProto.EXTERNAL
+        for key, value in (("location", self.location), ("offset", str(position)), ("length", str(length))):
+            entry = shard_init.external_data.add()
+            entry.key = key
+            entry.value = value
+
+        return shard_init
+
+    def close(self):
+        self.output.close()
+        for f, data_source in self.sources.values():
+            data_source.close()
+            f.close()
+
+def shard_onnx_model(peri_model, n_shards, output_paths, partitioner="spectral", out_of_core=None, node_times=None):
     """
     Shard an ONNX model into N smaller models.
 
@@ -15,9 +113,23 @@ def shard_onnx_model(peri_model, n_shards, output_paths):
     - model_path: Path to the input ONNX model.
     - n_shards: Number of shards to split the model into.
     - output_paths: List of file paths for the output sharded models.
+    - partitioner: One of PARTITIONERS. The returned DAG carries each shard's predicted
+      compute (compute_cost) and the predicted size of every tensor it sends (tensor_bytes).
+    - out_of_core: Load only the graph structure and copy weights, one at a time, from memory-mapped
+      external data into each shard's own external data file (shard_i.onnx.data). Peak memory then
+      follows the graph size rather than the model size, and shards may exceed 2GB. Defaults to
+      True for models that already keep their weights in external data.
+    - node_times: Optional measured seconds per node name, from profiling the shards of an earlier
+      run, so that shards balance measured rather than estimated compute.
     """
+    if out_of_core is None:
+        out_of_core = len(peri_model.get_external_data_files()) > 0
+
     # Load the ONNX model
-    model = peri_model.load_model()
+    if out_of_core:
+        model = onnx.load(peri_model.path, load_external_data=False)
+    else:
+        model = peri_model.load_model()
     graph = model.graph
     nodes = graph.node
 
@@ -27,9 +139,18 @@ def shard_onnx_model(peri_model, n_shards, output_paths):
         raise ValueError("Number of shards exceeds the number of nodes in the model.")
 
     initializers = {init.name: init for init in graph.initializer}
+    graph_outputs = set(x.name for x in graph.output)
 
-    partitions = get_partitions_spectral(model.graph.node, n_shards)
+    costs = estimate_costs(model)
+    node_weights = profile_node_weights(nodes, node_times, costs) if node_times else None
+    partitions = get_partitions(model, n_shards, partitioner, costs, node_weights)
 
+    # tensors each shard needs from elsewhere, so shards also export intermediates others consume
+    consumers = collections.defaultdict(set)
+    for shard_no, partition in enumerate(partitions):
+        for node in partition:
+            for x in node.input:
+                consumers[x].add(shard_no)
 
     all_inputs = []
     all_outputs = []
@@ -39,22 +160,31 @@ def shard_onnx_model(peri_model, n_shards, output_paths):
         shard_outputs = set()
         shard_initializers = set()
         for node in partition:
-            shard_inputs = shard_inputs.union(set(node.input))
-            shard_outputs = shard_outputs.union(set(node.output))
-            shard_initializers = shard_initializers.union(set([x for x in node.input if x in initializers]))
+            shard_inputs.update(node.input)
+            shard_outputs.update(node.output)
+            shard_initializers.update(x for x in node.input if x in initializers)
         
         intermediates = shard_inputs.intersection(shard_outputs)
 
         shard_inputs = shard_inputs.difference(intermediates)
-        shard_outputs = shard_outputs.difference(intermediates)
+        shard_outputs = set(x for x in shard_outputs if x not in intermediates or x in graph_outputs or consumers[x] - {shard_no})
         shard_inputs = shard_inputs.difference(shard_initializers)
+        shard_inputs.discard("")
 
         all_inputs.append(shard_inputs)
         all_outputs.append(shard_outputs)
 
-        shard_inputs = [helper.make_tensor_value_info(x, onnx.TensorProto.FLOAT, None) for x in shard_inputs]
-        shard_outputs = [helper.make_tensor_value_info(x, onnx.TensorProto.FLOAT, None) for x in shard_outputs]
-        shard_initializers = [initializers[x] for x in shard_initializers]
+        shard_inputs = [value_info(x, costs) for x in shard_inputs]
+        shard_outputs = [value_info(x, costs) for x in shard_outputs]
+
+        if out_of_core:
+            writer = ExternalDataWriter(os.path.dirname(os.path.realpath(peri_model.path)), output_paths[shard_no])
+            try:
+                shard_initializers = [writer.add(initializers[x]) for x in shard_initializers]
+            finally:
+                writer.close()
+        else:
+            shard_initializers = [initializers[x] for x in shard_initializers]
 
         shard_graph = helper.make_graph(
             nodes=partition,
@@ -73,4 +203,14 @@ def shard_onnx_model(peri_model, n_shards, output_paths):
         # Save the sharded model
         onnx.save(shard_model, output_paths[shard_no])
 
-    return infer_topology(all_inputs, all_outputs, set(initializers.keys()))
+    shard_dag = infer_topology(all_inputs, all_outputs, set(initializers.keys()))
+
+    for shard_no, shard_report in enumerate(partition_report(partitions, costs, node_weights)):
+        shard_node = shard_dag.nodes[shard_no]
+        shard_node.compute_cost = shard_report["compute"]
+        shard_node.tensor_bytes = {x: costs.tensor_bytes.get(x, 0) for x in shard_node.label_to_connection}
+        shard_node.members = [node_key(x) for x in partitions[shard_no]]
+
+        print(f"shard {shard_no}: {shard_report['compute']:.3g} FLOPs, receives {shard_report['received_bytes']} bytes, sends {shard_report['sent_bytes']} bytes")
+
+    return shard_dag
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from periphery.utils.dag import DirectedGraph
+
+# Bump when the shard file layout or plan format changes, so old entries are never reused
+CACHE_VERSION = 3
+
+class ShardCache:
+    """
+    Content-addressed cache of sharding plans and shard files.
+
+    Entries are keyed by the hash of the model (and its external data), the shard count and the
+    partitioner settings. Each entry directory holds the shard files and a plan.json with the
+    partition assignment and the shard DAG. Least recently used entries are evicted to keep the
+    cache under max_bytes.
+    """
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.hash_index_path = os.path.join(self.cache_dir, "hashes.json")
+
+    def load_hash_index(self):
+        if not os.path.exists(self.hash_index_path):
+            return {}
+        with open(self.hash_index_path) as f:
+            return json.load(f)
+
+    def file_hash(self, path):
+        # Hashing large models is slow, so hashes are remembered per path, size and mtime
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        index = self.load_hash_index()
+
+        cached = index.get(path)
+        if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            return cached["sha256"]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+
+        index[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+        with open(self.hash_index_path, "w") as f:
+            json.dump(index, f)
+
+        return index[path]["sha256"]
+
+    def key(self, peri_model, n_shards, settings):
+        digest = hashlib.sha256()
+        digest.update(json.dumps({"version": CACHE_VERSION, "n_shards": n_shards, "settings": settings}, sort_keys=True).encode())
+
+        for path in [peri_model.path] + peri_model.get_external_data_files():
+            digest.update(os.path.basename(path).encode())
+            digest.update(self.file_hash(path).encode())
+
+        return digest.hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def lookup(self, key):
+        """
+        Return (shard_paths, shard_graph) for a cached entry, or None if there is no complete entry.
+        """
+        plan_path = os.path.join(self.entry_dir(key), "plan.json")
+        if not os.path.exists(plan_path):
+            return None
+
+        with open(plan_path) as f:
+            plan = json.load(f)
+
+        shard_paths = [os.path.join(self.entry_dir(key), x) for x in plan["shard_files"]]
+        if not all(os.path.exists(x) for x in shard_paths):
+            return None
+
+        # the plan's mtime records when the entry was last used, for eviction
+        os.utime(plan_path)
+
+        return shard_paths, DirectedGraph.from_dict(plan["shard_graph"])
+
+    def store(self, key, n_shards, shard_fn):
+        """
+        Shard into a staging directory with shard_fn(shard_paths) -> shard_graph, then publish the entry.
+        """
+        staging = os.path.join(self.cache_dir, f".{key}.{os.getpid()}")
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+
+        shard_files = [f"shard_{i}.onnx" for i in range(n_shards)]
+        shard_graph = shard_fn([os.path.join(staging, x) for x in shard_files])
+
+        with open(os.path.join(staging, "plan.json"), "w") as f:
+            json.dump({"shard_files": shard_files, "shard_graph": shard_graph.to_dict()}, f)
+
+        with self.lock:
+            if os.path.exists(self.entry_dir(key)):
+                shutil.rmtree(staging)
+            else:
+                os.rename(staging, self.entry_dir(key))
+
+        self.evict(keep=key)
+
+        return self.lookup(key)
+
+    def get_or_shard(self, peri_model, n_shards, settings, shard_fn):
+        key = self.key(peri_model, n_shards, settings)
+
+        cached = self.lookup(key)
+        if cached is not None:
+            print(f"Using cached shards {key[:12]}")
+            return cached
+
+        return self.store(key, n_shards, shard_fn)
+
+    def entry_size(self, key):
+        total = 0
+        for root, _, files in os.walk(self.entry_dir(key)):
+            total += sum(os.path.getsize(os.path.join(root, x)) for x in files)
+        return total
+
+    def evict(self, keep=None):
+        with self.lock:
+            entries = [x for x in os.listdir(self.cache_dir) if os.path.exists(os.path.join(self.cache_dir, x, "plan.json"))]
+            sizes = {x: self.entry_size(x) for x in entries}
+            used = lambda x: os.path.getmtime(os.path.join(self.entry_dir(x), "plan.json"))
+
+            total = sum(sizes.values())
+            for key in sorted(entries, key=used):
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+
+                shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+                total -= sizes[key]
+                print(f"Evicted cached shards {key[:12]}")
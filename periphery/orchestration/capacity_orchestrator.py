@@ -0,0 +1,97 @@
+import os
+
+from periphery.orchestration.orchestrator import Orchestrator
+
+class CapacityOrchestrator(Orchestrator):
+    """
+    Places shards by the capabilities nodes report when registering (see
+    periphery.distributed.capabilities): the most expensive shards go to the fastest nodes that
+    have the memory for them, which minimizes the predicted time of the slowest pipeline stage.
+    A node's speed is that of all its session replicas together.
+    """
+    def __init__(self, submodels, shard_graph, registered_nodes, node_capabilities, master_url, node_replicas=None):
+        super().__init__(submodels, shard_graph, registered_nodes, node_replicas)
+        self.node_capabilities = node_capabilities
+        self.master_url = master_url
+
+        # Nodes that didn't report a score are assumed to be as slow as the slowest that did
+        scores = [x["matmul_flops"] for x in node_capabilities.values() if x.get("matmul_flops")]
+        self.default_speed = min(scores) if scores else 1.0
+
+    def node_speed(self, node):
+        return self.node_capabilities.get(node, {}).get("matmul_flops") or self.default_speed
+
+    def free_memory(self, node):
+        return self.node_capabilities.get(node, {}).get("free_memory")
+
+    def shard_bytes(self, model_id):
+        submodel = self.submodels[model_id]
+        return sum(os.path.getsize(x) for x in [submodel.path] + submodel.get_external_data_files())
+
+    def fits(self, model_id, node):
+        free_memory = self.free_memory(node)
+        return free_memory is None or self.shard_bytes(model_id) <= free_memory
+
+    def get_assignments(self):
+        nodes = [self.master_url] + list(self.registered_nodes)
+        if len(self.submodels) > len(nodes):
+            raise Exception("Too many submodels for world size.")
+        if len(self.submodels) == 0:
+            raise Exception("No submodels included.")
+
+        # The master always runs a shard; the fastest other nodes run the rest, spare nodes copies
+        others = sorted(self.registered_nodes, key=self.pool_speed, reverse=True)
+        selected = others[:len(self.submodels) - 1]
+        spare_nodes = others[len(self.submodels) - 1:]
+
+        # The master's shard can't be copied, so which shard it keeps decides which ones spare
+        # nodes can help with: try each that fits, and keep the fastest bottleneck stage among
+        # the placements where every shard fits its node
+        candidates = [x for x in range(len(self.submodels)) if self.fits(x, self.master_url)]
+        if not candidates:
+            print("The master has the memory for no shard, placing the smallest on it")
+            candidates = [min(range(len(self.submodels)), key=self.shard_bytes)]
+
+        best = None
+        for own_model_id in candidates:
+            assigned_nodes = self.place(own_model_id, selected)
+            replicas = self.assign_replicas(own_model_id, spare_nodes, assigned_nodes)
+
+            placement = dict(assigned_nodes)
+            placement[own_model_id] = self.master_url
+            stage_times = {x: self.stage_time(x, placement) for x in range(len(self.submodels))}
+            bottleneck = max(stage_times, key=stage_times.get)
+            score = (not all(self.fits(x, node) for x, node in assigned_nodes.items()), stage_times[bottleneck])
+            if best is None or score < best[0]:
+                best = (score, own_model_id, assigned_nodes, replicas, bottleneck, placement)
+
+        (overflows, bottleneck_time), own_model_id, assigned_nodes, self.replicas, bottleneck, placement = best
+        for model_id, node in assigned_nodes.items():
+            if not self.fits(model_id, node):
+                print(f"No node has the memory for shard {model_id}, placing it on {node}")
+
+        assigned_models = {node: x for x, node in assigned_nodes.items()}
+        for model_id, replica_nodes in self.replicas.items():
+            for node in replica_nodes:
+                assigned_models[node] = model_id
+
+        print(f"Predicted bottleneck: shard {bottleneck} on {placement[bottleneck]}, {bottleneck_time:.3g}s per request")
+
+        return own_model_id, assigned_models, assigned_nodes
+
+    def place(self, own_model_id, nodes):
+        """
+        Place every shard but the master's on the given nodes. Pairing shards by cost with nodes
+        by speed (of all their replicas) minimizes the largest cost / speed. Returns {model_id: node}.
+        """
+        shard_order = sorted([x for x in range(len(self.submodels)) if x != own_model_id], key=lambda x: -self.shard_graph.nodes[x].compute_cost)
+        free_nodes = sorted(nodes, key=self.pool_speed, reverse=True)
+
+        assigned_nodes = {}
+        for model_id in shard_order:
+            # shards that fit nowhere go to the fastest free node
+            fitting = [x for x in free_nodes if self.fits(model_id, x)] or free_nodes
+            assigned_nodes[model_id] = fitting[0]
+            free_nodes.remove(fitting[0])
+
+        return assigned_nodes
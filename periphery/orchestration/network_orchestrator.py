@@ -0,0 +1,108 @@
+import itertools
+import statistics
+
+from periphery.orchestration.orchestrator import Orchestrator
+
+class NetworkOrchestrator(Orchestrator):
+    """
+    Places shards so that the activations they exchange cross the fastest links, minimizing the
+    predicted transfer time per inference: for every edge of the shard DAG, the round trip plus the
+    edge's tensor bytes over the bandwidth measured between the two nodes (see Server.measure_links).
+    """
+    # Above this many candidate placements, a swap-based local search is used instead
+    max_exhaustive = 20000
+
+    def __init__(self, submodels, shard_graph, registered_nodes, link_costs, master_url, node_replicas=None):
+        super().__init__(submodels, shard_graph, registered_nodes, node_replicas)
+        self.link_costs = link_costs
+        self.master_url = master_url
+        self.predicted_transfer_time = None
+
+        # Links that weren't measured are assumed to be typical
+        measured = [x for targets in link_costs.values() for x in targets.values()]
+        self.default_link = {
+            "rtt": statistics.median([x["rtt"] for x in measured]) if measured else 0.0,
+            "bandwidth": statistics.median([x["bandwidth"] for x in measured]) if measured else 1e9,
+        }
+
+        # bytes sent along each edge of the shard DAG
+        self.edges = []
+        for node in shard_graph.nodes:
+            for connection, labels in node.connection_labels.items():
+                self.edges.append((node.index, connection.index, sum(node.tensor_bytes.get(x, 0) for x in labels)))
+
+    def link_time(self, source, target, n_bytes):
+        if source == target:
+            return 0.0
+        link = self.link_costs.get(source, {}).get(target, self.default_link)
+        return link["rtt"] + n_bytes / link["bandwidth"]
+
+    def transfer_time(self, placement):
+        # placement: node url per model id
+        return sum(self.link_time(placement[source], placement[target], n_bytes) for source, target, n_bytes in self.edges)
+
+    def exhaustive_placement(self, nodes, n_shards):
+        best = None
+        for candidate in itertools.permutations(nodes, n_shards):
+            if self.master_url not in candidate:
+                continue
+            cost = self.transfer_time(candidate)
+            if best is None or cost < best[0]:
+                best = (cost, list(candidate))
+
+        return best[1]
+
+    def local_search_placement(self, nodes, n_shards):
+        placement = [self.master_url] + [x for x in nodes if x != self.master_url][:n_shards - 1]
+        cost = self.transfer_time(placement)
+
+        improved = True
+        while improved:
+            improved = False
+            unused = [x for x in nodes if x not in placement]
+            # swap two shards' nodes, or move a shard to an unused node (the master keeps a shard)
+            moves = [(i, placement[j], j) for i in range(n_shards) for j in range(i + 1, n_shards)]
+            moves += [(i, x, None) for i in range(n_shards) for x in unused if placement[i] != self.master_url]
+            for i, node, j in moves:
+                candidate = list(placement)
+                if j is not None:
+                    candidate[i], candidate[j] = candidate[j], candidate[i]
+                else:
+                    candidate[i] = node
+                candidate_cost = self.transfer_time(candidate)
+                if candidate_cost < cost:
+                    placement, cost, improved = candidate, candidate_cost, True
+                    break
+
+        return placement
+
+    def get_assignments(self):
+        nodes = [self.master_url] + list(self.registered_nodes)
+        n_shards = len(self.submodels)
+        if n_shards > len(nodes):
+            raise Exception("Too many submodels for world size.")
+        if n_shards == 0:
+            raise Exception("No submodels included.")
+
+        n_candidates = 1
+        for x in range(len(nodes) - n_shards + 1, len(nodes) + 1):
+            n_candidates *= x
+
+        if n_candidates <= self.max_exhaustive:
+            placement = self.exhaustive_placement(nodes, n_shards)
+        else:
+            placement = self.local_search_placement(nodes, n_shards)
+
+        self.predicted_transfer_time = self.transfer_time(placement)
+        print(f"Predicted transfer time per inference: {self.predicted_transfer_time:.3g}s")
+
+        own_model_id = placement.index(self.master_url)
+        assigned_nodes = {x: node for x, node in enumerate(placement) if x != own_model_id}
+        assigned_models = {node: x for x, node in assigned_nodes.items()}
+
+        spare_nodes = [x for x in nodes if x not in placement]
+        for model_id, replica_nodes in self.assign_replicas(own_model_id, spare_nodes, assigned_nodes).items():
+            for node in replica_nodes:
+                assigned_models[node] = model_id
+
+        return own_model_id, assigned_models, assigned_nodes
@@ -1,10 +1,61 @@
-
+import collections
 
 class Orchestrator:
-    def __init__(self, submodels, shard_graph, registered_nodes):
+    def __init__(self, submodels, shard_graph, registered_nodes, node_replicas=None):
         self.submodels = submodels
         self.shard_graph = shard_graph
         self.registered_nodes = registered_nodes
+        # Session replicas per node url, as reported on /replicas; nodes not listed run one
+        self.node_replicas = node_replicas or {}
+
+        # Extra nodes per model id, running copies of that shard; see assign_replicas
+        self.replicas = {}
 
     def get_assignments(self):
         pass
+
+    def replicable_models(self, own_model_id):
+        """
+        Model ids whose shard can run on several nodes. Every input of a request must reach the same
+        copy, so only shards fed entirely by a single parent shard qualify: that parent then picks
+        the copy for each request on its own.
+        """
+        parents = collections.defaultdict(set)
+        for node in self.shard_graph.nodes:
+            for connection in node.connection_set:
+                parents[connection.index].add(node.index)
+
+        return [
+            x.index for x in self.shard_graph.nodes
+            if x.index != own_model_id and len(parents[x.index]) == 1 and not x.external_inputs
+        ]
+
+    def node_speed(self, node):
+        # Relative speed of a node; all nodes are alike unless an orchestrator knows better
+        return 1.0
+
+    def pool_speed(self, node):
+        # Speed of all of a node's session replicas together, each taking requests of its own
+        return self.node_speed(node) * self.node_replicas.get(node, 1)
+
+    def stage_time(self, model_id, assigned_nodes=None):
+        # Predicted time per request of a shard, its copies sharing the requests
+        nodes = [assigned_nodes.get(model_id) if assigned_nodes else None] + self.replicas.get(model_id, [])
+        return self.shard_graph.nodes[model_id].compute_cost / sum(self.pool_speed(x) for x in nodes)
+
+    def assign_replicas(self, own_model_id, spare_nodes, assigned_nodes=None):
+        """
+        Place a copy of a shard on each spare node, fastest node first, always adding to the shard
+        with the longest predicted stage time. Returns {model_id: [replica nodes]}, and keeps it in
+        self.replicas.
+        """
+        candidates = self.replicable_models(own_model_id)
+        self.replicas = {}
+        if not candidates:
+            return self.replicas
+
+        for node in sorted(spare_nodes, key=self.pool_speed, reverse=True):
+            model_id = max(candidates, key=lambda x: (self.stage_time(x, assigned_nodes), -len(self.replicas.get(x, []))))
+            self.replicas.setdefault(model_id, []).append(node)
+
+        return self.replicas
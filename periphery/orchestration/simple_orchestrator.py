@@ -1,11 +1,13 @@
 from periphery.orchestration.orchestrator import Orchestrator
 
 class SimpleOrchestrator(Orchestrator):
-    def __init__(self, submodels, shard_graph, registered_nodes):
+    def __init__(self, submodels, shard_graph, registered_nodes, node_replicas=None):
         #super().__init__(submodels, shard_graph, registered_nodes)
         self.submodels = submodels
         self.shard_graph = shard_graph
         self.registered_nodes = registered_nodes
+        self.node_replicas = node_replicas or {}
+        self.replicas = {}
 
     def get_assignments(self):
         if len(self.submodels) > len(self.registered_nodes)+1:
@@ -14,7 +16,8 @@ class SimpleOrchestrator(Orchestrator):
             raise Exception("No submodels included.")
 
         model_stack = self.shard_graph.get_parent_nodes()
-        model_set = set(model_stack)
+        # every shard ever pushed, so shards with several parents are assigned once
+        seen = set(model_stack)
         node_stack = [x for x in self.registered_nodes]
 
         own_model_id = None
@@ -24,11 +27,10 @@ class SimpleOrchestrator(Orchestrator):
 
         while len(model_stack) > 0:
             model_id = model_stack.pop()
-            model_set.remove(model_id)
 
-            new_models = [x.index for x in self.shard_graph.nodes[model_id].connection_set if x not in model_set]
+            new_models = [x.index for x in self.shard_graph.nodes[model_id].connection_set if x.index not in seen]
             model_stack += new_models
-            model_set = model_set.union(set(new_models))
+            seen.update(new_models)
 
             if own_model_id is None:
                 own_model_id = model_id
@@ -37,4 +39,9 @@ class SimpleOrchestrator(Orchestrator):
                 assigned_models[next_node] = model_id
                 assigned_nodes[model_id] =  next_node
 
+        # Nodes left over run extra copies of the most expensive shards
+        for model_id, replica_nodes in self.assign_replicas(own_model_id, node_stack, assigned_nodes).items():
+            for node in replica_nodes:
+                assigned_models[node] = model_id
+
         return own_model_id, assigned_models, assigned_nodes
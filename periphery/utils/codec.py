@@ -0,0 +1,177 @@
+import zlib
+
+import numpy as np
+
+from periphery.utils import wire
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Names the codec of a tensor upload, e.g. "bf16+zstd"; bodies without it are plain wire messages
+CODEC_HEADER = "X-Periphery-Codec"
+
+PRECISIONS = ["fp32", "fp16", "bf16", "int8"]
+COMPRESSIONS = ["zstd", "lz4", "zlib"]
+
+def compressor_available(name):
+    return {"zstd": zstandard is not None, "lz4": lz4 is not None, "zlib": True}[name]
+
+def can_decode(spec):
+    """
+    Whether this node can decode messages encoded with the codec spec, which needs the codec's
+    compressor installed here too.
+    """
+    for part in spec.split("+"):
+        if part in COMPRESSIONS:
+            if not compressor_available(part):
+                return False
+        elif part not in PRECISIONS and part != "none":
+            return False
+
+    return True
+
+def compress(name, data):
+    # fast levels: activations are sent once, and compressing them must cost less than sending them
+    if name == "zstd":
+        return zstandard.ZstdCompressor(level=1).compress(data)
+    if name == "lz4":
+        return lz4.frame.compress(data)
+    return zlib.compress(data, 1)
+
+def decompress(name, data):
+    if name == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    if name == "lz4":
+        return lz4.frame.decompress(data)
+    return zlib.decompress(data)
+
+def to_bf16(array):
+    # the upper half of each float32, rounded to nearest even
+    bits = np.ascontiguousarray(array, dtype=np.float32).view(np.uint32)
+    rounding = ((bits >> 16) & 1) + np.uint32(0x7FFF)
+    return ((bits + rounding) >> 16).astype(np.uint16)
+
+def from_bf16(array):
+    return (array.astype(np.uint32) << 16).view(np.float32)
+
+class Codec:
+    """
+    How tensors travel over one shard edge: float32 activations optionally reduced to fp16, bf16
+    or int8 (symmetric, one scale per tensor), and the message optionally compressed.
+
+    Codecs are named "<precision>[+<compression>]", e.g. "fp16", "bf16+zstd", "zstd" or "fp32".
+    A compression whose module isn't installed falls back to zlib; the name sent with each message
+    is the one actually used, so receivers decode it correctly.
+    """
+    def __init__(self, spec="fp32"):
+        precision, compression = "fp32", None
+        for part in spec.split("+"):
+            if part in PRECISIONS:
+                precision = part
+            elif part in COMPRESSIONS:
+                compression = part
+            elif part and part != "none":
+                raise ValueError(f"Codec {spec} not supported, use precisions {PRECISIONS} and compressions {COMPRESSIONS}")
+
+        if compression is not None and not compressor_available(compression):
+            print(f"{compression} is not installed, compressing with zlib instead")
+            compression = "zlib"
+
+        self.precision = precision
+        self.compression = compression
+
+    @property
+    def spec(self):
+        return self.precision + (f"+{self.compression}" if self.compression else "")
+
+    def is_identity(self):
+        return self.precision == "fp32" and self.compression is None
+
+    def quantize(self, array):
+        # returns the array to send and its wire attributes
+        array = np.asarray(array)
+        if self.precision == "fp32" or array.dtype != np.float32:
+            return array, None
+
+        if self.precision == "fp16":
+            return array.astype(np.float16), {"codec": "fp16"}
+        if self.precision == "bf16":
+            return to_bf16(array), {"codec": "bf16"}
+
+        peak = float(np.max(np.abs(array))) if array.size else 0.0
+        if not np.isfinite(peak):
+            # an inf or NaN would swamp the scale; send the tensor as it is rather than garbled
+            return array, None
+
+        scale = peak / 127 if peak > 0 else 1.0
+        return np.clip(np.rint(array / scale), -127, 127).astype(np.int8), {"codec": "int8", "scale": scale}
+
+    def encode(self, tensors):
+        """
+        Encode a dict of arrays into a message body, returned with the headers to send it with.
+        """
+        arrays = {}
+        attributes = {}
+        for name, tensor in tensors.items():
+            arrays[name], attrs = self.quantize(tensor)
+            if attrs:
+                attributes[name] = attrs
+
+        body = wire.pack_tensors(arrays, attributes)
+        if self.compression:
+            body = compress(self.compression, body)
+
+        return body, {"Content-Type": wire.CONTENT_TYPE, CODEC_HEADER: self.spec}
+
+def dequantize(array, attrs):
+    if attrs is None:
+        return array
+    if attrs["codec"] == "fp16":
+        return array.astype(np.float32)
+    if attrs["codec"] == "bf16":
+        return from_bf16(array)
+    if attrs["codec"] == "int8":
+        return array.astype(np.float32) * np.float32(attrs["scale"])
+
+    raise ValueError(f"Unknown tensor codec {attrs['codec']}")
+
+def assign_edge_codecs(shard_graph, spec, min_bytes=0):
+    """
+    Choose the codec of every edge of a sharding plan: edges sending at least min_bytes (by the
+    predicted tensor_bytes) use spec, smaller ones are sent as they are. Edges of unknown size
+    count as empty.
+
+    Sets each shard node's edge_codecs and returns the number of edges using spec.
+    """
+    Codec(spec)
+
+    assigned = 0
+    for node in shard_graph.nodes:
+        node.edge_codecs = {}
+        for connection, labels in node.connection_labels.items():
+            if sum(node.tensor_bytes.get(x, 0) for x in labels) >= min_bytes:
+                node.edge_codecs[connection.index] = spec
+                assigned += 1
+
+    return assigned
+
+def decode(body, spec):
+    """
+    Decode a message body encoded by Codec(spec).encode, restoring float32 activations.
+    """
+    if not can_decode(spec):
+        raise ValueError(f"Codec {spec} not supported on this node")
+
+    compression = next((x for x in spec.split("+") if x in COMPRESSIONS), None)
+    if compression:
+        body = decompress(compression, body)
+
+    tensors, attributes = wire.decode_tensors(body, return_attributes=True)
+    return {name: dequantize(array, attributes.get(name)) for name, array in tensors.items()}
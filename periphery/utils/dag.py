@@ -1,6 +1,7 @@
 import collections
 
 import numpy as np
+import scipy.sparse as sp
 
 class Node:
     def __init__(self, index=None):
@@ -11,6 +12,16 @@ class Node:
 
         self.external_inputs = set()
 
+        # Predicted compute of this node, and bytes of each tensor (label) it sends, if known
+        self.compute_cost = 0
+        self.tensor_bytes = {}
+
+        # Keys of the model nodes this node stands for, when it is a shard
+        self.members = []
+
+        # Codec of the tensors sent to each connected node (by index), see periphery.utils.codec
+        self.edge_codecs = {}
+
     def add_connection(self, label, nxt):
         self.connection_labels[nxt].add(label)
         self.label_to_connection[label] = nxt
@@ -20,6 +31,33 @@ class DirectedGraph:
     def __init__(self):
         self.nodes = []
 
+    def to_dict(self):
+        return {"nodes": [{
+            "connections": sorted([label, nxt.index] for nxt, labels in node.connection_labels.items() for label in labels),
+            "external_inputs": sorted(node.external_inputs),
+            "compute_cost": node.compute_cost,
+            "tensor_bytes": node.tensor_bytes,
+            "members": node.members,
+            "edge_codecs": {str(k): v for k, v in node.edge_codecs.items()},
+        } for node in self.nodes]}
+
+    @classmethod
+    def from_dict(cls, data):
+        graph = cls()
+        graph.add_nodes([Node() for _ in data["nodes"]])
+
+        for node, node_data in zip(graph.nodes, data["nodes"]):
+            for label, index in node_data["connections"]:
+                node.add_connection(label, graph.nodes[index])
+
+            node.external_inputs = set(node_data["external_inputs"])
+            node.compute_cost = node_data["compute_cost"]
+            node.tensor_bytes = node_data["tensor_bytes"]
+            node.members = node_data["members"]
+            node.edge_codecs = {int(k): v for k, v in node_data.get("edge_codecs", {}).items()}
+
+        return graph
+
     def add_node(self, node):
         node.index = len(self.nodes)
         self.nodes.append(node)
@@ -33,13 +71,25 @@ class DirectedGraph:
     def get_parent_nodes(self):
         non_parents = set()
 
-        for i, node in enumerate(self.nodes):
-            non_parents = non_parents.union(node.connection_set)
+        # update in place; union() would copy the growing set for every node
+        for node in self.nodes:
+            non_parents.update(node.connection_set)
 
         return [i for i, x in enumerate(self.nodes)  if x not in non_parents]
 
-    def undirected_adjacency_matrix(self):
+    def undirected_adjacency_matrix(self, sparse=False):
         n_nodes = len(self.nodes)
+
+        if sparse:
+            # CSR keeps memory proportional to the number of edges rather than n_nodes squared
+            rows = [node_idx for node_idx, node in enumerate(self.nodes) for _ in node.connection_set]
+            cols = [next_node.index for node in self.nodes for next_node in node.connection_set]
+            ones = np.ones(2 * len(rows))
+            adj = sp.csr_matrix((ones, (rows + cols, cols + rows)), shape=(n_nodes, n_nodes))
+            # duplicate (i, j) entries are summed, so cap them back to 1
+            adj.data[:] = 1
+            return adj
+
         adj = np.zeros((n_nodes, n_nodes))
         
         for node_idx, node in enumerate(self.nodes):
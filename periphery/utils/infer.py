@@ -1,9 +1,13 @@
 import requests
-import time
+import asyncio
+import base64
 import io
+import time
 
 import numpy as np
 
+from periphery.utils import wire
+
 # Function to create a sample .npz file
 def create_npz_buffer(input_dict):
     buffer = io.BytesIO()
@@ -13,29 +17,87 @@ def create_npz_buffer(input_dict):
     
     return buffer
 
-def send_for_inference(domain, port, infer_id, input_dict):
-    npz_filename = f"input_{infer_id}.npz"
+def send_for_inference(domain, port, infer_id, input_dict, use_npz=False):
     url = f"http://{domain}:{port}/submit_input/{infer_id}"
 
-    buffer = create_npz_buffer(input_dict)
+    if use_npz:
+        npz_filename = f"input_{infer_id}.npz"
+        buffer = create_npz_buffer(input_dict)
+        return requests.post(url, files={"file": (npz_filename, buffer, wire.NPZ_CONTENT_TYPE)})
+
+    body = wire.pack_tensors(input_dict)
+    return requests.post(url, data=body, headers={"Content-Type": wire.CONTENT_TYPE})
 
-    response = requests.post(url, files={"file": (npz_filename, buffer, "application/octet-stream")})
+def decode_response(response):
+    if response.headers.get("Content-Type", "").startswith(wire.CONTENT_TYPE):
+        return wire.decode_tensors(response.content)
 
-    return response
+    return wire.decode_npz(response.content)
 
-def get_inference_result(domain, port, infer_id):
+def get_inference_result(domain, port, infer_id, poll_timeout=30):
     while True:
         url = f"http://{domain}:{port}/final_output/{infer_id}"
 
-        response = requests.get(url)
+        # Long-poll: the server holds the request until the result lands or poll_timeout passes
+        response = requests.get(url, headers={"Accept": wire.CONTENT_TYPE}, params={"timeout": poll_timeout}, timeout=poll_timeout + 30)
 
         if response.status_code == 200:
-            npz_file_path = f"np_data/output_{infer_id}.npz"
-
-            flo = io.BytesIO(response.content)
-
-            return np.load(flo)
+            return decode_response(response)
         elif response.status_code != 202:
             return None
-        
-        time.sleep(1)
+
+def stream_inference_results(domain, port, infer_ids=None, include_data=True, timeout=None):
+    """
+    Yield (infer_id, outputs) pairs as final outputs land, from the server-sent event stream.
+
+    Parameters:
+    - infer_ids: Ids to wait on; the stream ends once all of them are yielded. None streams every
+      result from the moment the stream opens.
+    - include_data: If False, outputs is None and only the ids of finished requests are yielded.
+      Requests that failed, or whose outputs were evicted, are not yielded.
+    - timeout: Seconds after which the stream is closed and TimeoutError raised. The server's
+      keepalives wake the stream up to check, so it closes within one keepalive period of it.
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    url = f"http://{domain}:{port}/final_output_stream"
+    params = {"include_data": str(include_data).lower()}
+    if infer_ids is not None:
+        params["ids"] = ",".join(str(x) for x in infer_ids)
+
+    with requests.get(url, params=params, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+
+        event = {}
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError(f"Results not all finished within {timeout}s")
+                if line:
+                    if not line.startswith(":"):
+                        field, _, value = line.partition(": ")
+                        event[field] = value
+                    continue
+
+                if event.get("event") == "final_output":
+                    outputs = wire.decode_tensors(base64.b64decode(event["data"])) if include_data else None
+                    yield int(event["id"]), outputs
+                event = {}
+        except requests.exceptions.ConnectionError as e:
+            # a read that timed out, without even a keepalive
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Results not all finished within {timeout}s") from e
+            raise
+
+async def get_inference_result_async(domain, port, infer_id, poll_timeout=30):
+    return await asyncio.to_thread(get_inference_result, domain, port, infer_id, poll_timeout)
+
+async def get_inference_results(domain, port, infer_ids, timeout=None):
+    """
+    Wait on many infer_ids at once over a single result stream, returning {infer_id: outputs}.
+
+    Raises TimeoutError if they aren't all finished within timeout seconds, once the stream is
+    closed, so no thread is left reading it.
+    """
+    collect = lambda: dict(stream_inference_results(domain, port, infer_ids, timeout=timeout))
+
+    return await asyncio.to_thread(collect)
@@ -0,0 +1,161 @@
+import bisect
+import contextlib
+import math
+import threading
+import time
+
+# Seconds, from sub-millisecond tensor decoding to multi-second stages of large models
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for k, v in labels]
+    return "{" + ",".join(f"{k}=\"{v}\"" for k, v in escaped) + "}"
+
+class Metric:
+    """
+    A metric with a fixed set of label names, holding one value per combination of label values.
+    """
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        self.functions = {}
+
+    def key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {list(self.labelnames)}, got {list(labels)}")
+        return tuple(labels[x] for x in self.labelnames)
+
+    def labels_of(self, key):
+        return list(zip(self.labelnames, key))
+
+    def set_function(self, fn, **labels):
+        """
+        Read the value from fn on every scrape, for values (queue depths, memory held, counts kept
+        elsewhere) that are cheaper to read than to keep up to date.
+        """
+        self.functions[self.key(labels)] = fn
+
+    def samples(self):
+        # (name, labels, value) triples, labels as (name, value) pairs
+        with self.lock:
+            samples = [(self.name, self.labels_of(key), value) for key, value in self.values.items()]
+
+        for key, fn in list(self.functions.items()):
+            try:
+                samples.append((self.name, self.labels_of(key), fn()))
+            except Exception as e:
+                # the state a function reads may change under it; skip the sample this once
+                print(f"Reading {self.name} failed: {str(e)}")
+        return samples
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines += [f"{name}{format_labels(labels)} {format_value(value)}" for name, labels, value in self.samples()]
+        return "\n".join(lines)
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+class Gauge(Metric):
+    """
+    A value that goes up and down.
+    """
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            if key not in self.values:
+                # per-bucket (not cumulative) counts, with a last bucket for +Inf, and the sum
+                self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = self.values[key]
+            counts[0][index] += 1
+            counts[1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        value = self.values.get(self.key(labels))
+        return sum(value[0]) if value else 0
+
+    def samples(self):
+        with self.lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+
+        samples = []
+        for key, counts, total in values:
+            labels = self.labels_of(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", labels + [("le", format_value(bound))], cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+
+        return samples
+
+class Registry:
+    """
+    The metrics of a node, rendered in the Prometheus text exposition format by render().
+    """
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        return "\n".join(x.render() for x in self.metrics.values()) + "\n"
@@ -3,11 +3,34 @@ import periphery.utils.dag as dag
 from periphery.utils.topology import infer_topology
 
 from sklearn.cluster import SpectralClustering
+from onnx import helper, shape_inference
+import scipy.sparse as sp
+import numpy as np
 
-def get_partitions_simple(nodes, n_shards):
+import collections
+import math
+
+def _weight_list(nodes, node_weights, costs=None):
+    # node_weights are keyed by node_key; missing nodes fall back to the FLOP estimates of costs, or 1
+    if costs is not None:
+        return [float(costs.node_cost(x, node_weights)) for x in nodes]
+    return [float(node_weights.get(node_key(x), 1.0)) for x in nodes]
+
+def get_partitions_simple(nodes, n_shards, node_weights=None, costs=None):
     # partition the model graph using a greedy algorithm
     total_nodes = len(nodes)
 
+    if node_weights is not None:
+        # contiguous runs of even total weight rather than of even node count
+        prefix = np.cumsum(_weight_list(nodes, node_weights, costs))
+        boundaries = [0]
+        for shard_no in range(1, n_shards):
+            boundary = int(np.searchsorted(prefix, shard_no * prefix[-1] / n_shards)) + 1
+            boundaries.append(min(max(boundary, boundaries[-1] + 1), total_nodes - (n_shards - shard_no)))
+        boundaries.append(total_nodes)
+
+        return [nodes[boundaries[i]:boundaries[i + 1]] for i in range(n_shards)]
+
     shard_size = total_nodes // n_shards
 
     partitions = []
@@ -21,22 +44,162 @@ def get_partitions_simple(nodes, n_shards):
 
     return partitions
 
-def get_partitions_spectral(nodes, n_shards):
+def _heavy_edge_matching(adj, rng):
+    # pair every node with its heaviest unmatched neighbour; returns the coarse node of each node
+    n_nodes = adj.shape[0]
+    indptr, indices, data = adj.indptr, adj.indices, adj.data
+    match = np.full(n_nodes, -1)
+
+    for node in rng.permutation(n_nodes):
+        if match[node] != -1:
+            continue
+        match[node] = node
+
+        best, best_weight = -1, 0
+        for i in range(indptr[node], indptr[node + 1]):
+            neighbour = indices[i]
+            if match[neighbour] == -1 and data[i] > best_weight:
+                best, best_weight = neighbour, data[i]
+        if best != -1:
+            match[best] = node
+
+    _, coarse = np.unique(match, return_inverse=True)
+    return coarse
+
+def _coarsen(adj, weights, coarse):
+    # collapse matched pairs, summing node weights and the weights of parallel edges
+    n_coarse = int(coarse.max()) + 1
+    projection = sp.csr_matrix((np.ones(len(coarse)), (np.arange(len(coarse)), coarse)), shape=(len(coarse), n_coarse))
+
+    coarse_adj = (projection.T @ adj @ projection).tocsr()
+    coarse_adj.setdiag(0)
+    coarse_adj.eliminate_zeros()
+
+    return coarse_adj, projection.T @ weights
+
+def _refine(adj, weights, labels, n_shards, balance_tolerance, passes=2):
+    # greedily move boundary nodes to the partition they are most connected to, if balance allows
+    max_weight = (1 + balance_tolerance) * weights.sum() / n_shards
+    partition_weights = np.bincount(labels, weights=weights, minlength=n_shards)
+
+    for _ in range(passes):
+        connection = np.asarray((adj @ sp.csr_matrix((np.ones(len(labels)), (np.arange(len(labels)), labels)), shape=(len(labels), n_shards))).todense())
+        gains = connection.max(axis=1) - connection[np.arange(len(labels)), labels]
+        candidates = np.flatnonzero(gains > 0)
+
+        moved = 0
+        for node in candidates[np.argsort(-gains[candidates])]:
+            row = slice(adj.indptr[node], adj.indptr[node + 1])
+            connection = np.bincount(labels[adj.indices[row]], weights=adj.data[row], minlength=n_shards)
+
+            target = int(np.argmax(connection))
+            if connection[target] <= connection[labels[node]]:
+                continue
+            if partition_weights[target] + weights[node] > max_weight:
+                continue
+
+            partition_weights[labels[node]] -= weights[node]
+            partition_weights[target] += weights[node]
+            labels[node] = target
+            moved += 1
+
+        if moved == 0:
+            break
+
+    return labels
+
+def _rebalance(adj, weights, labels, n_shards, balance_tolerance):
+    # move boundary nodes out of the heaviest partitions, losing the fewest cut edges, until within
+    # balance. Only nodes next to the target move, so that a chain stays cut into contiguous runs
+    max_weight = (1 + balance_tolerance) * weights.sum() / n_shards
+    partition_weights = np.bincount(labels, weights=weights, minlength=n_shards)
+
+    for _ in range(len(labels)):
+        membership = sp.csr_matrix((np.ones(len(labels)), (np.arange(len(labels)), labels)), shape=(len(labels), n_shards))
+
+        moved = False
+        for source in np.argsort(-partition_weights):
+            members = np.flatnonzero(labels == source)
+            if partition_weights[source] <= max_weight:
+                break
+            if len(members) < 2:
+                continue
+
+            connection = np.asarray((adj[members] @ membership).todense())
+            gains = connection - connection[:, [source]]
+
+            # a move must leave the target lighter than the source was, so every move evens out
+            # the partitions and the loop ends
+            allowed = (connection > 0) & (partition_weights[None, :] + weights[members, None] < partition_weights[source])
+            allowed[:, source] = False
+            if not allowed.any():
+                continue
+
+            node, target = np.unravel_index(np.argmax(np.where(allowed, gains, -np.inf)), gains.shape)
+            partition_weights[source] -= weights[members[node]]
+            partition_weights[target] += weights[members[node]]
+            labels[members[node]] = target
+            moved = True
+            break
+
+        if not moved:
+            break
+
+    return labels
+
+def _spectral_labels(adj, n_shards, n_init, seed):
+    sc = SpectralClustering(n_shards, affinity="precomputed", eigen_solver="arpack", n_init=n_init, random_state=seed)
+    sc.fit(adj)
+
+    return sc.labels_.astype(int)
+
+def get_partitions_spectral(nodes, n_shards, coarsen_to=2000, balance_tolerance=0.1, seed=0, node_weights=None, costs=None):
+    """
+    Partition the model graph with spectral clustering over a sparse adjacency matrix.
+
+    Graphs larger than coarsen_to nodes are partitioned multilevel: heavy-edge matching repeatedly
+    halves the graph, the coarsest graph is clustered, and the labels are projected back level by
+    level with a greedy boundary refinement, so time and memory grow near-linearly with graph size.
+    With node_weights (node_key to cost, the FLOP estimates of costs filling in missing nodes),
+    the clustered partitions are first evened out to within balance_tolerance of the same weight,
+    and the refinement keeps them so; otherwise the refinement balances by node count.
+    """
     # use spectral decomposition to partition the model graph
     node_inputs = [x.input for x in nodes]
     node_outputs = [x.output for x in nodes]
 
     dag = infer_topology(node_inputs, node_outputs)
 
-    adj = dag.undirected_adjacency_matrix()
+    adj = dag.undirected_adjacency_matrix(sparse=True)
+    if node_weights is not None:
+        weights = np.array(_weight_list(nodes, node_weights, costs))
+    else:
+        weights = np.ones(adj.shape[0])
 
-    sc = SpectralClustering(n_shards, affinity="precomputed", n_init=100)
-    sc.fit(adj)
+    rng = np.random.default_rng(seed)
+    levels = []
+    while adj.shape[0] > max(coarsen_to, n_shards):
+        coarse = _heavy_edge_matching(adj, rng)
+        if coarse.max() + 1 > 0.95 * adj.shape[0]:
+            # nothing left to match (e.g. a star graph), cluster at this level
+            break
+
+        levels.append((adj, weights, coarse))
+        adj, weights = _coarsen(adj, weights, coarse)
+
+    labels = _spectral_labels(adj, n_shards, n_init=100 if not levels else 10, seed=seed)
+    if node_weights is not None:
+        # clustering minimizes the cut regardless of weight, so balance the partitions here, where
+        # the graph is small; the refinement of finer levels keeps them balanced
+        labels = _refine(adj, weights, _rebalance(adj, weights, labels, n_shards, balance_tolerance), n_shards, balance_tolerance)
+
+    for adj, weights, coarse in reversed(levels):
+        labels = _refine(adj, weights, labels[coarse], n_shards, balance_tolerance)
 
     # make sure the first node is on partition 0, swap if needed
-    swap_val = int(sc.labels_[0])
+    swap_val = int(labels[0])
     swap_if_needed = lambda x: x if not (x in [0, swap_val]) else {0: swap_val, swap_val: 0}[x]
-    partition_map = [swap_if_needed(int(sc.labels_[i])) for i in range(len(nodes))]
+    partition_map = [swap_if_needed(int(labels[i])) for i in range(len(nodes))]
 
     partitions = [list() for i in range(n_shards)]
 
@@ -44,3 +207,232 @@ def get_partitions_spectral(nodes, n_shards):
         partitions[partition_no].append(nodes[node_no])
 
     return partitions
+
+def node_key(node):
+    # outputs are unique within a graph, unlike node names which may be empty
+    return node.output[0] if len(node.output) > 0 else node.name
+
+class GraphCosts:
+    def __init__(self, node_flops, tensor_bytes, tensor_types=None):
+        # estimated FLOPs per node (keyed by node_key), and estimated bytes per tensor name
+        self.node_flops = node_flops
+        self.tensor_bytes = tensor_bytes
+        # inferred onnx.TypeProto per tensor name, symbolic dimensions kept
+        self.tensor_types = tensor_types or {}
+
+    def node_cost(self, node, node_weights=None):
+        key = node_key(node)
+        if node_weights is not None and key in node_weights:
+            return node_weights[key]
+        return self.node_flops.get(key, 1)
+
+def profile_node_weights(nodes, node_times, costs):
+    """
+    Turn measured node times (seconds per node name, see PeriModel.profile_ops) into node weights
+    for the get_partitions_* functions, keyed by node_key like GraphCosts.
+
+    Measured times are scaled into the units of the FLOP estimates, by the estimated FLOPs per
+    measured second over all measured nodes, so that nodes without a measurement (including
+    unnamed ones) keep their estimate and remain comparable. Every node gets a weight.
+    """
+    measured = [x for x in nodes if x.name in node_times]
+    total_time = sum(node_times[x.name] for x in measured)
+    total_flops = sum(costs.node_flops.get(node_key(x), 1) for x in measured)
+    scale = total_flops / total_time if total_time > 0 else 1.0
+
+    weights = {}
+    for node in nodes:
+        if node.name and node.name in node_times:
+            weights[node_key(node)] = node_times[node.name] * scale
+        else:
+            weights[node_key(node)] = costs.node_flops.get(node_key(node), 1)
+
+    return weights
+
+def _static_shape(tensor_type):
+    # symbolic or unknown dimensions are assumed to be 1, i.e. a single request
+    if not tensor_type.HasField("shape"):
+        return None
+    return [x.dim_value if x.HasField("dim_value") and x.dim_value > 0 else 1 for x in tensor_type.shape.dim]
+
+def _node_flops(node, shapes):
+    output_shape = shapes.get(node.output[0]) if len(node.output) > 0 else None
+    output_elements = math.prod(output_shape) if output_shape is not None else 1
+
+    input_shapes = [shapes.get(x) for x in node.input]
+
+    if node.op_type in ("MatMul", "MatMulInteger", "Gemm") and len(input_shapes) > 1 and input_shapes[0]:
+        # 2 * M * N * K; the reduced dimension K is the last of A (or the first, for a transposed Gemm)
+        a_shape = input_shapes[0]
+        trans_a = any(x.name == "transA" and x.i for x in node.attribute)
+        k = a_shape[-2] if trans_a and len(a_shape) > 1 else a_shape[-1]
+        return 2 * output_elements * k
+
+    if node.op_type in ("Conv", "ConvInteger", "ConvTranspose") and len(input_shapes) > 1 and input_shapes[1]:
+        # every output element is a dot product over C_in/group * kernel elements of the weight
+        return 2 * output_elements * math.prod(input_shapes[1][1:])
+
+    return output_elements
+
+def estimate_costs(model):
+    """
+    Estimate the compute cost of every node and the size of every tensor of an ONNX model.
+
+    Parameters:
+    - model: An onnx.ModelProto. Shape inference runs on a copy, so the model isn't modified.
+    """
+    try:
+        inferred = shape_inference.infer_shapes(model)
+    except Exception as e:
+        print(f"Shape inference failed, costs will be approximate: {str(e)}")
+        inferred = model
+    graph = inferred.graph
+
+    shapes = {}
+    tensor_bytes = {}
+    tensor_types = {}
+    for value_info in list(graph.input) + list(graph.value_info) + list(graph.output):
+        tensor_types[value_info.name] = value_info.type
+        tensor_type = value_info.type.tensor_type
+        shape = _static_shape(tensor_type)
+        if shape is None:
+            continue
+
+        shapes[value_info.name] = shape
+        itemsize = np.dtype(helper.tensor_dtype_to_np_dtype(tensor_type.elem_type)).itemsize if tensor_type.elem_type else 4
+        tensor_bytes[value_info.name] = math.prod(shape) * itemsize
+
+    for init in graph.initializer:
+        shapes[init.name] = list(init.dims)
+        tensor_bytes[init.name] = math.prod(init.dims) * np.dtype(helper.tensor_dtype_to_np_dtype(init.data_type)).itemsize
+
+    node_flops = {node_key(node): _node_flops(node, shapes) for node in model.graph.node}
+
+    return GraphCosts(node_flops, tensor_bytes, tensor_types)
+
+def topological_order(nodes):
+    # Kahn's algorithm over tensor producer/consumer edges, stable with respect to graph order
+    producers = {}
+    for node_no, node in enumerate(nodes):
+        for output in node.output:
+            producers[output] = node_no
+
+    consumers = collections.defaultdict(list)
+    in_degree = [0] * len(nodes)
+    for node_no, node in enumerate(nodes):
+        parents = {producers[x] for x in node.input if x in producers and producers[x] != node_no}
+        in_degree[node_no] = len(parents)
+        for parent in parents:
+            consumers[parent].append(node_no)
+
+    ready = collections.deque(i for i, x in enumerate(in_degree) if x == 0)
+    order = []
+    while ready:
+        node_no = ready.popleft()
+        order.append(node_no)
+        for child in consumers[node_no]:
+            in_degree[child] -= 1
+            if in_degree[child] == 0:
+                ready.append(child)
+
+    if len(order) != len(nodes):
+        raise ValueError("Model graph has a cycle.")
+
+    return order
+
+def cut_bytes(nodes, order, tensor_bytes):
+    """
+    Return the bytes crossing each cut of the topological order, where cuts[p] is the cut
+    between order[p-1] and order[p].
+    """
+    position = {node_no: p for p, node_no in enumerate(order)}
+
+    first_produced = {}
+    last_consumed = {}
+    for node_no, node in enumerate(nodes):
+        for output in node.output:
+            first_produced[output] = position[node_no]
+        for x in node.input:
+            last_consumed[x] = max(last_consumed.get(x, -1), position[node_no])
+
+    # a tensor crosses every cut between its producer and its last consumer
+    delta = np.zeros(len(nodes) + 1)
+    for name, produced_at in first_produced.items():
+        consumed_at = last_consumed.get(name, -1)
+        if consumed_at > produced_at:
+            delta[produced_at + 1] += tensor_bytes.get(name, 0)
+            delta[consumed_at + 1] -= tensor_bytes.get(name, 0)
+
+    return np.cumsum(delta)
+
+def get_partitions_cost_aware(model, n_shards, node_weights=None, balance_tolerance=0.1, costs=None):
+    """
+    Partition an ONNX model into contiguous runs of its topological order, balancing estimated
+    compute while cutting where the fewest bytes cross between shards.
+
+    Parameters:
+    - model: An onnx.ModelProto
+    - n_shards: Number of partitions to produce
+    - node_weights: Optional dict mapping node keys (see node_key) to costs, used instead of the FLOP estimates
+    - balance_tolerance: How far (as a fraction of an even share) a shard may drift from an even
+      share of compute to find a cheaper cut
+    - costs: Optional precomputed GraphCosts
+    """
+    nodes = model.graph.node
+    if n_shards > len(nodes):
+        raise ValueError("Number of shards exceeds the number of nodes in the model.")
+
+    if costs is None:
+        costs = estimate_costs(model)
+
+    order = topological_order(nodes)
+    # free ops (reshapes, casts, ...) still weigh a little, so they don't pile up in one shard
+    weights = [max(float(costs.node_cost(nodes[x], node_weights)), 1.0) for x in order]
+    prefix = np.concatenate([[0], np.cumsum(weights)])
+    cuts = cut_bytes(nodes, order, costs.tensor_bytes)
+
+    total = prefix[-1]
+    share = total / n_shards
+
+    boundaries = [0]
+    for shard_no in range(1, n_shards):
+        target = shard_no * share
+        low = boundaries[-1] + 1
+        high = len(order) - (n_shards - shard_no)
+
+        candidates = [p for p in range(low, high + 1) if abs(prefix[p] - target) <= balance_tolerance * share]
+        if not candidates:
+            candidates = [min(range(low, high + 1), key=lambda p: abs(prefix[p] - target))]
+
+        boundaries.append(min(candidates, key=lambda p: (cuts[p], abs(prefix[p] - target))))
+    boundaries.append(len(order))
+
+    return [[nodes[x] for x in order[boundaries[i]:boundaries[i + 1]]] for i in range(n_shards)]
+
+def partition_report(partitions, costs, node_weights=None):
+    """
+    Predict per-shard compute, and the bytes each shard receives from and sends to other shards.
+
+    Parameters:
+    - partitions: A list of node lists, as returned by the get_partitions_* functions
+    - costs: GraphCosts for the model
+    - node_weights: Optional dict mapping node keys (see node_key) to costs, used instead of the FLOP estimates
+    """
+    producer_shard = {}
+    for shard_no, partition in enumerate(partitions):
+        for node in partition:
+            for output in node.output:
+                producer_shard[output] = shard_no
+
+    report = [{"compute": 0, "received_bytes": 0, "sent_bytes": 0} for _ in partitions]
+    for shard_no, partition in enumerate(partitions):
+        received = set()
+        for node in partition:
+            report[shard_no]["compute"] += costs.node_cost(node, node_weights)
+            received.update(x for x in node.input if x in producer_shard and producer_shard[x] != shard_no)
+
+        for name in received:
+            report[shard_no]["received_bytes"] += costs.tensor_bytes.get(name, 0)
+            report[producer_shard[name]]["sent_bytes"] += costs.tensor_bytes.get(name, 0)
+
+    return report
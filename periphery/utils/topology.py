@@ -1,3 +1,5 @@
+import collections
+
 import periphery.utils.dag as dag
 
 def infer_topology(inputs, outputs, initializer_set=None):
@@ -19,12 +21,13 @@ def infer_topology(inputs, outputs, initializer_set=None):
 
     graph.add_nodes(nodes)
     
-    input_mapping = {}
     output_mapping = {}
 
+    # a tensor may feed several shards/nodes
+    input_mapping = collections.defaultdict(list)
     for input_no, input_names in enumerate(inputs):
         for input_name in input_names:
-            input_mapping[input_name] = input_no
+            input_mapping[input_name].append(input_no)
 
     for input_no, output_names in enumerate(outputs):
         for output_name in output_names:
@@ -32,12 +35,11 @@ def infer_topology(inputs, outputs, initializer_set=None):
 
     for input_no, _ in enumerate(inputs):
         for output in list(outputs[input_no]):
-            if output in input_mapping:
-                next_node = nodes[input_mapping[output]]
-                nodes[input_no].add_connection(output, next_node)
+            for consumer_no in input_mapping.get(output, []):
+                nodes[input_no].add_connection(output, nodes[consumer_no])
 
     for input_no, input_names in enumerate(inputs):
         external_inputs = [x for x in input_names if x not in output_mapping and x not in initializer_set]
-        nodes[input_no].external_inputs = nodes[input_no].external_inputs.union(set(external_inputs))
+        nodes[input_no].external_inputs.update(external_inputs)
     
     return graph
@@ -0,0 +1,93 @@
+import collections
+import threading
+
+# Carries "<trace_id>:<sampled>" with every tensor post, so downstream nodes join the same trace
+TRACE_HEADER = "X-Periphery-Trace"
+
+class Tracer:
+    """
+    Records spans (receive, wait_inputs, queue, run, send, ...) of sampled requests on one node.
+
+    A request's trace is decided where it enters the cluster and travels in TRACE_HEADER. Without a
+    header the decision is a hash of the infer_id, so nodes receiving separate inputs of the same
+    request agree without coordinating. Span times are wall clock seconds, so spans of different
+    nodes line up as well as their clocks do.
+    """
+    def __init__(self, sample_rate=0.0, max_spans=100000, max_contexts=10000):
+        self.sample_rate = sample_rate
+        self.spans = collections.deque(maxlen=max_spans)
+        # (trace_id, sampled) per infer_id in flight on this node, oldest first
+        self.contexts = collections.OrderedDict()
+        self.max_contexts = max_contexts
+        self.lock = threading.Lock()
+
+    def should_sample(self, infer_id):
+        # multiplicative hashing spreads consecutive ids evenly over [0, 1)
+        return (infer_id * 2654435761 % 2**32) / 2**32 < self.sample_rate
+
+    def begin(self, infer_id, header=None):
+        """
+        Join the trace of infer_id, as given by an upstream node's header or else by sampling.
+        Returns whether the request is sampled.
+        """
+        with self.lock:
+            if infer_id not in self.contexts:
+                context = None
+                if header:
+                    trace_id, _, sampled = header.partition(":")
+                    context = (trace_id, sampled == "1")
+                if context is None:
+                    context = (str(infer_id), self.should_sample(infer_id))
+
+                self.contexts[infer_id] = context
+                while len(self.contexts) > self.max_contexts:
+                    self.contexts.popitem(last=False)
+
+            return self.contexts[infer_id][1]
+
+    def end(self, infer_id):
+        with self.lock:
+            self.contexts.pop(infer_id, None)
+
+    def header(self, infer_id):
+        # headers for posts about infer_id; unsampled traces are propagated too, so that
+        # downstream nodes don't sample them on their own
+        context = self.contexts.get(infer_id)
+        if context is None:
+            return {}
+        return {TRACE_HEADER: f"{context[0]}:{int(context[1])}"}
+
+    def record(self, infer_id, name, start, end, **args):
+        context = self.contexts.get(infer_id)
+        if context is None or not context[1]:
+            return
+
+        self.spans.append({"trace_id": context[0], "infer_id": infer_id, "name": name, "start": start, "end": end, "args": args})
+
+    def get_spans(self, infer_id=None):
+        spans = list(self.spans)
+        if infer_id is not None:
+            spans = [x for x in spans if x["infer_id"] == infer_id]
+        return spans
+
+def to_chrome_trace(node_spans):
+    """
+    Build a Chrome trace / Perfetto JSON timeline from the spans of every node ({node: spans}):
+    one process per node, one thread per request.
+    """
+    events = []
+    for pid, (node, spans) in enumerate(node_spans.items()):
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": node}})
+        for span in spans:
+            events.append({
+                "name": span["name"],
+                "cat": "periphery",
+                "ph": "X",
+                "ts": span["start"] * 1e6,
+                "dur": max(span["end"] - span["start"], 0) * 1e6,
+                "pid": pid,
+                "tid": span["infer_id"],
+                "args": dict(span["args"], trace_id=span["trace_id"]),
+            })
+
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
@@ -0,0 +1,130 @@
+import io
+import json
+import struct
+
+import numpy as np
+
+# Framed tensor format used between nodes:
+#   MAGIC | u32 header length | JSON header | padding | tensor buffers (each 64-byte aligned)
+# The JSON header lists name, dtype, shape, offset and nbytes for every tensor. Offsets are
+# relative to the first aligned byte after the header, so the receiver can view tensors in place.
+# Entries may carry an "attrs" dict, e.g. how a tensor was quantized (see periphery.utils.codec).
+CONTENT_TYPE = "application/x-peri-tensors"
+# Content type of the npz files sent to and served to nodes that predate the format
+NPZ_CONTENT_TYPE = "application/octet-stream"
+
+MAGIC = b"PRT1"
+ALIGNMENT = 64
+
+_PREFIX = struct.Struct("<4sI")
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def _as_wire_array(value):
+    array = np.require(value, requirements="C")
+    if array.dtype.hasobject:
+        raise ValueError("Object arrays can't be sent over the wire.")
+
+    return array
+
+def encode_tensors(tensors, attributes=None):
+    """
+    Encode a dict of arrays into a list of frames, without copying the array data.
+
+    Parameters:
+    - tensors: A dict mapping tensor names to numpy arrays (or array-likes)
+    - attributes: An optional dict mapping tensor names to JSON-serializable dicts sent along with them
+
+    Returns a list of bytes-like frames; concatenated, they form one message.
+    """
+    arrays = {name: _as_wire_array(value) for name, value in tensors.items()}
+
+    entries = []
+    offset = 0
+    for name, array in arrays.items():
+        entries.append({"name": name, "dtype": array.dtype.str, "shape": list(array.shape), "offset": offset, "nbytes": array.nbytes})
+        if attributes and name in attributes:
+            entries[-1]["attrs"] = attributes[name]
+        offset = _align(offset + array.nbytes)
+
+    header = json.dumps(entries).encode()
+    header_end = _PREFIX.size + len(header)
+
+    frames = [_PREFIX.pack(MAGIC, len(header)), header, bytes(_align(header_end) - header_end)]
+
+    position = 0
+    for entry, array in zip(entries, arrays.values()):
+        if entry["offset"] > position:
+            frames.append(bytes(entry["offset"] - position))
+        frames.append(memoryview(array.reshape(-1).view(np.uint8)))
+        position = entry["offset"] + entry["nbytes"]
+
+    return frames
+
+def pack_tensors(tensors, attributes=None):
+    """
+    Encode a dict of arrays into a single contiguous buffer, copying each array exactly once.
+    """
+    frames = encode_tensors(tensors, attributes)
+
+    buffer = bytearray(sum(len(frame) for frame in frames))
+    view = memoryview(buffer)
+
+    position = 0
+    for frame in frames:
+        view[position:position + len(frame)] = frame
+        position += len(frame)
+
+    return buffer
+
+def decode_tensors(buffer, return_attributes=False):
+    """
+    Decode a message produced by encode_tensors/pack_tensors.
+
+    The returned arrays are views into the given buffer, so no tensor data is copied. They are
+    read-only when the buffer is immutable (e.g. bytes). With return_attributes, the attributes
+    of the tensors that have them are returned too, as a dict by tensor name.
+    """
+    view = memoryview(buffer)
+    if len(view) < _PREFIX.size:
+        raise ValueError("Message is too short to hold a tensor header.")
+
+    magic, header_len = _PREFIX.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError("Message is not in the Periphery tensor format.")
+
+    header_end = _PREFIX.size + header_len
+    entries = json.loads(bytes(view[_PREFIX.size:header_end]))
+    data_start = _align(header_end)
+
+    tensors = {}
+    attributes = {}
+    for entry in entries:
+        dtype = np.dtype(entry["dtype"])
+        offset = data_start + entry["offset"]
+        if offset + entry["nbytes"] > len(view):
+            raise ValueError(f"Tensor {entry['name']} lies outside of the message.")
+
+        array = np.frombuffer(view, dtype=dtype, count=entry["nbytes"] // dtype.itemsize, offset=offset)
+        tensors[entry["name"]] = array.reshape(tuple(entry["shape"]))
+        if "attrs" in entry:
+            attributes[entry["name"]] = entry["attrs"]
+
+    if return_attributes:
+        return tensors, attributes
+    return tensors
+
+def encode_npz(tensors):
+    buffer = io.BytesIO()
+    np.savez(buffer, **{k: np.asarray(v) for k, v in tensors.items()})
+    buffer.seek(0)
+
+    return buffer
+
+def decode_npz(buffer):
+    with np.load(io.BytesIO(buffer)) as np_contents:
+        return {k: np_contents[k] for k in np_contents}
+
+def accepts_wire_format(accept_header):
+    return accept_header is not None and CONTENT_TYPE in accept_header
@@ -0,0 +1,71 @@
+"""
+Per-call latency and output allocations of PeriModel.infer, with and without IOBinding into reused
+output buffers. Outputs are released after every call, as the TaskManager does once they are sent.
+
+Output arrays returned by session.run are allocated by ONNX Runtime, out of sight of tracemalloc,
+so allocations are counted as the bytes of distinct output buffers seen per call, with every
+output kept alive so that addresses can't be recycled.
+
+Usage:
+    python -m tests.benchmarks.binding_bench [--nodes 64] [--hidden 64 256 512] [--calls 200]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import onnx
+
+from periphery.model.model import PeriModel, SessionConfig
+
+from tests.benchmarks.synthetic import make_synthetic_model
+
+def measure(model, inputs, calls):
+    # warm up, so the first run (and the bound path's buffer allocation) isn't counted
+    for _ in range(5):
+        model.release_outputs(model.infer(inputs))
+
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        outputs = model.infer(inputs)
+        latencies.append(time.perf_counter() - start)
+        model.release_outputs(outputs)
+
+    return np.array(latencies) * 1e6
+
+def allocated_per_call(model, inputs, calls):
+    held = []
+    buffers = {}
+    for _ in range(calls):
+        outputs = model.infer(inputs)
+        held.append(dict(outputs))
+        buffers.update({x.ctypes.data: x.nbytes for x in outputs.values()})
+        model.release_outputs(outputs)
+
+    return sum(buffers.values()) / calls
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=64)
+    parser.add_argument("--hidden", type=int, nargs="+", default=[64, 256, 512])
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'hidden':>8}  {'mode':<12}{'mean us':>10}{'p50 us':>10}{'p99 us':>10}{'alloc KB/call':>15}")
+    for hidden in args.hidden:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "model.onnx")
+            onnx.save(make_synthetic_model("chain", args.nodes, hidden=hidden), path)
+            inputs = {"input": np.random.default_rng(0).random((hidden, hidden), dtype=np.float32)}
+
+            for mode, io_binding in (("run", False), ("io_binding", True)):
+                model = PeriModel(path, session_config=SessionConfig(cache_optimized_model=False, io_binding=io_binding))
+                latencies = measure(model, inputs, args.calls)
+                allocated = allocated_per_call(model, inputs, args.calls)
+
+                print(f"{hidden:>8}  {mode:<12}{latencies.mean():>10.1f}{np.percentile(latencies, 50):>10.1f}{np.percentile(latencies, 99):>10.1f}{allocated / 1024:>15.1f}")
+
+if __name__ == "__main__":
+    main()
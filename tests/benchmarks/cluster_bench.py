@@ -0,0 +1,281 @@
+"""
+Throughput and latency of a local cluster: a master and N workers, each a main.py process on its
+own localhost port, serving a synthetic (or given) model sharded across all of them.
+
+Requests arrive open loop, at a fixed average rate whether or not earlier ones have finished, so
+queueing shows up as latency instead of slowing the load down. Each request sends its inputs to
+the nodes the master's /parents names, and is timed from its scheduled arrival until the master's
+result stream reports it. Per-node CPU and RSS are sampled while each rate runs.
+
+Results are printed as a table and, with --output, saved as JSON (with the git commit) so that runs
+can be compared across commits.
+
+Usage:
+    python -m tests.benchmarks.cluster_bench [--workers 2] [--rates 10 50 100] [--duration 10]
+        [--shape chain --nodes 200 --hidden 64 | --model_path model.onnx] [--output results.json]
+        [--node_args "--max_batch_size 4"]
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import onnx
+import psutil
+import requests
+
+from periphery.model.model import PeriModel
+from periphery.utils import wire
+from periphery.utils.infer import stream_inference_results
+
+from tests.benchmarks.synthetic import SHAPES, make_synthetic_model
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+class Cluster:
+    """
+    A master and workers main.py processes, each in its own process group so that stop() takes
+    down whatever they spawned.
+    """
+    def __init__(self, model_path, n_workers, n_shards, base_port, work_dir, node_args):
+        self.base_port = base_port
+        self.master_url = f"http://127.0.0.1:{base_port}"
+        self.processes = {}
+
+        common = [sys.executable, "main.py", "--master_port", str(base_port)] + node_args
+        commands = {self.master_url: common + ["--master", "--port", str(base_port), "--model_path", model_path,
+                                               "--num_shards", str(n_shards), "--num_nodes", str(n_workers + 1),
+                                               "--shard_cache_dir", os.path.join(work_dir, "shard_cache")]}
+        for i in range(1, n_workers + 1):
+            worker_dir = os.path.join(work_dir, f"worker_{i}")
+            os.makedirs(worker_dir, exist_ok=True)
+            commands[f"http://127.0.0.1:{base_port + i}"] = common + ["--port", str(base_port + i), "--model_path", os.path.join(worker_dir, "shard.onnx")]
+
+        env = dict(os.environ, PYTHONUNBUFFERED="1")
+        for url, command in commands.items():
+            log = open(os.path.join(work_dir, f"node_{url.rsplit(':', 1)[1]}.log"), "w")
+            self.processes[url] = subprocess.Popen(command, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT, env=env, start_new_session=True)
+            if url == self.master_url:
+                # workers register with the master, so it has to be up first
+                self.wait_for(lambda: requests.get(f"{self.master_url}/", timeout=1), timeout=60)
+
+    def wait_for(self, fn, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            for url, process in self.processes.items():
+                if process.poll() is not None:
+                    raise Exception(f"Node {url} exited with code {process.returncode}")
+            try:
+                result = fn()
+                if result:
+                    return result
+            except requests.exceptions.RequestException:
+                pass
+            if time.monotonic() > deadline:
+                raise Exception("Timed out waiting for the cluster")
+            time.sleep(0.5)
+
+    def parents(self, timeout):
+        return self.wait_for(lambda: requests.get(f"{self.master_url}/parents", timeout=1).json()["parents"], timeout)
+
+    def stop(self):
+        for process in self.processes.values():
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            process.wait()
+
+class ResourceSampler:
+    """
+    Samples the CPU use and RSS of every node process (and its children) in the background.
+    """
+    def __init__(self, processes, interval=0.5):
+        self.processes = {url: psutil.Process(x.pid) for url, x in processes.items()}
+        self.interval = interval
+        self.samples = {url: [] for url in processes}
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def tree(self, process):
+        return [process] + process.children(recursive=True)
+
+    def run(self):
+        for process in self.processes.values():
+            for x in self.tree(process):
+                x.cpu_percent()
+
+        while not self.stopping.wait(self.interval):
+            for url, process in self.processes.items():
+                try:
+                    tree = self.tree(process)
+                    self.samples[url].append((sum(x.cpu_percent() for x in tree), sum(x.memory_info().rss for x in tree)))
+                except psutil.NoSuchProcess:
+                    pass
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopping.set()
+        self.thread.join()
+
+    def summary(self):
+        return {
+            url: {
+                "cpu_percent": float(np.mean([x for x, _ in samples])) if samples else None,
+                "max_rss_mb": max(x for _, x in samples) / 2**20 if samples else None,
+            } for url, samples in self.samples.items()
+        }
+
+def send_request(session, parents, infer_id, inputs):
+    for url, names in parents.items():
+        tensors = {k: v for k, v in inputs.items() if k in names}
+        response = session.post(f"{url}/submit_input/{infer_id}", data=wire.pack_tensors(tensors), headers={"Content-Type": wire.CONTENT_TYPE}, timeout=60)
+        response.raise_for_status()
+
+def run_rate(cluster, parents, inputs, rate, duration, first_id, arrivals, drain_timeout, seed):
+    """
+    Offer rate requests per second for duration seconds, open loop, and time every request from
+    its scheduled arrival until the master reports its result.
+    """
+    rng = np.random.default_rng(seed)
+    n_requests = max(1, int(rate * duration))
+    if arrivals == "poisson":
+        offsets = np.cumsum(rng.exponential(1 / rate, n_requests))
+    else:
+        offsets = np.arange(n_requests) / rate
+    infer_ids = list(range(first_id, first_id + n_requests))
+
+    completed = {}
+    def collect():
+        try:
+            for infer_id, _ in stream_inference_results("127.0.0.1", cluster.base_port, infer_ids, include_data=False):
+                completed[infer_id] = time.perf_counter()
+        except requests.exceptions.RequestException as e:
+            print(f"Result stream failed: {str(e)}")
+    collector = threading.Thread(target=collect, daemon=True)
+    collector.start()
+    # let the stream subscribe before the first result can land
+    time.sleep(0.2)
+
+    sessions = threading.local()
+    def submit(infer_id):
+        if not hasattr(sessions, "session"):
+            sessions.session = requests.Session()
+        send_request(sessions.session, parents, infer_id, inputs)
+
+    errors = 0
+    scheduled = {}
+    with ResourceSampler(cluster.processes) as sampler:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=64) as executor:
+            start = time.perf_counter()
+            futures = []
+            for infer_id, offset in zip(infer_ids, offsets):
+                delay = start + offset - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                scheduled[infer_id] = start + offset
+                futures.append(executor.submit(submit, infer_id))
+
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors += 1
+
+        collector.join(timeout=drain_timeout)
+
+    latencies = np.array([completed[x] - scheduled[x] for x in infer_ids if x in completed]) * 1000
+    elapsed = max(completed.values()) - start if completed else 0
+    result = {
+        "rate": rate,
+        "sent": n_requests,
+        "completed": len(completed),
+        "errors": errors,
+        "throughput": len(completed) / elapsed if elapsed > 0 else 0.0,
+        "nodes": sampler.summary(),
+    }
+    for p in (50, 95, 99):
+        result[f"p{p}_ms"] = float(np.percentile(latencies, p)) if len(latencies) else None
+
+    return result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--shards", type=int, default=None, help="Defaults to one per node.")
+    parser.add_argument("--rates", type=float, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--arrivals", choices=["poisson", "uniform"], default="poisson")
+    parser.add_argument("--model_path", type=str, default=None, help="Serve this model instead of a synthetic one.")
+    parser.add_argument("--shape", choices=SHAPES, default="chain")
+    parser.add_argument("--nodes", type=int, default=200)
+    parser.add_argument("--hidden", type=int, default=64)
+    parser.add_argument("--base_port", type=int, default=29700)
+    parser.add_argument("--node_args", type=str, default="", help="Extra arguments for every main.py, e.g. \"--max_batch_size 4\".")
+    parser.add_argument("--startup_timeout", type=float, default=120)
+    parser.add_argument("--drain_timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None, help="Save the results to this JSON file.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        model_path = args.model_path and os.path.abspath(args.model_path)
+        if model_path is None:
+            model_path = os.path.join(work_dir, "model.onnx")
+            onnx.save(make_synthetic_model(args.shape, args.nodes, hidden=args.hidden), model_path)
+        inputs = PeriModel(model_path).get_dummy_inputs()
+        inputs = {k: np.random.default_rng(args.seed).random(v.shape).astype(v.dtype) for k, v in inputs.items()}
+
+        n_shards = args.shards or args.workers + 1
+        cluster = Cluster(model_path, args.workers, n_shards, args.base_port, work_dir, shlex.split(args.node_args))
+        try:
+            parents = cluster.parents(args.startup_timeout)
+            # one request end to end, so every shard is loaded and warm before timing starts
+            warmup = run_rate(cluster, parents, inputs, 1, 1, 0, "uniform", args.startup_timeout, args.seed)
+            if warmup["completed"] == 0:
+                raise Exception(f"The cluster didn't answer, see the logs in {work_dir}")
+
+            results = []
+            first_id = 1
+            for rate in args.rates:
+                results.append(run_rate(cluster, parents, inputs, rate, args.duration, first_id, args.arrivals, args.drain_timeout, args.seed))
+                first_id += results[-1]["sent"]
+        finally:
+            cluster.stop()
+
+    print(f"{'rate':>8}{'sent':>8}{'done':>8}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for x in results:
+        latency = "".join(f"{x[f'p{p}_ms']:>10.1f}" if x[f"p{p}_ms"] is not None else f"{'-':>10}" for p in (50, 95, 99))
+        print(f"{x['rate']:>8g}{x['sent']:>8}{x['completed']:>8}{x['errors']:>8}{x['throughput']:>9.1f}{latency}")
+
+    print(f"\n{'rate':>8}  {'node':<26}{'cpu %':>8}{'max rss MB':>12}")
+    for x in results:
+        for url, node in x["nodes"].items():
+            cpu = f"{node['cpu_percent']:>8.0f}" if node["cpu_percent"] is not None else f"{'-':>8}"
+            rss = f"{node['max_rss_mb']:>12.0f}" if node["max_rss_mb"] is not None else f"{'-':>12}"
+            print(f"{x['rate']:>8g}  {url:<26}{cpu}{rss}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"commit": git_commit(), "time": time.time(), "config": vars(args), "results": results}, f, indent=2)
+        print(f"\nSaved results to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Bytes on the wire, encode and decode time, and output error of every edge codec, on a synthetic
+(or given) model sharded as the master would shard it.
+
+The shards run one after another in this process. Every tensor a shard sends to another goes
+through the codec exactly as between nodes (Codec.encode, then codec.decode), so each edge's
+receiver computes on what it would really receive. The final outputs are compared with those of
+the unsharded model. Transfer time is estimated from the wire bytes at --bandwidth_mbps, to weigh
+the codec's CPU time against the bytes it saves.
+
+Usage:
+    python -m tests.benchmarks.codec_bench [--codecs fp32 zstd fp16 bf16+zstd int8+zstd]
+        [--shape transformer --nodes 60 --hidden 256 | --model_path model.onnx] [--shards 4]
+        [--runs 10] [--bandwidth_mbps 1000]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import onnx
+import onnxruntime as ort
+
+from periphery.model.model import PeriModel
+from periphery.model.shard import shard_onnx_model
+from periphery.utils import codec
+
+from tests.benchmarks.synthetic import SHAPES, make_synthetic_model
+
+CODECS = ["fp32", "zlib", "zstd", "lz4", "fp16", "bf16", "int8", "bf16+zstd", "int8+zstd"]
+
+def run_sharded(sessions, shard_dag, inputs, edge_codec):
+    """
+    Run the shards in dependency order, sending every inter-shard edge through edge_codec.
+
+    Returns the tensors produced by the shards, and the tensor bytes, wire bytes, encode and
+    decode seconds summed over all edges.
+    """
+    received = {x: {k: v for k, v in inputs.items() if k in shard_dag.nodes[x].external_inputs} for x in range(len(sessions))}
+    produced = {}
+    raw_bytes, wire_bytes, encode_seconds, decode_seconds = 0, 0, 0.0, 0.0
+
+    pending = list(range(len(sessions)))
+    while pending:
+        for shard_no in pending:
+            session = sessions[shard_no]
+            names = [x.name for x in session.get_inputs()]
+            if all(x in received[shard_no] for x in names):
+                break
+        else:
+            raise Exception(f"Shards {pending} are missing inputs")
+        pending.remove(shard_no)
+
+        outputs = dict(zip([x.name for x in session.get_outputs()], session.run(None, {x: received[shard_no][x] for x in names})))
+        produced.update(outputs)
+
+        for connection, labels in shard_dag.nodes[shard_no].connection_labels.items():
+            sent = {x: outputs[x] for x in labels}
+            start = time.perf_counter()
+            body, headers = edge_codec.encode(sent)
+            body = bytes(body)
+            encoded = time.perf_counter()
+            tensors = codec.decode(body, headers[codec.CODEC_HEADER])
+            decode_seconds += time.perf_counter() - encoded
+            encode_seconds += encoded - start
+            raw_bytes += sum(x.nbytes for x in sent.values())
+            wire_bytes += len(body)
+
+            received[connection.index].update(tensors)
+
+    return produced, raw_bytes, wire_bytes, encode_seconds, decode_seconds
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codecs", nargs="+", default=CODECS)
+    parser.add_argument("--model_path", type=str, default=None, help="Benchmark this model instead of a synthetic one.")
+    parser.add_argument("--shape", choices=SHAPES, default="transformer")
+    parser.add_argument("--nodes", type=int, default=60)
+    parser.add_argument("--hidden", type=int, default=256)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--partitioner", type=str, default="simple")
+    parser.add_argument("--runs", type=int, default=10, help="Timings are the median over this many runs.")
+    parser.add_argument("--bandwidth_mbps", type=float, default=1000, help="Link bandwidth for the estimated transfer time.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model_path and os.path.abspath(args.model_path)
+        if model_path is None:
+            model_path = os.path.join(tmp, "model.onnx")
+            onnx.save(make_synthetic_model(args.shape, args.nodes, hidden=args.hidden), model_path)
+
+        model = PeriModel(model_path)
+        rng = np.random.default_rng(args.seed)
+        inputs = {k: rng.standard_normal(v.shape).astype(v.dtype) if np.issubdtype(v.dtype, np.floating) else v
+                  for k, v in model.get_dummy_inputs().items()}
+
+        reference_session = ort.InferenceSession(model_path)
+        reference = dict(zip([x.name for x in reference_session.get_outputs()], reference_session.run(None, inputs)))
+
+        shard_paths = [os.path.join(tmp, f"shard_{i}.onnx") for i in range(args.shards)]
+        shard_dag = shard_onnx_model(model, args.shards, shard_paths, partitioner=args.partitioner)
+        sessions = [ort.InferenceSession(x) for x in shard_paths]
+
+        print(f"\n{'codec':<14}{'used':<14}{'wire KB':>10}{'ratio':>8}{'enc ms':>9}{'dec ms':>9}{'xfer ms':>9}{'total ms':>10}{'max err':>11}{'rel err':>11}")
+        for spec in args.codecs:
+            edge_codec = codec.Codec(spec)
+            runs = [run_sharded(sessions, shard_dag, inputs, edge_codec) for _ in range(args.runs)]
+            produced, raw_bytes, wire_bytes = runs[0][:3]
+            encode_ms = np.median([x[3] for x in runs]) * 1000
+            decode_ms = np.median([x[4] for x in runs]) * 1000
+            transfer_ms = wire_bytes * 8 / (args.bandwidth_mbps * 1e6) * 1000
+            ratio = f"{raw_bytes / wire_bytes:>8.2f}" if wire_bytes else f"{'-':>8}"
+
+            max_error, squared_error, squared_norm = 0.0, 0.0, 0.0
+            for name, expected in reference.items():
+                difference = produced[name].astype(np.float64) - expected
+                max_error = max(max_error, float(np.max(np.abs(difference))) if difference.size else 0.0)
+                squared_error += float(np.sum(difference ** 2))
+                squared_norm += float(np.sum(expected.astype(np.float64) ** 2))
+            relative_error = np.sqrt(squared_error / squared_norm) if squared_norm > 0 else 0.0
+
+            print(f"{spec:<14}{edge_codec.spec:<14}{wire_bytes / 1024:>10.1f}{ratio}{encode_ms:>9.2f}{decode_ms:>9.2f}"
+                  f"{transfer_ms:>9.2f}{encode_ms + decode_ms + transfer_ms:>10.2f}{max_error:>11.2e}{relative_error:>11.2e}", flush=True)
+
+if __name__ == "__main__":
+    main()
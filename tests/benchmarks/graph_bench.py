@@ -0,0 +1,95 @@
+"""
+Time and peak memory of each stage of sharding, on synthetic chain, branching and transformer
+graphs from a thousand to a million nodes, to see where sharding stops being interactive and to
+catch stages that grow faster than the graph.
+
+Stages, each on the output of the previous ones:
+- build: generating the synthetic ONNX graph
+- infer_topology: the node-level DAG of the graph
+- get_parent_nodes: the DAG's root nodes
+- adjacency: DirectedGraph.undirected_adjacency_matrix(sparse=True)
+- spectral: get_partitions_spectral
+- shard: shard_onnx_model with the simple partitioner, writing the shard files
+
+Usage:
+    python -m tests.benchmarks.graph_bench [--sizes 1000 10000 100000 1000000] [--shapes chain branching transformer]
+        [--stages ...] [--shards 4] [--no_tracemalloc]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import onnx
+
+from periphery.model.model import PeriModel
+from periphery.model.shard import shard_onnx_model
+from periphery.utils.partition import get_partitions_spectral
+from periphery.utils.topology import infer_topology
+
+from tests.benchmarks.synthetic import SHAPES, make_synthetic_model
+
+STAGES = ["build", "infer_topology", "get_parent_nodes", "adjacency", "spectral", "shard"]
+
+def measure(fn, trace_memory=True):
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return result, elapsed, peak
+
+def shard(model, n_shards):
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = os.path.join(tmp, "model.onnx")
+        onnx.save(model, model_path)
+        shard_paths = [os.path.join(tmp, f"shard_{i}.onnx") for i in range(n_shards)]
+
+        return shard_onnx_model(PeriModel(model_path), n_shards, shard_paths, partitioner="simple", out_of_core=False)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--shapes", nargs="+", choices=SHAPES, default=SHAPES)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--no_tracemalloc", action="store_true", help="Time without tracing allocations, which slows Python code down.")
+    args = parser.parse_args()
+    trace_memory = not args.no_tracemalloc
+
+    print(f"{'shape':<14}{'nodes':>10}  {'stage':<18}{'seconds':>10}{'us/node':>10}{'peak MB':>10}")
+    for shape in args.shapes:
+        for size in args.sizes:
+            def report(stage, elapsed, peak):
+                if stage in args.stages:
+                    peak_mb = f"{peak / 2**20:>10.1f}" if peak is not None else f"{'-':>10}"
+                    print(f"{shape:<14}{n_nodes:>10}  {stage:<18}{elapsed:>10.3f}{elapsed / n_nodes * 1e6:>10.2f}{peak_mb}", flush=True)
+
+            model, elapsed, peak = measure(lambda: make_synthetic_model(shape, size), trace_memory)
+            nodes = list(model.graph.node)
+            n_nodes = len(nodes)
+            report("build", elapsed, peak)
+
+            if {"infer_topology", "get_parent_nodes", "adjacency"} & set(args.stages):
+                node_dag, elapsed, peak = measure(lambda: infer_topology([x.input for x in nodes], [x.output for x in nodes]), trace_memory)
+                report("infer_topology", elapsed, peak)
+
+            stages = {
+                "get_parent_nodes": lambda: node_dag.get_parent_nodes(),
+                "adjacency": lambda: node_dag.undirected_adjacency_matrix(sparse=True),
+                "spectral": lambda: get_partitions_spectral(nodes, args.shards),
+                "shard": lambda: shard(model, args.shards),
+            }
+            for stage, fn in stages.items():
+                if stage in args.stages:
+                    _, elapsed, peak = measure(fn, trace_memory)
+                    report(stage, elapsed, peak)
+
+if __name__ == "__main__":
+    main()
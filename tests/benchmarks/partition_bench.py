@@ -0,0 +1,44 @@
+"""
+Time and peak memory of spectral partitioning on synthetic chain and transformer-shaped graphs.
+
+Usage:
+    python -m tests.benchmarks.partition_bench [--sizes 1000 10000 100000] [--shards 4]
+"""
+import argparse
+import time
+import tracemalloc
+
+from periphery.utils.partition import get_partitions_spectral
+
+from tests.benchmarks.synthetic import make_synthetic_model
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--shapes", nargs="+", default=["chain", "transformer"])
+    parser.add_argument("--shards", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{'shape':<14}{'nodes':>10}{'seconds':>10}{'us/node':>10}{'peak MB':>10}{'dense adj MB':>14}  shard sizes")
+    for shape in args.shapes:
+        for size in args.sizes:
+            nodes = list(make_synthetic_model(shape, size).graph.node)
+
+            partitions, elapsed, peak = measure(lambda: get_partitions_spectral(nodes, args.shards))
+
+            dense_mb = len(nodes) ** 2 * 8 / 2**20
+            sizes = [len(x) for x in partitions]
+            print(f"{shape:<14}{len(nodes):>10}{elapsed:>10.2f}{elapsed / len(nodes) * 1e6:>10.1f}{peak / 2**20:>10.1f}{dense_mb:>14.0f}  {sizes}")
+
+if __name__ == "__main__":
+    main()
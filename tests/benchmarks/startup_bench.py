@@ -0,0 +1,72 @@
+"""
+Time to read model metadata and have a session ready, per shard, before and after reading
+metadata from the graph instead of compiling a session for it.
+
+"session metadata" compiles a throwaway session for get_inputs, as PeriModel used to, before the
+serving session is created. "graph metadata" reads the graph (cold) or <model>.meta.json (cached)
+and then creates the one shared session.
+
+Usage:
+    python -m tests.benchmarks.startup_bench [--sizes 1000 10000] [--shards 4] [--hidden 256]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import onnx
+import onnxruntime as ort
+
+from periphery.model.model import PeriModel, SessionConfig
+from periphery.model.shard import shard_onnx_model
+
+from tests.benchmarks.synthetic import make_synthetic_model
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def session_metadata(path):
+    metadata = timed(lambda: ort.InferenceSession(path).get_inputs())
+    return metadata, metadata + timed(lambda: ort.InferenceSession(path))
+
+def graph_metadata(path, cached):
+    if not cached and os.path.exists(path + ".meta.json"):
+        os.remove(path + ".meta.json")
+
+    model = PeriModel(path, session_config=SessionConfig(cache_optimized_model=False))
+    metadata = timed(model.get_inputs)
+    return metadata, metadata + timed(model.get_session)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--shapes", nargs="+", default=["chain", "transformer"])
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--hidden", type=int, default=256)
+    args = parser.parse_args()
+
+    print(f"{'shape':<14}{'nodes':>8}  {'method':<22}{'metadata s':>12}{'ready s':>10}")
+    for shape in args.shapes:
+        for size in args.sizes:
+            with tempfile.TemporaryDirectory() as tmp:
+                model_path = os.path.join(tmp, "model.onnx")
+                onnx.save(make_synthetic_model(shape, size, hidden=args.hidden), model_path)
+
+                shard_paths = [os.path.join(tmp, f"shard_{i}.onnx") for i in range(args.shards)]
+                shard_onnx_model(PeriModel(model_path), args.shards, shard_paths, partitioner="simple", out_of_core=False)
+
+                methods = [
+                    ("session metadata", session_metadata),
+                    ("graph metadata, cold", lambda x: graph_metadata(x, cached=False)),
+                    ("graph metadata, cached", lambda x: graph_metadata(x, cached=True)),
+                ]
+                for name, method in methods:
+                    results = [method(x) for x in shard_paths]
+                    metadata = sum(x for x, _ in results)
+                    ready = sum(x for _, x in results)
+                    print(f"{shape:<14}{size:>8}  {name:<22}{metadata:>12.3f}{ready:>10.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Synthetic ONNX graphs for the scaling benchmarks.
+
+Every MatMul shares one small weight, so graphs stay cheap to build and hold in memory at any
+size while still being valid, runnable models.
+"""
+import onnx
+from onnx import helper, numpy_helper
+import numpy as np
+
+SHAPES = ["chain", "branching", "transformer"]
+
+def _chain_block(previous, prefix):
+    return [
+        helper.make_node("MatMul", [previous, "w"], [f"{prefix}_mm"], name=f"{prefix}_mm"),
+        helper.make_node("Relu", [f"{prefix}_mm"], [f"{prefix}_out"], name=f"{prefix}_relu"),
+    ], f"{prefix}_out"
+
+def _branching_block(previous, prefix):
+    # fan out into two branches that are joined again
+    return [
+        helper.make_node("MatMul", [previous, "w"], [f"{prefix}_a"], name=f"{prefix}_a"),
+        helper.make_node("Relu", [previous], [f"{prefix}_b"], name=f"{prefix}_b"),
+        helper.make_node("Relu", [f"{prefix}_a"], [f"{prefix}_a2"], name=f"{prefix}_a2"),
+        helper.make_node("Add", [f"{prefix}_a2", f"{prefix}_b"], [f"{prefix}_out"], name=f"{prefix}_join"),
+    ], f"{prefix}_out"
+
+def _transformer_block(previous, prefix):
+    # single-head attention and an MLP, each with a residual connection
+    p = prefix
+    return [
+        helper.make_node("MatMul", [previous, "w"], [f"{p}_q"], name=f"{p}_q"),
+        helper.make_node("MatMul", [previous, "w"], [f"{p}_k"], name=f"{p}_k"),
+        helper.make_node("MatMul", [previous, "w"], [f"{p}_v"], name=f"{p}_v"),
+        helper.make_node("Transpose", [f"{p}_k"], [f"{p}_kt"], name=f"{p}_kt"),
+        helper.make_node("MatMul", [f"{p}_q", f"{p}_kt"], [f"{p}_scores"], name=f"{p}_scores"),
+        helper.make_node("Softmax", [f"{p}_scores"], [f"{p}_probs"], name=f"{p}_probs", axis=-1),
+        helper.make_node("MatMul", [f"{p}_probs", f"{p}_v"], [f"{p}_attn"], name=f"{p}_attn"),
+        helper.make_node("MatMul", [f"{p}_attn", "w"], [f"{p}_proj"], name=f"{p}_proj"),
+        helper.make_node("Add", [previous, f"{p}_proj"], [f"{p}_res1"], name=f"{p}_res1"),
+        helper.make_node("MatMul", [f"{p}_res1", "w"], [f"{p}_up"], name=f"{p}_up"),
+        helper.make_node("Relu", [f"{p}_up"], [f"{p}_act"], name=f"{p}_act"),
+        helper.make_node("MatMul", [f"{p}_act", "w"], [f"{p}_down"], name=f"{p}_down"),
+        helper.make_node("Add", [f"{p}_res1", f"{p}_down"], [f"{p}_out"], name=f"{p}_res2"),
+    ], f"{p}_out"
+
+BLOCKS = {"chain": _chain_block, "branching": _branching_block, "transformer": _transformer_block}
+
+def make_synthetic_model(shape, n_nodes, hidden=8):
+    """
+    Build an ONNX model of roughly n_nodes nodes by repeating the block for the given shape.
+
+    Parameters:
+    - shape: One of SHAPES
+    - n_nodes: Approximate node count; whole blocks are generated
+    - hidden: Width of the (hidden x hidden) activations and shared weight
+    """
+    block = BLOCKS[shape]
+
+    nodes = []
+    previous = "input"
+    block_no = 0
+    while len(nodes) < n_nodes:
+        block_nodes, previous = block(previous, f"b{block_no}")
+        nodes += block_nodes
+        block_no += 1
+
+    nodes.append(helper.make_node("Identity", [previous], ["output"], name="output"))
+
+    weight = numpy_helper.from_array((np.eye(hidden) / 2).astype(np.float32), "w")
+    graph = helper.make_graph(
+        nodes=nodes,
+        name=f"synthetic_{shape}",
+        inputs=[helper.make_tensor_value_info("input", onnx.TensorProto.FLOAT, [hidden, hidden])],
+        outputs=[helper.make_tensor_value_info("output", onnx.TensorProto.FLOAT, [hidden, hidden])],
+        initializer=[weight],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+
+    return model
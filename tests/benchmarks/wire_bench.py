@@ -0,0 +1,54 @@
+"""
+Compare the npz upload format with the binary tensor format, per hop between two shards.
+
+Usage:
+    python -m tests.benchmarks.wire_bench [--repeat N]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from periphery.utils import wire
+
+CASES = {
+    "mnist_input": {"input": (1, 1, 28, 28)},
+    "mnist_activation": {"activation": (1, 32, 26, 26)},
+    "llm_hidden_state": {"hidden_states": (1, 2048, 4096)},
+    "llm_hidden_state_batch8": {"hidden_states": (8, 512, 4096)},
+}
+
+def npz_hop(tensors):
+    buffer = wire.encode_npz(tensors).getvalue()
+    return buffer, wire.decode_npz(buffer)
+
+def wire_hop(tensors):
+    # bytes() stands in for the socket read on the receiving side
+    buffer = bytes(wire.pack_tensors(tensors))
+    return buffer, wire.decode_tensors(buffer)
+
+def time_hop(hop, tensors, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        buffer, _ = hop(tensors)
+        timings.append(time.perf_counter() - start)
+
+    return len(buffer), float(np.median(timings)) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'case':<26}{'npz bytes':>14}{'wire bytes':>14}{'npz us':>12}{'wire us':>12}{'saved us':>12}")
+    for case, shapes in CASES.items():
+        tensors = {name: np.random.rand(*shape).astype(np.float32) for name, shape in shapes.items()}
+
+        npz_bytes, npz_us = time_hop(npz_hop, tensors, args.repeat)
+        wire_bytes, wire_us = time_hop(wire_hop, tensors, args.repeat)
+
+        print(f"{case:<26}{npz_bytes:>14}{wire_bytes:>14}{npz_us:>12.1f}{wire_us:>12.1f}{npz_us - wire_us:>12.1f}")
+
+if __name__ == "__main__":
+    main()
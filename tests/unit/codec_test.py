@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from periphery.utils import codec
+from periphery.utils.dag import DirectedGraph, Node
+
+def activations():
+    rng = np.random.default_rng(0)
+    return {
+        "hidden": rng.standard_normal((2, 16, 32)).astype(np.float32),
+        "ids": np.arange(7, dtype=np.int64),
+        "mask": np.ones((2, 16), dtype=np.float16),
+    }
+
+def round_trip(spec, tensors):
+    body, headers = codec.Codec(spec).encode(tensors)
+    return codec.decode(bytes(body), headers[codec.CODEC_HEADER]), body
+
+@pytest.mark.parametrize("spec", ["fp32", "zlib", "fp32+zlib"])
+def test_lossless(spec):
+    tensors = activations()
+    decoded, _ = round_trip(spec, tensors)
+
+    for name, value in tensors.items():
+        assert decoded[name].dtype == value.dtype
+        np.testing.assert_array_equal(decoded[name], value)
+
+@pytest.mark.parametrize("spec, bound", [("fp16", 1e-3), ("bf16", 1e-2), ("int8", 1 / 127), ("int8+zlib", 1 / 127)])
+def test_reduced_precision(spec, bound):
+    tensors = activations()
+    decoded, body = round_trip(spec, tensors)
+
+    hidden = tensors["hidden"]
+    assert decoded["hidden"].dtype == np.float32
+    assert decoded["hidden"].shape == hidden.shape
+    assert np.max(np.abs(decoded["hidden"] - hidden)) <= bound * np.max(np.abs(hidden))
+    assert len(body) < hidden.nbytes
+
+    # only float32 tensors are reduced
+    np.testing.assert_array_equal(decoded["ids"], tensors["ids"])
+    assert decoded["mask"].dtype == np.float16
+
+def test_bf16_rounds_to_nearest_even():
+    x = np.array([1.0, 1.0 + 2**-8, 1.0 + 3 * 2**-8, -2.5, 0.0], dtype=np.float32)
+
+    np.testing.assert_array_equal(codec.from_bf16(codec.to_bf16(x)), [1.0, 1.0, 1.0 + 2**-6, -2.5, 0.0])
+
+def test_int8_of_zeros():
+    decoded, _ = round_trip("int8", {"x": np.zeros(4, dtype=np.float32)})
+
+    np.testing.assert_array_equal(decoded["x"], np.zeros(4))
+
+@pytest.mark.parametrize("bad", [np.inf, -np.inf, np.nan])
+def test_int8_of_non_finite_is_sent_unquantized(bad):
+    x = np.array([0.5, -0.25, bad, 1.0], dtype=np.float32)
+    decoded, _ = round_trip("int8+zlib", {"x": x})
+
+    assert decoded["x"].dtype == np.float32
+    np.testing.assert_array_equal(decoded["x"], x)
+
+def test_missing_compressor_falls_back_to_zlib(monkeypatch):
+    monkeypatch.setattr(codec, "zstandard", None)
+
+    assert codec.Codec("bf16+zstd").spec == "bf16+zlib"
+
+def test_can_decode(monkeypatch):
+    assert codec.can_decode("int8+zlib")
+    assert not codec.can_decode("fp8")
+
+    monkeypatch.setattr(codec, "lz4", None)
+    assert not codec.can_decode("bf16+lz4")
+    with pytest.raises(ValueError):
+        codec.decode(b"", "bf16+lz4")
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        codec.Codec("fp8")
+    with pytest.raises(ValueError):
+        codec.decode(b"", "gzip")
+
+def test_assign_edge_codecs():
+    graph = DirectedGraph()
+    graph.add_nodes([Node() for _ in range(3)])
+    graph.nodes[0].add_connection("big", graph.nodes[1])
+    graph.nodes[0].add_connection("small", graph.nodes[2])
+    graph.nodes[0].tensor_bytes = {"big": 1 << 20, "small": 16}
+
+    assert codec.assign_edge_codecs(graph, "fp16", min_bytes=1024) == 1
+    assert graph.nodes[0].edge_codecs == {1: "fp16"}
+
+    assert DirectedGraph.from_dict(graph.to_dict()).nodes[0].edge_codecs == {1: "fp16"}
@@ -0,0 +1,32 @@
+import asyncio
+import time
+
+import pytest
+
+from periphery.utils import infer
+
+class KeepaliveResponse:
+    # A result stream that never delivers a result, only keepalives
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.closed = True
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self, decode_unicode=False):
+        while True:
+            time.sleep(0.02)
+            yield ": keepalive"
+            yield ""
+
+def test_results_timeout_closes_the_stream(monkeypatch):
+    response = KeepaliveResponse()
+    monkeypatch.setattr(infer.requests, "get", lambda *args, **kwargs: response)
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(infer.get_inference_results("127.0.0.1", 1, [1], timeout=0.1))
+
+    assert response.closed
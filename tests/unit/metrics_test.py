@@ -0,0 +1,40 @@
+import pytest
+
+from periphery.utils.metrics import Registry
+
+def test_render_prometheus_text():
+    registry = Registry()
+    counter = registry.counter("requests_total", "Requests.", ["event"])
+    gauge = registry.gauge("queue_depth", "Queued requests.", ["queue"])
+    histogram = registry.histogram("stage_seconds", "Seconds per stage.", ["stage"], buckets=(0.1, 1))
+
+    counter.inc(event="received")
+    counter.inc(2, event="received")
+    gauge.set_function(lambda: 7, queue="ready")
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, stage="run")
+
+    lines = registry.render().splitlines()
+
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{event="received"} 3' in lines
+    assert 'queue_depth{queue="ready"} 7' in lines
+    assert "# TYPE stage_seconds histogram" in lines
+    assert 'stage_seconds_bucket{stage="run",le="0.1"} 1' in lines
+    assert 'stage_seconds_bucket{stage="run",le="1"} 2' in lines
+    assert 'stage_seconds_bucket{stage="run",le="+Inf"} 3' in lines
+    assert 'stage_seconds_sum{stage="run"} 5.55' in lines
+    assert 'stage_seconds_count{stage="run"} 3' in lines
+
+def test_labels_must_match():
+    counter = Registry().counter("requests_total", "Requests.", ["event"])
+
+    with pytest.raises(ValueError):
+        counter.inc(stage="run")
+
+def test_duplicate_metric():
+    registry = Registry()
+    registry.counter("requests_total", "Requests.")
+
+    with pytest.raises(ValueError):
+        registry.gauge("requests_total", "Requests.")
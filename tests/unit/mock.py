@@ -1,7 +1,11 @@
 import collections
+import os
 
 import numpy as np
 
+from periphery.utils.metrics import Registry
+from periphery.utils.tracing import Tracer
+
 class MockInputs:
     def __init__(self):
         self.name = "mock"
@@ -16,6 +20,9 @@ class MockModel:
     def get_inputs(self):
         return self.inputs
 
+    def busy_replicas(self):
+        return 0
+
 class MockNode:
     def __init__(self):
         self.task_manager = MockTaskManager()
@@ -29,6 +36,10 @@ class MockTaskManager:
         self.children = []
         self.child_output_mappings = collections.defaultdict(list)
 
+        self.metrics = Registry()
+        self.stage_seconds = self.metrics.histogram("periphery_stage_seconds", "Seconds spent in each stage of the pipeline.", ["stage"])
+        self.tracer = Tracer()
+
     def clear_model(self):
         self.model = None
 
@@ -36,6 +47,13 @@ class MockTaskManager:
         self.children = []
         self.child_output_mappings = collections.defaultdict(list)
 
+    def add_child(self, child, outputs, replicas=None, codec=None):
+        self.children.append(child)
+        self.child_output_mappings[child] += outputs
+
+    def pending_requests(self):
+        return len(self.input_requests)
+
     def submit_input(self, input_tensors, infer_id):
         if infer_id in input_tensors:
             self.input_requests[infer_id].update(input_tensors)
@@ -45,9 +63,70 @@ class MockTaskManager:
     def check_for_completion(self):
         pass
 
+    def is_running(self):
+        return False
+
+    def stop(self):
+        pass
+
     def get_buffer(self, infer_id):
         if infer_id not in self.outputs:
             raise Exception("Inference not completed")
         output = {"a": np.zeros(5)}
         buffer = io.BytesIO(output)
         return buffer, f"output_{infer_id}.bin"
+
+def make_mock_onnx_model(path, batch_dim="batch"):
+    # y = x + 1 over a [batch_dim, 4] float input, small enough to run in tests
+    import onnx
+    from onnx import helper
+
+    node = helper.make_node("Add", ["x", "one"], ["y"])
+    one = helper.make_tensor("one", onnx.TensorProto.FLOAT, [1], [1.0])
+    graph = helper.make_graph(
+        nodes=[node],
+        name="mock",
+        inputs=[helper.make_tensor_value_info("x", onnx.TensorProto.FLOAT, [batch_dim, 4])],
+        outputs=[helper.make_tensor_value_info("y", onnx.TensorProto.FLOAT, [batch_dim, 4])],
+        initializer=[one],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+
+    return path
+
+def make_mock_chain_model(path, widths, batch=1, external_data=False):
+    # input -> MatMul -> Relu -> MatMul -> Relu ... -> output, the i-th activation being widths[i] wide
+    import onnx
+    from onnx import helper, numpy_helper
+
+    rng = np.random.default_rng(0)
+    nodes = []
+    initializers = []
+    previous = "input"
+    for i, (width_in, width_out) in enumerate(zip(widths[:-1], widths[1:])):
+        last = i == len(widths) - 2
+        weight = (rng.random((width_in, width_out), dtype=np.float32) - 0.5) / width_in
+        initializers.append(numpy_helper.from_array(weight, f"w{i}"))
+
+        nodes.append(helper.make_node("MatMul", [previous, f"w{i}"], [f"mm{i}"], name=f"matmul_{i}"))
+        output = "output" if last else f"relu{i}"
+        nodes.append(helper.make_node("Relu", [f"mm{i}"], [output], name=f"relu_{i}"))
+        previous = output
+
+    graph = helper.make_graph(
+        nodes=nodes,
+        name="mock_chain",
+        inputs=[helper.make_tensor_value_info("input", onnx.TensorProto.FLOAT, [batch, widths[0]])],
+        outputs=[helper.make_tensor_value_info("output", onnx.TensorProto.FLOAT, [batch, widths[-1]])],
+        initializer=initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    if external_data:
+        onnx.save(model, path, save_as_external_data=True, location=os.path.basename(path) + ".data", size_threshold=0)
+    else:
+        onnx.save(model, path)
+
+    return path
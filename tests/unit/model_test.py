@@ -0,0 +1,121 @@
+import concurrent.futures
+import glob
+import os
+
+import numpy as np
+import onnxruntime as ort
+
+from periphery.model.model import PeriModel, SessionConfig
+import periphery.model.model as model_module
+
+from tests.unit.mock import make_mock_chain_model, make_mock_onnx_model
+
+def test_optimized_model_is_cached_and_reused(tmp_path):
+    path = make_mock_chain_model(str(tmp_path / "chain.onnx"), [8] * 4)
+    x = np.ones((1, 8), dtype=np.float32)
+
+    expected = PeriModel(path, session_config=SessionConfig(cache_optimized_model=False)).infer({"input": x})["output"]
+
+    model = PeriModel(path)
+    assert np.allclose(model.infer({"input": x})["output"], expected)
+    optimized_path = model.get_optimized_model_path()
+    assert os.path.exists(optimized_path)
+
+    # a fresh model loads the cached graph instead of optimizing again
+    mtime = os.path.getmtime(optimized_path)
+    assert np.allclose(PeriModel(path).infer({"input": x})["output"], expected)
+    assert os.path.getmtime(optimized_path) == mtime
+
+def test_changed_settings_cache_another_optimized_model(tmp_path):
+    path = make_mock_chain_model(str(tmp_path / "chain.onnx"), [8] * 4)
+
+    first = PeriModel(path)
+    first.get_session()
+    second = PeriModel(path, session_config=SessionConfig(optimization_level="basic", intra_op_threads=1))
+    second.get_session()
+
+    assert first.get_optimized_model_path() != second.get_optimized_model_path()
+    # the graph of the other settings stays, as another process may be using it
+    assert sorted(glob.glob(str(tmp_path / "chain.onnx.opt-*"))) == sorted([first.get_optimized_model_path(), second.get_optimized_model_path()])
+
+    assert len(second.clear_optimized_models()) == 2
+    assert glob.glob(str(tmp_path / "chain.onnx.opt-*")) == []
+
+def test_warmup_creates_the_session(tmp_path):
+    model = PeriModel(make_mock_chain_model(str(tmp_path / "chain.onnx"), [8] * 4))
+
+    assert model.warmup() > 0
+    assert model.session is not None
+    assert model.get_dummy_inputs()["input"].shape == (1, 8)
+
+def test_metadata_matches_session_without_creating_one(tmp_path, monkeypatch):
+    path = make_mock_onnx_model(str(tmp_path / "add.onnx"))
+    model = PeriModel(path)
+
+    inputs, outputs = model.get_inputs(), model.get_outputs()
+    assert model.session is None
+    assert os.path.exists(model.get_metadata_path())
+
+    session = ort.InferenceSession(path)
+    for ours, theirs in zip(inputs + outputs, session.get_inputs() + session.get_outputs()):
+        assert (ours.name, ours.shape, ours.type) == (theirs.name, theirs.shape, theirs.type)
+
+    # a fresh model reads the cached metadata instead of the graph
+    monkeypatch.setattr(model_module, "read_metadata", None)
+    assert [x.name for x in PeriModel(path).get_inputs()] == ["x"]
+
+def test_session_is_shared_between_threads(tmp_path):
+    model = PeriModel(make_mock_chain_model(str(tmp_path / "chain.onnx"), [8] * 4))
+
+    with concurrent.futures.ThreadPoolExecutor(8) as pool:
+        sessions = list(pool.map(lambda _: model.get_session(), range(8)))
+
+    assert all(x is sessions[0] for x in sessions)
+
+def test_io_binding_reuses_released_buffers(tmp_path):
+    path = make_mock_onnx_model(str(tmp_path / "add.onnx"))
+    bound = PeriModel(path, session_config=SessionConfig(io_binding=True))
+
+    x = np.zeros((1, 4), dtype=np.float32)
+    y = np.ones((1, 4), dtype=np.float32)
+
+    first = bound.infer({"x": x})
+    np.testing.assert_array_equal(first["y"], x + 1)
+    buffer = first["y"]
+
+    # held outputs are never overwritten
+    second = bound.infer({"x": y})
+    assert second["y"] is not buffer
+    np.testing.assert_array_equal(first["y"], x + 1)
+
+    bound.release_outputs(first)
+    third = bound.infer({"x": y})
+    assert third["y"] is buffer
+    np.testing.assert_array_equal(third["y"], y + 1)
+
+    # a new shape signature gets buffers of its own
+    batch = bound.infer({"x": np.concatenate([x, y])})
+    np.testing.assert_array_equal(batch["y"], np.concatenate([x, y]) + 1)
+
+def test_replicas_run_concurrently(tmp_path):
+    model = PeriModel(make_mock_onnx_model(str(tmp_path / "add.onnx")), session_config=SessionConfig(replicas=3))
+    x = np.zeros((1, 4), dtype=np.float32)
+
+    model.warmup()
+    assert len(model.sessions) == 3
+    assert len(set(id(x) for x in model.sessions)) == 3
+    assert model.session_config.replica_threads() >= 1
+
+    with model.acquire_replica() as first, model.acquire_replica() as second:
+        assert first != second
+        assert model.busy_replicas() == 2
+        np.testing.assert_array_equal(model.infer({"x": x})["y"], x + 1)
+    assert model.busy_replicas() == 0
+
+def test_profile_ops_times_every_node(tmp_path):
+    path = make_mock_chain_model(str(tmp_path / "chain.onnx"), [16, 32, 8])
+
+    node_times = PeriModel(path).profile_ops(runs=3)
+
+    assert set(node_times) == {"matmul_0", "relu_0", "matmul_1", "relu_1"}
+    assert all(x >= 0 for x in node_times.values())
@@ -0,0 +1,174 @@
+import pytest
+
+from periphery.orchestration.simple_orchestrator import SimpleOrchestrator
+from periphery.orchestration.capacity_orchestrator import CapacityOrchestrator
+from periphery.orchestration.network_orchestrator import NetworkOrchestrator
+from periphery.utils.dag import DirectedGraph
+from periphery.utils.topology import infer_topology
+
+def make_shard_graph():
+    # 0 -> 1 -> 2, and 0 -> 3 which also takes an external input
+    inputs = [{"input"}, {"a"}, {"b"}, {"a", "extra"}]
+    outputs = [{"a"}, {"b"}, {"output"}, {"output2"}]
+    shard_graph = infer_topology(inputs, outputs)
+    for node, cost in zip(shard_graph.nodes, [1, 10, 4, 100]):
+        node.compute_cost = cost
+
+    return shard_graph
+
+def test_tensor_feeding_several_shards_connects_to_each():
+    shard_graph = make_shard_graph()
+
+    assert set(x.index for x in shard_graph.nodes[0].connection_set) == {1, 3}
+    restored = DirectedGraph.from_dict(shard_graph.to_dict())
+    assert set(x.index for x in restored.nodes[0].connection_set) == {1, 3}
+
+def test_spare_nodes_replicate_the_most_expensive_shards():
+    nodes = [f"http://node{i}" for i in range(6)]
+    orchestrator = SimpleOrchestrator([None] * 4, make_shard_graph(), nodes)
+
+    own_model_id, assigned_models, assigned_nodes = orchestrator.get_assignments()
+
+    # shard 3 has an external input and shard 0 no parent, so only 1 and 2 can be copied
+    assert own_model_id == 0
+    assert sorted(len(x) for x in orchestrator.replicas.values()) == [1, 2]
+    assert len(orchestrator.replicas[1]) == 2
+    assert len(assigned_models) == 6
+    for model_id, replica_nodes in orchestrator.replicas.items():
+        assert all(assigned_models[x] == model_id for x in replica_nodes)
+        assert assigned_nodes[model_id] not in replica_nodes
+
+def test_shard_with_two_parents_is_assigned_once():
+    # 0 -> 1 -> 2 and 0 -> 2
+    shard_graph = infer_topology([{"input"}, {"a"}, {"a", "b"}], [{"a"}, {"b"}, {"output"}])
+    orchestrator = SimpleOrchestrator([None] * 3, shard_graph, ["http://a", "http://b"])
+
+    own_model_id, assigned_models, assigned_nodes = orchestrator.get_assignments()
+
+    assert sorted(list(assigned_nodes) + [own_model_id]) == [0, 1, 2]
+    assert sorted(assigned_models.values()) == sorted(assigned_nodes)
+
+def test_no_replicas_without_spare_nodes():
+    orchestrator = SimpleOrchestrator([None] * 4, make_shard_graph(), ["http://a", "http://b", "http://c"])
+    orchestrator.get_assignments()
+
+    assert orchestrator.replicas == {}
+
+class MockSubmodel:
+    def __init__(self, path):
+        self.path = path
+
+    def get_external_data_files(self):
+        return []
+
+def test_capacity_orchestrator_puts_heavy_shards_on_fast_nodes(tmp_path):
+    shard_graph = infer_topology([{"input"}, {"a"}, {"b"}], [{"a"}, {"b"}, {"output"}])
+    for node, cost in zip(shard_graph.nodes, [1, 100, 10]):
+        node.compute_cost = cost
+
+    submodels = []
+    for i, size in enumerate([10, 10, 5000]):
+        path = tmp_path / f"shard_{i}.onnx"
+        path.write_bytes(bytes(size))
+        submodels.append(MockSubmodel(str(path)))
+
+    capabilities = {
+        "http://master": {"matmul_flops": 5, "free_memory": 10**6},
+        "http://slow": {"matmul_flops": 1, "free_memory": 10**6},
+        "http://fast": {"matmul_flops": 100, "free_memory": 10**6},
+        "http://small": {"matmul_flops": 50, "free_memory": 100},
+    }
+    orchestrator = CapacityOrchestrator(submodels, shard_graph, ["http://slow", "http://fast", "http://small"], capabilities, "http://master")
+
+    own_model_id, assigned_models, assigned_nodes = orchestrator.get_assignments()
+
+    # shard 2 doesn't fit in the small node's memory, so it takes the master while shard 0 gets the small node
+    assert assigned_nodes[1] == "http://fast"
+    assert own_model_id == 2
+    assert assigned_nodes[0] == "http://small"
+    # the slow node is spare, and copies the costliest replicable stage
+    assert orchestrator.replicas == {1: ["http://slow"]}
+
+def test_capacity_orchestrator_leaves_replicable_shards_to_spare_nodes(tmp_path):
+    # the master's shard can't be copied, so it keeps the cheap one and the spare nodes share the other
+    shard_graph = infer_topology([{"input"}, {"a"}], [{"a"}, {"output"}])
+    for node, cost in zip(shard_graph.nodes, [10, 100]):
+        node.compute_cost = cost
+
+    submodels = []
+    for i in range(2):
+        path = tmp_path / f"shard_{i}.onnx"
+        path.write_bytes(bytes(10))
+        submodels.append(MockSubmodel(str(path)))
+
+    capabilities = {"m": {"matmul_flops": 10}, "a": {"matmul_flops": 5}, "b": {"matmul_flops": 4}, "c": {"matmul_flops": 3}}
+    orchestrator = CapacityOrchestrator(submodels, shard_graph, ["a", "b", "c"], capabilities, "m")
+
+    own_model_id, assigned_models, assigned_nodes = orchestrator.get_assignments()
+
+    assert own_model_id == 0
+    assert assigned_nodes == {1: "a"}
+    assert orchestrator.replicas == {1: ["b", "c"]}
+    assert assigned_models == {"a": 1, "b": 1, "c": 1}
+    assert orchestrator.stage_time(1, {1: "a"}) == pytest.approx(100 / 12)
+
+def test_capacity_orchestrator_counts_session_replicas(tmp_path):
+    shard_graph = infer_topology([{"input"}, {"a"}, {"b"}], [{"a"}, {"b"}, {"output"}])
+    for node, cost in zip(shard_graph.nodes, [1, 100, 10]):
+        node.compute_cost = cost
+
+    submodels = []
+    for i in range(3):
+        path = tmp_path / f"shard_{i}.onnx"
+        path.write_bytes(bytes(10))
+        submodels.append(MockSubmodel(str(path)))
+
+    capabilities = {"m": {"matmul_flops": 5}, "fast": {"matmul_flops": 10}, "pool": {"matmul_flops": 6}}
+
+    orchestrator = CapacityOrchestrator(submodels, shard_graph, ["fast", "pool"], capabilities, "m")
+    assert orchestrator.get_assignments()[2] == {1: "fast", 2: "pool"}
+
+    # four sessions of the slower node take more requests at once than the faster node's one
+    orchestrator = CapacityOrchestrator(submodels, shard_graph, ["fast", "pool"], capabilities, "m", node_replicas={"pool": 4})
+    own_model_id, assigned_models, assigned_nodes = orchestrator.get_assignments()
+
+    assert own_model_id == 0
+    assert assigned_nodes == {1: "pool", 2: "fast"}
+    assert orchestrator.stage_time(1, assigned_nodes) == pytest.approx(100 / 24)
+
+def make_network():
+    # 0 -> 1 sends a large activation, 1 -> 2 a small one; only the master and near share a fast link
+    shard_graph = infer_topology([{"input"}, {"a"}, {"b"}], [{"a"}, {"b"}, {"output"}])
+    shard_graph.nodes[0].tensor_bytes = {"a": 10**7}
+    shard_graph.nodes[1].tensor_bytes = {"b": 10}
+
+    fast = {"rtt": 0.001, "bandwidth": 1e9}
+    slow = {"rtt": 0.001, "bandwidth": 1e6}
+    link_costs = {
+        "http://master": {"http://near": fast, "http://far": slow},
+        "http://near": {"http://master": fast, "http://far": slow},
+        "http://far": {"http://master": slow, "http://near": slow},
+    }
+
+    return shard_graph, link_costs
+
+def test_network_orchestrator_keeps_large_activations_on_fast_links():
+    shard_graph, link_costs = make_network()
+    orchestrator = NetworkOrchestrator([None] * 3, shard_graph, ["http://far", "http://near"], link_costs, "http://master")
+
+    own_model_id, assigned_models, assigned_nodes = orchestrator.get_assignments()
+    assigned_nodes[own_model_id] = "http://master"
+
+    assert {assigned_nodes[0], assigned_nodes[1]} == {"http://master", "http://near"}
+    assert assigned_nodes[2] == "http://far"
+    assert orchestrator.predicted_transfer_time == pytest.approx(0.002 + 10**7 / 1e9 + 10 / 1e6)
+
+def test_network_orchestrator_local_search():
+    shard_graph, link_costs = make_network()
+    orchestrator = NetworkOrchestrator([None] * 3, shard_graph, ["http://far", "http://near"], link_costs, "http://master")
+    orchestrator.max_exhaustive = 0
+
+    own_model_id, assigned_models, assigned_nodes = orchestrator.get_assignments()
+    assigned_nodes[own_model_id] = "http://master"
+
+    assert {assigned_nodes[0], assigned_nodes[1]} == {"http://master", "http://near"}
@@ -0,0 +1,128 @@
+import onnx
+import numpy as np
+import onnxruntime as ort
+
+from periphery.model.model import PeriModel
+from periphery.model.shard import shard_onnx_model
+from periphery.utils.partition import estimate_costs, get_partitions_cost_aware, get_partitions_simple, get_partitions_spectral, partition_report, profile_node_weights, node_key
+from periphery.utils.topology import infer_topology
+
+from tests.unit.mock import make_mock_chain_model
+
+def test_estimate_costs(tmp_path):
+    model = onnx.load(make_mock_chain_model(str(tmp_path / "chain.onnx"), [8, 16, 4]))
+
+    costs = estimate_costs(model)
+
+    assert costs.tensor_bytes["mm0"] == 16 * 4
+    assert costs.node_flops["mm0"] == 2 * 8 * 16
+    assert costs.node_flops["relu0"] == 16
+
+def test_cost_aware_prefers_narrow_cut(tmp_path):
+    # equal compute either side of the middle; the narrow activation is one layer off-centre
+    model = onnx.load(make_mock_chain_model(str(tmp_path / "chain.onnx"), [64, 64, 64, 2, 64, 64, 64]))
+
+    partitions = get_partitions_cost_aware(model, 2, balance_tolerance=0.5)
+    report = partition_report(partitions, estimate_costs(model))
+
+    assert [x.name for x in partitions[0]][-1] == "relu_2"
+    assert report[1]["received_bytes"] == 2 * 4
+    assert report[0]["sent_bytes"] == 2 * 4
+
+def test_cost_aware_partitions_are_contiguous(tmp_path):
+    model = onnx.load(make_mock_chain_model(str(tmp_path / "chain.onnx"), [32] * 9))
+
+    partitions = get_partitions_cost_aware(model, 4)
+
+    names = [x.name for partition in partitions for x in partition]
+    assert names == [x.name for x in model.graph.node]
+    assert all(len(x) == 4 for x in partitions)
+
+def test_shard_cost_aware_matches_full_model(tmp_path):
+    path = make_mock_chain_model(str(tmp_path / "chain.onnx"), [16, 32, 32, 8, 32, 16])
+    shard_paths = [str(tmp_path / f"shard_{i}.onnx") for i in range(2)]
+
+    shard_dag = shard_onnx_model(PeriModel(path), 2, shard_paths, partitioner="cost_aware")
+
+    x = np.random.rand(1, 16).astype(np.float32)
+    first = ort.InferenceSession(shard_paths[0]).run(None, {"input": x})
+    first_outputs = dict(zip([o.name for o in ort.InferenceSession(shard_paths[0]).get_outputs()], first))
+    result = ort.InferenceSession(shard_paths[1]).run(None, first_outputs)[0]
+
+    np.testing.assert_allclose(result, ort.InferenceSession(path).run(None, {"input": x})[0], rtol=1e-5)
+    assert all(x.compute_cost > 0 for x in shard_dag.nodes)
+    assert sum(shard_dag.nodes[0].tensor_bytes.values()) == 32 * 4
+
+def test_sparse_adjacency_matches_dense(tmp_path):
+    model = onnx.load(make_mock_chain_model(str(tmp_path / "chain.onnx"), [8] * 6))
+    nodes = model.graph.node
+    graph = infer_topology([x.input for x in nodes], [x.output for x in nodes])
+
+    np.testing.assert_array_equal(graph.undirected_adjacency_matrix(sparse=True).toarray(), graph.undirected_adjacency_matrix())
+
+def test_multilevel_spectral_covers_all_nodes(tmp_path):
+    nodes = list(onnx.load(make_mock_chain_model(str(tmp_path / "chain.onnx"), [4] * 301)).graph.node)
+
+    partitions = get_partitions_spectral(nodes, 3, coarsen_to=50)
+
+    assert len(partitions) == 3
+    assert all(len(x) > 0 for x in partitions)
+    assert sorted(x.name for partition in partitions for x in partition) == sorted(x.name for x in nodes)
+    assert partitions[0][0].name == nodes[0].name
+
+def test_profile_node_weights_fill_unmeasured_nodes(tmp_path):
+    model = onnx.load(make_mock_chain_model(str(tmp_path / "chain.onnx"), [32] * 3))
+    costs = estimate_costs(model)
+
+    weights = profile_node_weights(model.graph.node, {"matmul_0": 2.0, "relu_0": 1.0}, costs)
+
+    # measured nodes share their estimated FLOPs in proportion to their time; weights are keyed
+    # like GraphCosts, by the node's first output
+    assert weights["mm0"] == 2 * (2 * 32 * 32 + 32) / 3
+    assert weights["relu0"] == (2 * 32 * 32 + 32) / 3
+    assert weights["mm1"] == 2 * 32 * 32
+    assert set(weights) == {node_key(x) for x in model.graph.node}
+
+def test_unnamed_nodes_keep_their_estimate(tmp_path):
+    # the first MatMul dominates, so a cut by estimate differs from one by node count
+    model = onnx.load(make_mock_chain_model(str(tmp_path / "chain.onnx"), [64, 64, 8, 8, 8, 8]))
+    nodes = model.graph.node
+    for node in nodes:
+        node.name = ""
+    costs = estimate_costs(model)
+    node_weights = profile_node_weights(nodes, {}, costs)
+
+    # an estimate for every node, so the weighted cut matches the FLOP-balanced one
+    assert [costs.node_cost(x, node_weights) for x in nodes] == [costs.node_flops[node_key(x)] for x in nodes]
+    weighted = get_partitions_simple(nodes, 2, node_weights=node_weights, costs=costs)
+    assert weighted == get_partitions_simple(nodes, 2, node_weights=costs.node_flops)
+    assert [len(x) for x in weighted] == [1, len(nodes) - 1]
+
+def test_profiled_weights_move_the_cut(tmp_path):
+    model = onnx.load(make_mock_chain_model(str(tmp_path / "chain.onnx"), [32] * 9))
+    nodes = model.graph.node
+    # the first MatMul measured far slower than its FLOPs suggest
+    node_times = {x.name: 0.001 for x in nodes}
+    node_times["matmul_0"] = 1.0
+    node_weights = profile_node_weights(nodes, node_times, estimate_costs(model))
+
+    for partitions in (get_partitions_simple(nodes, 2, node_weights=node_weights), get_partitions_cost_aware(model, 2, node_weights=node_weights)):
+        assert [x.name for x in partitions[0]] == ["matmul_0"]
+        assert len(partitions[1]) == len(nodes) - 1
+
+def test_profiled_weights_balance_small_spectral_partitions(tmp_path):
+    # small enough to be clustered without coarsening, where only the weighted balancing applies
+    model = onnx.load(make_mock_chain_model(str(tmp_path / "chain.onnx"), [32] * 9))
+    nodes = list(model.graph.node)
+    costs = estimate_costs(model)
+
+    assert [len(x) for x in get_partitions_spectral(nodes, 2)] == [8, 8]
+
+    node_times = {x.name: 0.001 for x in nodes}
+    node_times["matmul_1"] = 1.0
+    node_weights = profile_node_weights(nodes, node_times, costs)
+    partitions = get_partitions_spectral(nodes, 2, node_weights=node_weights, costs=costs)
+
+    # the slow node keeps a shard of its own as far as the chain allows
+    assert [x.name for x in partitions[0]] == ["matmul_0", "relu_0", "matmul_1"]
+    assert [x.name for x in partitions[1]] == [x.name for x in nodes[3:]]
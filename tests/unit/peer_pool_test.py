@@ -0,0 +1,66 @@
+import http.server
+import threading
+import time
+
+import pytest
+
+from periphery.distributed.peer_pool import PeerPool
+
+class FlakyHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.attempts += 1
+
+        if self.path == "/slow":
+            time.sleep(0.2)
+
+        status = 503 if self.server.attempts <= self.server.failures else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        if status == 503:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def peer():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+    server.attempts = 0
+    server.failures = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+def url(server, path):
+    return f"http://127.0.0.1:{server.server_port}{path}"
+
+def test_retries_overloaded_peer(peer):
+    peer.failures = 2
+    pool = PeerPool(retries=3, backoff=0.001)
+
+    response = pool.post(url(peer, "/submit"), data=b"payload")
+
+    assert response.status_code == 200
+    assert peer.attempts == 3
+
+def test_gives_up_after_retries(peer):
+    peer.failures = 10
+    pool = PeerPool(retries=1, backoff=0.001)
+
+    response = pool.post(url(peer, "/submit"), data=b"payload")
+
+    assert response.status_code == 503
+    assert peer.attempts == 2
+
+def test_fan_out_overlaps(peer):
+    pool = PeerPool(max_in_flight=4)
+
+    start = time.perf_counter()
+    futures = [pool.submit_request("POST", url(peer, "/slow"), data=b"x") for _ in range(4)]
+    assert all(x.result().status_code == 200 for x in futures)
+
+    assert time.perf_counter() - start < 0.6
@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+
+from periphery.distributed.result_store import ResultStore
+
+def tensors(n_bytes, value=0):
+    return {"y": np.full(n_bytes // 4, value, dtype=np.float32)}
+
+def test_budget_evicts_least_recently_used():
+    store = ResultStore(max_bytes=1000)
+    for infer_id in range(3):
+        store[infer_id] = tensors(400)
+        store[0]
+
+    assert list(store) == [2, 0]
+    assert store.nbytes == 800
+    assert store.evictions == 1
+
+def test_pinned_entries_stay():
+    store = ResultStore(max_bytes=500)
+    store.put(0, tensors(400), pinned=True)
+    store.put(1, tensors(400), pinned=True)
+
+    assert list(store) == [0, 1]
+
+    store.unpin(0)
+
+    assert list(store) == [1]
+    assert store.evictions == 1
+
+def test_final_outputs_expire():
+    store = ResultStore(ttl=0)
+    store.expiry_interval = 0
+    store[0] = tensors(400)
+
+    assert 0 not in store
+    store[1] = tensors(400)
+    assert len(store) == 0
+    assert store.expirations == 2
+
+def test_expired_entries_are_hidden_before_being_dropped():
+    store = ResultStore(ttl=0)
+    store.expiry_interval = 60
+    store[0] = tensors(400)
+
+    # still held until the next expiry scan, but neither counted, listed nor returned
+    assert len(store.entries) == 1
+    assert len(store) == len(list(store)) == 0
+    assert store.get(0) is None
+
+def test_spill_to_memory_mapped_files(tmp_path):
+    store = ResultStore(max_bytes=500, spill_dir=str(tmp_path))
+    store[0] = tensors(400, value=1)
+    store[1] = tensors(400, value=2)
+
+    assert store.spills == 1
+    assert store.nbytes == 400 and store.spilled_bytes == 400
+    assert isinstance(store[0]["y"], np.memmap)
+    np.testing.assert_array_equal(store[0]["y"], np.ones(100))
+
+    store.pop(0)
+
+    assert store.spilled_bytes == 0
+    assert os.listdir(tmp_path) == []
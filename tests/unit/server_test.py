@@ -3,11 +3,18 @@ from unittest.mock import AsyncMock, MagicMock, patch
 from fastapi.testclient import TestClient
 from queue import Queue
 from pydantic import BaseModel
+import asyncio
+import concurrent.futures
 import io
+import hashlib
+import threading
+import time
 import numpy as np
 from periphery.distributed.http_server.server import Server
+from periphery.distributed.task_manager import TaskManager
+from periphery.utils import wire, codec
 
-from tests.unit.mock import MockNode, MockTaskManager
+from tests.unit.mock import MockNode, MockTaskManager, make_mock_onnx_model
 
 @pytest.fixture
 def client():
@@ -51,3 +58,249 @@ def test_get_inputs(client):
 
 def test_output(client):
     assert True
+
+def test_submit_input_wire_format(client):
+    body = bytes(wire.pack_tensors({"data": np.array([1, 2, 3])}))
+    response = client.post("/submit_input/1", content=body, headers={"Content-Type": wire.CONTENT_TYPE})
+    assert response.status_code == 200
+
+def test_submit_input_with_codec():
+    node = MockNode()
+    client = TestClient(Server(node).app)
+
+    tensors = {"data": np.linspace(-1, 1, 8, dtype=np.float32)}
+    body, headers = codec.Codec("int8+zlib").encode(tensors)
+    response = client.post("/submit_input/1", content=bytes(body), headers=headers)
+    assert response.status_code == 200
+
+    received = node.task_manager.input_requests[1]["data"]
+    assert received.dtype == np.float32
+    np.testing.assert_allclose(received, tensors["data"], atol=1 / 127)
+
+def test_submit_input_with_codec_not_installed(client, monkeypatch):
+    monkeypatch.setattr(codec, "zstandard", None)
+
+    body = bytes(wire.pack_tensors({"data": np.zeros(4, dtype=np.float32)}))
+    response = client.post("/submit_input/1", content=body, headers={"Content-Type": wire.CONTENT_TYPE, codec.CODEC_HEADER: "fp32+zstd"})
+    assert response.status_code == 415
+
+def test_submit_input_unsupported_type(client):
+    response = client.post("/submit_input/1", content=b"data", headers={"Content-Type": "text/plain"})
+    assert response.status_code == 415
+
+def test_submit_input_malformed(client):
+    response = client.post("/submit_input/1", content=b"not tensors", headers={"Content-Type": wire.CONTENT_TYPE})
+    assert response.status_code == 400
+
+@pytest.fixture
+def master():
+    node = MockNode()
+    node.task_manager = TaskManager()
+    server = Server(node)
+    server.is_master = True
+    return server
+
+def test_final_output_long_poll(master):
+    client = TestClient(master.app)
+    timer = threading.Timer(0.1, master.task_manager.set_final_output, (3, {"output": np.arange(4)}))
+    timer.start()
+
+    response = client.get("/final_output/3", params={"timeout": 5}, headers={"Accept": wire.CONTENT_TYPE})
+
+    assert response.status_code == 200
+    np.testing.assert_array_equal(wire.decode_tensors(response.content)["output"], np.arange(4))
+
+def test_final_output_long_poll_timeout(master):
+    client = TestClient(master.app)
+
+    response = client.get("/final_output/4", params={"timeout": 0.05})
+
+    assert response.status_code == 202
+
+def test_failed_request_answers_waiting_clients(master):
+    client = TestClient(master.app)
+    timer = threading.Timer(0.1, client.post, ("/failed_request/6",), {"json": {"reason": "Inference failed: boom"}})
+    timer.start()
+
+    start = time.monotonic()
+    response = client.get("/final_output/6", params={"timeout": 30})
+
+    assert response.status_code == 500
+    assert "boom" in response.json()["detail"]
+    assert time.monotonic() - start < 10
+
+    events = client.get("/final_output_stream", params={"ids": "6"}).text
+    assert events.startswith("event: final_output_failed\nid: 6\ndata: Inference failed: boom")
+
+def test_long_poll_on_other_nodes_redirects_to_master(client):
+    response = client.get("/final_output/3", params={"timeout": 5}, follow_redirects=False)
+
+    assert response.status_code == 307
+    assert response.headers["location"].endswith("/final_output/3?timeout=5.0")
+
+def test_expired_final_output_is_still_processing(master):
+    client = TestClient(master.app)
+    master.task_manager.set_result_limits(final_output_ttl=0)
+    master.task_manager.final_outputs.expiry_interval = 60
+    master.task_manager.set_final_output(4, {"output": np.ones(2)})
+
+    assert client.get("/final_output/4").status_code == 202
+
+def test_final_output_stream(master):
+    client = TestClient(master.app)
+    master.task_manager.set_final_output(1, {"output": np.ones(2)})
+    threading.Timer(0.1, master.task_manager.set_final_output, (2, {"output": np.zeros(2)})).start()
+
+    response = client.get("/final_output_stream", params={"ids": "1,2"})
+
+    events = [x for x in response.text.split("\n\n") if x.startswith("event: final_output")]
+    assert [x.split("\n")[1] for x in events] == ["id: 1", "id: 2"]
+
+def test_open_final_output_stream_only_sends_new_outputs(master):
+    master.task_manager.set_final_output(1, {"output": np.ones(2)})
+    threading.Timer(0.1, master.task_manager.set_final_output, (2, {"output": np.zeros(2)})).start()
+
+    async def first_event():
+        events = master.final_output_events(None, include_data=False)
+        try:
+            return await events.__anext__()
+        finally:
+            await events.aclose()
+
+    first = asyncio.run(first_event())
+
+    assert first.startswith("event: final_output\nid: 2\n")
+    assert master.task_manager.final_output_subscribers == []
+
+def test_waiting_clients_hold_no_threads(master):
+    # more long-polls and streams than the threadpool has threads
+    master.task_manager.set_final_output(0, {"output": np.ones(2)})
+    n_waiting = 50
+
+    with TestClient(master.app) as client, concurrent.futures.ThreadPoolExecutor(n_waiting + 5) as pool:
+        polls = [pool.submit(client.get, f"/final_output/{i}", params={"timeout": 30}) for i in range(1, n_waiting + 1)]
+        streams = [pool.submit(client.get, "/final_output_stream", params={"ids": "1"}) for _ in range(5)]
+
+        deadline = time.monotonic() + 10
+        while (len(master.task_manager.final_output_waiters) < n_waiting or len(master.task_manager.final_output_subscribers) < 5) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        # finished results are still served while every client waits
+        start = time.monotonic()
+        response = client.get("/final_output/0", headers={"Accept": wire.CONTENT_TYPE})
+        assert response.status_code == 200
+        assert time.monotonic() - start < 5
+
+        for infer_id in range(1, n_waiting + 1):
+            master.task_manager.set_final_output(infer_id, {"output": np.full(2, infer_id)})
+
+        assert all(x.result(timeout=10).status_code == 200 for x in polls)
+        assert all("id: 1" in x.result(timeout=10).text for x in streams)
+
+    assert master.task_manager.final_output_waiters == {}
+
+def test_model_chunk_resume_and_commit(master, tmp_path):
+    client = TestClient(master.app)
+    master.model_path = str(tmp_path / "node" / "current_shard.onnx")
+    contents = open(make_mock_onnx_model(str(tmp_path / "shard_1.onnx")), "rb").read()
+    files = [{"name": "shard_1.onnx", "size": len(contents), "sha256": hashlib.sha256(contents).hexdigest()}]
+
+    assert client.post("/model_chunk/shard_1.onnx", params={"offset": 0}, content=contents[:10]).status_code == 200
+    assert client.get("/model_chunk/shard_1.onnx").json() == {"received": 10}
+    assert client.post("/model_chunk/shard_1.onnx", params={"offset": 5}, content=contents[5:]).status_code == 409
+    assert client.post("/model_chunk/shard_1.onnx", params={"offset": 10}, content=contents[10:]).status_code == 200
+
+    response = client.post("/model_commit", json={"model": "shard_1.onnx", "files": files})
+
+    assert response.status_code == 200
+    assert open(master.model_path, "rb").read() == contents
+    assert master.task_manager.input_names == ["x"]
+
+def test_model_commit_checksum_mismatch(master, tmp_path):
+    client = TestClient(master.app)
+    master.model_path = str(tmp_path / "current_shard.onnx")
+
+    client.post("/model_chunk/shard_1.onnx", params={"offset": 0}, content=b"corrupted")
+    files = [{"name": "shard_1.onnx", "size": 9, "sha256": hashlib.sha256(b"different").hexdigest()}]
+
+    response = client.post("/model_commit", json={"model": "shard_1.onnx", "files": files})
+
+    assert response.status_code == 400
+    assert client.get("/model_chunk/shard_1.onnx").json() == {"received": 0}
+
+def test_replicas(client):
+    response = client.get("/replicas")
+
+    assert response.status_code == 200
+    assert response.json()["replicas"] == 1
+
+def test_register_node_with_capabilities(master):
+    client = TestClient(master.app)
+    payload = {"ip": "http://192.168.1.3:29500", "capabilities": {"cores": 8, "free_memory": 2**30, "matmul_flops": 1e10}}
+    response = client.post("/register_node", json=payload)
+
+    assert response.status_code == 200
+    assert master.node_capabilities["http://192.168.1.3:29500"]["cores"] == 8
+
+def test_probe_payload(client):
+    response = client.post("/probe_payload", content=bytes(1000))
+
+    assert response.status_code == 200
+    assert response.json() == {"received": 1000}
+
+def test_network(master):
+    master.link_costs = {"http://a": {"http://b": {"rtt": 0.001, "bandwidth": 1e8}}}
+    master.placement = {0: ["http://a"], 1: ["http://b"]}
+    client = TestClient(master.app)
+
+    response = client.get("/network")
+
+    assert response.status_code == 200
+    assert response.json()["links"]["http://a"]["http://b"]["bandwidth"] == 1e8
+    assert response.json()["placement"] == {"0": ["http://a"], "1": ["http://b"]}
+
+def test_profile_cluster(master, tmp_path):
+    from periphery.model.model import PeriModel
+    from tests.unit.mock import make_mock_chain_model
+
+    master.task_manager.model = PeriModel(make_mock_chain_model(str(tmp_path / "chain.onnx"), [16, 32, 8]))
+    master.master_url = "http://master"
+    master.placement = {0: ["http://master"]}
+
+    profile = master.profile_cluster(2)
+
+    assert set(profile["node_times"]) == {"matmul_0", "relu_0", "matmul_1", "relu_1"}
+    assert profile["stage_times"][0] == sum(profile["node_times"].values())
+    assert TestClient(master.app).get("/op_profile").json()["runs"] == 2
+
+def test_metrics(master, tmp_path):
+    from periphery.model.model import PeriModel
+
+    master.task_manager.set_model(PeriModel(make_mock_onnx_model(str(tmp_path / "mock.onnx"))))
+    client = TestClient(master.app)
+    body = bytes(wire.pack_tensors({"x": np.zeros((1, 4), dtype=np.float32)}))
+    client.post("/submit_input/1", content=body, headers={"Content-Type": wire.CONTENT_TYPE})
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'periphery_stage_seconds_count{stage="decode"} 1' in response.text
+    assert 'periphery_requests_total{event="received"} 1' in response.text
+
+def test_trace(master, tmp_path):
+    from periphery.model.model import PeriModel
+    from periphery.utils.tracing import TRACE_HEADER
+
+    master.task_manager.set_model(PeriModel(make_mock_onnx_model(str(tmp_path / "mock.onnx"))))
+    client = TestClient(master.app)
+    body = bytes(wire.pack_tensors({"x": np.zeros((1, 4), dtype=np.float32)}))
+    client.post("/submit_input/1", content=body, headers={"Content-Type": wire.CONTENT_TYPE, TRACE_HEADER: "abc:1"})
+    client.post("/submit_input/2", content=body, headers={"Content-Type": wire.CONTENT_TYPE, TRACE_HEADER: "def:0"})
+
+    spans = client.get("/spans", params={"infer_id": 1}).json()
+    trace = client.get("/trace").json()
+
+    assert [x["name"] for x in spans] == ["wait_inputs", "receive", "queue", "run"]
+    assert all(x["trace_id"] == "abc" for x in spans)
+    assert {x["tid"] for x in trace["traceEvents"] if x["ph"] == "X"} == {1}
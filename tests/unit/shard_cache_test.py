@@ -0,0 +1,48 @@
+import os
+
+from periphery.model.model import PeriModel
+from periphery.model.shard import shard_onnx_model
+from periphery.model.shard_cache import ShardCache
+
+from tests.unit.mock import make_mock_chain_model
+
+def shard_with_count(model, calls):
+    def shard_fn(paths):
+        calls.append(paths)
+        return shard_onnx_model(model, len(paths), paths, partitioner="cost_aware")
+    return shard_fn
+
+def test_cache_hit_skips_sharding(tmp_path):
+    model = PeriModel(make_mock_chain_model(str(tmp_path / "chain.onnx"), [8] * 5))
+    cache = ShardCache(str(tmp_path / "cache"), 2**30)
+    calls = []
+
+    paths, graph = cache.get_or_shard(model, 2, {"partitioner": "cost_aware"}, shard_with_count(model, calls))
+    cached_paths, cached_graph = cache.get_or_shard(model, 2, {"partitioner": "cost_aware"}, shard_with_count(model, calls))
+
+    assert len(calls) == 1
+    assert cached_paths == paths
+    assert all(os.path.exists(x) for x in cached_paths)
+    assert cached_graph.to_dict() == graph.to_dict()
+
+def test_cache_misses_on_changed_settings(tmp_path):
+    model = PeriModel(make_mock_chain_model(str(tmp_path / "chain.onnx"), [8] * 5))
+    cache = ShardCache(str(tmp_path / "cache"), 2**30)
+    calls = []
+
+    cache.get_or_shard(model, 2, {"partitioner": "cost_aware"}, shard_with_count(model, calls))
+    cache.get_or_shard(model, 3, {"partitioner": "cost_aware"}, shard_with_count(model, calls))
+    cache.get_or_shard(model, 2, {"partitioner": "simple"}, shard_with_count(model, calls))
+
+    assert len(calls) == 3
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    model = PeriModel(make_mock_chain_model(str(tmp_path / "chain.onnx"), [8] * 5))
+    cache = ShardCache(str(tmp_path / "cache"), 2**30)
+
+    first, _ = cache.get_or_shard(model, 2, {"run": 1}, shard_with_count(model, []))
+    cache.max_bytes = cache.entry_size(os.path.basename(os.path.dirname(first[0]))) + 1
+    second, _ = cache.get_or_shard(model, 2, {"run": 2}, shard_with_count(model, []))
+
+    assert not os.path.exists(first[0])
+    assert os.path.exists(second[0])
@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import onnx
+import onnxruntime as ort
+
+from periphery.model.model import PeriModel
+from periphery.model.shard import shard_onnx_model
+
+from tests.unit.mock import make_mock_chain_model
+
+def run_shards(shard_paths, shard_dag, input_tensors):
+    # Run the shards one after another, feeding each the tensors produced so far
+    tensors = dict(input_tensors)
+    pending = list(range(len(shard_paths)))
+    while pending:
+        for shard_no in pending:
+            session = ort.InferenceSession(shard_paths[shard_no])
+            names = [x.name for x in session.get_inputs()]
+            if all(x in tensors for x in names):
+                outputs = session.run(None, {x: tensors[x] for x in names})
+                tensors.update(zip([x.name for x in session.get_outputs()], outputs))
+                pending.remove(shard_no)
+                break
+        else:
+            raise Exception(f"Shards {pending} are missing inputs")
+
+    return tensors
+
+def test_out_of_core_shards_match_full_model(tmp_path):
+    model_path = make_mock_chain_model(str(tmp_path / "chain.onnx"), [16] * 7, external_data=True)
+    paths = [str(tmp_path / f"shard_{i}.onnx") for i in range(3)]
+
+    shard_dag = shard_onnx_model(PeriModel(model_path), 3, paths, partitioner="simple")
+
+    for path in paths:
+        assert os.path.exists(path + ".data")
+        shard_model = onnx.load(path, load_external_data=False)
+        assert all(x.data_location == onnx.TensorProto.EXTERNAL for x in shard_model.graph.initializer)
+        assert PeriModel(path).get_external_data_files() == [path + ".data"]
+
+    x = np.random.default_rng(0).random((1, 16), dtype=np.float32)
+    expected = ort.InferenceSession(model_path).run(None, {"input": x})[0]
+
+    assert np.allclose(run_shards(paths, shard_dag, {"input": x})["output"], expected)
+
+def test_shards_export_tensors_consumed_elsewhere(tmp_path):
+    model_path = make_mock_chain_model(str(tmp_path / "chain.onnx"), [16] * 5)
+    model = onnx.load(model_path)
+    # skip connection: the first activation also feeds the last MatMul's output
+    model.graph.node[-1].input[0] = "skip"
+    model.graph.node.append(onnx.helper.make_node("Add", ["mm3", "relu0"], ["skip"], name="add"))
+    model.graph.node.insert(len(model.graph.node) - 2, model.graph.node.pop())
+    onnx.save(model, model_path)
+
+    paths = [str(tmp_path / f"shard_{i}.onnx") for i in range(2)]
+    shard_dag = shard_onnx_model(PeriModel(model_path), 2, paths, partitioner="simple", out_of_core=False)
+
+    x = np.random.default_rng(0).random((1, 16), dtype=np.float32)
+    expected = ort.InferenceSession(model_path).run(None, {"input": x})[0]
+
+    assert np.allclose(run_shards(paths, shard_dag, {"input": x})["output"], expected)
+
+def test_shards_declare_inferred_types(tmp_path):
+    model_path = make_mock_chain_model(str(tmp_path / "chain.onnx"), [16, 8, 4])
+    paths = [str(tmp_path / f"shard_{i}.onnx") for i in range(2)]
+    shard_onnx_model(PeriModel(model_path), 2, paths, partitioner="simple")
+
+    assert [x.shape for x in PeriModel(paths[1]).get_dummy_inputs().values()] == [(1, 8)]
@@ -0,0 +1,342 @@
+import asyncio
+import pytest
+import threading
+import time
+import numpy as np
+
+from periphery.distributed.task_manager import TaskManager, QueueFullError
+from periphery.model.model import PeriModel, SessionConfig
+from periphery.utils import codec
+
+from tests.unit.mock import make_mock_onnx_model
+
+class CountingModel(PeriModel):
+    def __init__(self, path):
+        super().__init__(path)
+        self.calls = 0
+
+    def infer(self, input_dict):
+        self.calls += 1
+        return super().infer(input_dict)
+
+@pytest.fixture
+def model(tmp_path):
+    return CountingModel(make_mock_onnx_model(str(tmp_path / "mock.onnx")))
+
+def test_infer_batch_matches_single(model):
+    requests = [{"x": np.full((n, 4), n, dtype=np.float32)} for n in (1, 2, 3)]
+
+    outputs = model.infer_batch(requests)
+
+    assert model.calls == 1
+    for request, output in zip(requests, outputs):
+        np.testing.assert_array_equal(output["y"], request["x"] + 1)
+
+def test_infer_batch_copies_bound_outputs_before_release(tmp_path, monkeypatch):
+    model = PeriModel(make_mock_onnx_model(str(tmp_path / "mock.onnx")), session_config=SessionConfig(io_binding=True))
+    requests = [{"x": np.full((1, 4), n, dtype=np.float32)} for n in (1, 2)]
+
+    # released buffers are free for the next run to write into
+    release_outputs = model.release_outputs
+    def release_and_overwrite(outputs):
+        for array in outputs.values():
+            array.fill(-1)
+        release_outputs(outputs)
+    monkeypatch.setattr(model, "release_outputs", release_and_overwrite)
+
+    outputs = model.infer_batch(requests)
+
+    for request, output in zip(requests, outputs):
+        np.testing.assert_array_equal(output["y"], request["x"] + 1)
+
+def test_infer_batch_falls_back_on_mismatched_shapes(model):
+    requests = [{"x": np.zeros((1, 4), dtype=np.float32)}, {"x": np.zeros((1, 3), dtype=np.float32)}]
+
+    assert not model.can_batch(requests)
+
+def test_infer_batch_fixed_batch_dim(tmp_path):
+    model = CountingModel(make_mock_onnx_model(str(tmp_path / "fixed.onnx"), batch_dim=1))
+    requests = [{"x": np.zeros((1, 4), dtype=np.float32)} for _ in range(3)]
+
+    outputs = model.infer_batch(requests)
+
+    assert model.calls == 3
+    assert all(np.all(x["y"] == 1) for x in outputs)
+
+def test_infer_batch_outputs_without_batch_dim(tmp_path):
+    # y sums x over the batch, so a batched run couldn't be split between the requests
+    import onnx
+    from onnx import helper
+
+    axes = helper.make_tensor("axes", onnx.TensorProto.INT64, [1], [0])
+    graph = helper.make_graph(
+        nodes=[helper.make_node("ReduceSum", ["x", "axes"], ["y"], keepdims=0)],
+        name="reduce",
+        inputs=[helper.make_tensor_value_info("x", onnx.TensorProto.FLOAT, ["batch", 4])],
+        outputs=[helper.make_tensor_value_info("y", onnx.TensorProto.FLOAT, [4])],
+        initializer=[axes],
+    )
+    onnx_model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    onnx_model.ir_version = 8
+    onnx.save(onnx_model, str(tmp_path / "reduce.onnx"))
+
+    model = CountingModel(str(tmp_path / "reduce.onnx"))
+    requests = [{"x": np.ones((1, 4), dtype=np.float32)} for _ in range(3)]
+
+    assert not model.can_batch(requests)
+    outputs = model.infer_batch(requests)
+
+    # one run per request, without a wasted batched run first
+    assert model.calls == 3
+    assert all(np.all(x["y"] == 1) for x in outputs)
+
+def test_task_manager_micro_batching(model):
+    task_manager = TaskManager(max_batch_size=4, max_batch_wait=0.01)
+    task_manager.set_model(model)
+
+    for infer_id in range(3):
+        task_manager.submit_input({"x": np.full((1, 4), infer_id, dtype=np.float32)}, infer_id)
+    task_manager.check_for_completion()
+
+    assert model.calls == 1
+    assert not task_manager.input_requests
+    for infer_id in range(3):
+        np.testing.assert_array_equal(task_manager.outputs[infer_id]["y"], np.full((1, 4), infer_id + 1))
+
+def test_partial_request_does_not_block_ready_ones(model):
+    task_manager = TaskManager()
+    task_manager.set_model(model)
+    task_manager.input_names.append("mask")
+    task_manager.input_name_set.add("mask")
+
+    task_manager.submit_input({"x": np.zeros((1, 4), dtype=np.float32)}, 0)
+    task_manager.submit_input({"x": np.zeros((1, 4), dtype=np.float32), "mask": np.ones(1)}, 1)
+
+    assert list(task_manager.ready_ids) == [1]
+    assert task_manager.missing_inputs[0] == 1
+
+    task_manager.submit_input({"mask": np.ones(1)}, 0)
+    task_manager.submit_input({"mask": np.ones(1)}, 0)
+
+    assert list(task_manager.ready_ids) == [1, 0]
+    assert task_manager.missing_inputs[0] == 0
+
+def test_pipeline_workers(model):
+    task_manager = TaskManager(max_queue_size=8)
+    task_manager.set_model(model)
+    sent = []
+    task_manager.forward = sent.append
+
+    task_manager.start(num_workers=2, num_senders=1)
+    try:
+        for infer_id in range(5):
+            task_manager.submit_input({"x": np.full((1, 4), infer_id, dtype=np.float32)}, infer_id)
+
+        deadline = time.monotonic() + 5
+        while len(sent) < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        task_manager.stop()
+
+    assert sorted(sent) == list(range(5))
+    for infer_id in range(5):
+        np.testing.assert_array_equal(task_manager.outputs[infer_id]["y"], np.full((1, 4), infer_id + 1))
+
+def test_stop_with_full_send_queue(model):
+    task_manager = TaskManager(max_queue_size=2)
+    task_manager.set_model(model)
+    task_manager.forward = lambda infer_id: time.sleep(0.05)
+
+    task_manager.start(num_workers=2, num_senders=1)
+    for infer_id in range(2):
+        task_manager.submit_input({"x": np.zeros((1, 4), dtype=np.float32)}, infer_id)
+
+    # stop while workers may be blocked handing finished requests to the one busy sender
+    stopper = threading.Thread(target=task_manager.stop, daemon=True)
+    stopper.start()
+    stopper.join(timeout=5)
+
+    assert not stopper.is_alive()
+    assert not task_manager.is_running()
+
+def test_submit_refused_when_queue_full(model):
+    task_manager = TaskManager(max_queue_size=2)
+    task_manager.set_model(model)
+
+    task_manager.submit_input({"x": np.zeros((1, 4), dtype=np.float32)}, 0)
+    task_manager.submit_input({"x": np.zeros((1, 4), dtype=np.float32)}, 1)
+
+    with pytest.raises(QueueFullError):
+        task_manager.submit_input({"x": np.zeros((1, 4), dtype=np.float32)}, 2)
+
+def report_to(task_manager, monkeypatch):
+    reported = []
+    task_manager.master_url = "http://master"
+    monkeypatch.setattr(task_manager.peers, "submit_request", lambda method, url, json: reported.append((url, json["reason"])))
+    return reported
+
+def test_stale_requests_dropped_and_reported(model, monkeypatch):
+    task_manager = TaskManager(max_queue_size=1)
+    task_manager.set_model(model)
+    task_manager.input_names.append("mask")
+    task_manager.input_name_set.add("mask")
+    task_manager.pending_timeout = 0.05
+    reported = report_to(task_manager, monkeypatch)
+
+    # e.g. the parent sending the mask failed
+    task_manager.submit_input({"x": np.zeros((1, 4), dtype=np.float32)}, 0)
+    with pytest.raises(QueueFullError):
+        task_manager.submit_input({"x": np.zeros((1, 4), dtype=np.float32)}, 1)
+
+    time.sleep(0.1)
+    task_manager.submit_input({"x": np.zeros((1, 4), dtype=np.float32)}, 1)
+
+    assert list(task_manager.input_requests) == [1]
+    assert 0 not in task_manager.missing_inputs and 0 not in task_manager.arrival_times
+    assert [x for x, _ in reported] == ["http://master/failed_request/0"]
+
+def test_failed_inference_reported(model, monkeypatch):
+    task_manager = TaskManager()
+    task_manager.set_model(model)
+    reported = report_to(task_manager, monkeypatch)
+
+    task_manager.submit_input({"x": np.zeros((1, 3), dtype=np.float32)}, 4)
+    task_manager.check_for_completion()
+
+    assert [x for x, _ in reported] == ["http://master/failed_request/4"]
+    assert reported[0][1].startswith("Inference failed")
+    assert task_manager.requests_total.get(event="failed") == 1
+
+def test_bound_outputs_released_after_forwarding(tmp_path):
+    model = PeriModel(make_mock_onnx_model(str(tmp_path / "mock.onnx")), session_config=SessionConfig(io_binding=True))
+    task_manager = TaskManager()
+    task_manager.set_model(model)
+
+    task_manager.submit_input({"x": np.zeros((1, 4), dtype=np.float32)}, 0)
+    task_manager.check_for_completion()
+
+    assert 0 not in task_manager.outputs
+    assert sum(len(x) for x in model.free_buffers.values()) == 1
+
+def test_route_picks_least_outstanding_replica():
+    task_manager = TaskManager()
+    task_manager.add_child("http://a", ["t"], ["http://a", "http://b"])
+
+    first = task_manager.route("http://a")
+    second = task_manager.route("http://a")
+    assert {first, second} == {"http://a", "http://b"}
+
+    # a copy reporting a long queue is avoided until the other catches up
+    task_manager.replica_in_flight.clear()
+    task_manager.replica_pending = {"http://a": 5, "http://b": 0}
+    assert [task_manager.route("http://a") for _ in range(5)] == ["http://b"] * 5
+    assert task_manager.route("http://a") in ("http://a", "http://b")
+
+    assert task_manager.route("http://unreplicated") == "http://unreplicated"
+
+def test_stage_metrics(model):
+    task_manager = TaskManager()
+    task_manager.set_model(model)
+
+    for infer_id in range(2):
+        task_manager.submit_input({"x": np.zeros((1, 4), dtype=np.float32)}, infer_id)
+    task_manager.submit_input({}, 2)
+    task_manager.check_for_completion()
+
+    for stage in ("wait_inputs", "queue", "run", "forward"):
+        assert task_manager.stage_seconds.count(stage=stage) == 2
+    assert task_manager.requests_total.get(event="received") == 3
+    assert task_manager.requests_total.get(event="inferred") == 2
+
+    text = task_manager.metrics.render()
+    assert 'periphery_queue_depth{queue="pending"} 1' in text
+    assert 'periphery_held_bytes{store="outputs"} 32' in text
+
+def test_outputs_dropped_once_acknowledged():
+    task_manager = TaskManager()
+    task_manager.set_result_limits(max_output_bytes=0)
+    for infer_id in range(2):
+        task_manager.outputs.put(infer_id, {"y": np.zeros(4, dtype=np.float32)}, pinned=True)
+
+    task_manager.release_outputs(0, acknowledged=True)
+    task_manager.release_outputs(1, acknowledged=False)
+
+    # unacknowledged outputs are kept while the budget allows, which here it doesn't
+    assert 0 not in task_manager.outputs
+    assert 1 not in task_manager.outputs
+    assert task_manager.outputs.evictions == 1
+
+def test_spill_limits(tmp_path):
+    leftover = tmp_path / "final_outputs" / "7_crashed"
+    leftover.mkdir(parents=True)
+    (leftover / "0.npy").write_bytes(b"stale")
+
+    task_manager = TaskManager()
+    task_manager.set_result_limits(max_final_output_bytes=0, spill_dir=str(tmp_path), max_spill_bytes=500)
+
+    # leftovers of an earlier process are removed
+    assert not leftover.exists()
+
+    for infer_id in range(3):
+        task_manager.final_outputs[infer_id] = {"y": np.zeros(100, dtype=np.float32)}
+
+    # everything spills, and only what fits on disk stays
+    assert list(task_manager.final_outputs) == [2]
+    assert task_manager.final_outputs.spilled_bytes == 400
+    assert len(list((tmp_path / "final_outputs").iterdir())) == 1
+
+def test_edge_codec(monkeypatch):
+    task_manager = TaskManager()
+    task_manager.add_child("http://a", ["y"], ["http://a", "http://b"], codec="fp16")
+    task_manager.add_child("http://c", ["y"])
+    task_manager.outputs[0] = {"y": np.linspace(-1, 1, 64, dtype=np.float32)}
+
+    sent = {}
+    class Response:
+        status_code = 200
+    def post(url, data=None, headers=None, **kwargs):
+        sent[url] = (bytes(data), headers)
+        return Response()
+    monkeypatch.setattr(task_manager.peers, "post", post)
+
+    for peer in ("http://b", "http://c"):
+        task_manager.post_tensors(peer, peer, 0, ["y"], peer)
+
+    body, headers = sent["http://b"]
+    decoded = codec.decode(body, headers[codec.CODEC_HEADER])["y"]
+    np.testing.assert_allclose(decoded, task_manager.outputs[0]["y"], atol=1e-3)
+    assert len(body) < len(sent["http://c"][0])
+    assert codec.CODEC_HEADER not in sent["http://c"][1]
+    assert task_manager.codec_bytes.get(codec="fp16", stage="raw") == 256
+
+def test_timed_out_waits_leave_no_waiters():
+    task_manager = TaskManager()
+
+    async def wait():
+        assert not await task_manager.wait_for_final_output(7, timeout=0.01)
+        assert task_manager.final_output_waiters == {}
+
+        threading.Timer(0.05, task_manager.set_final_output, (8, {"output": np.ones(1)})).start()
+        assert await task_manager.wait_for_final_output(8, timeout=5)
+        assert task_manager.final_output_waiters == {}
+
+    asyncio.run(wait())
+
+def test_edge_codec_dropped_for_peers_that_cant_decode_it(monkeypatch):
+    task_manager = TaskManager()
+    task_manager.add_child("http://a", ["y"], codec="int8")
+    task_manager.outputs[0] = {"y": np.ones(4, dtype=np.float32)}
+
+    sent = []
+    class Response:
+        def __init__(self, status_code):
+            self.status_code = status_code
+    def post(url, data=None, headers=None, **kwargs):
+        sent.append(headers)
+        return Response(415 if codec.CODEC_HEADER in headers else 200)
+    monkeypatch.setattr(task_manager.peers, "post", post)
+
+    assert task_manager.post_tensors("http://a", "http://a/submit_input/0", 0, ["y"], "http://a").status_code == 200
+    assert [codec.CODEC_HEADER in x for x in sent] == [True, False]
+    assert "http://a" not in task_manager.edge_codecs
+    assert "http://a" not in task_manager.npz_peers
@@ -0,0 +1,39 @@
+from periphery.utils.tracing import Tracer, TRACE_HEADER, to_chrome_trace
+
+def test_sampling_is_consistent_across_nodes():
+    first, second = Tracer(sample_rate=0.25), Tracer(sample_rate=0.25)
+
+    sampled = [x for x in range(1000) if first.begin(x)]
+
+    assert sampled == [x for x in range(1000) if second.begin(x)]
+    assert 150 < len(sampled) < 350
+
+def test_header_overrides_sampling():
+    upstream = Tracer(sample_rate=1.0)
+    upstream.begin(7)
+    downstream = Tracer(sample_rate=0.0)
+
+    assert downstream.begin(7, upstream.header(7)[TRACE_HEADER])
+    assert not Tracer(sample_rate=1.0).begin(7, "7:0")
+
+def test_only_sampled_requests_are_recorded():
+    tracer = Tracer(sample_rate=0.0)
+    tracer.begin(1, "1:1")
+    tracer.begin(2, "2:0")
+
+    tracer.record(1, "run", 1.0, 1.5)
+    tracer.record(2, "run", 1.0, 1.5)
+    tracer.end(1)
+    tracer.record(1, "send", 1.5, 2.0)
+
+    assert [(x["infer_id"], x["name"]) for x in tracer.get_spans()] == [(1, "run")]
+
+def test_chrome_trace():
+    span = {"trace_id": "1", "infer_id": 1, "name": "run", "start": 2.0, "end": 2.5, "args": {"batch_size": 1}}
+
+    trace = to_chrome_trace({"http://a": [span], "http://b": []})
+
+    events = trace["traceEvents"]
+    assert [x["args"]["name"] for x in events if x["ph"] == "M"] == ["http://a", "http://b"]
+    run = [x for x in events if x["ph"] == "X"][0]
+    assert (run["ts"], run["dur"], run["pid"], run["tid"]) == (2e6, 5e5, 0, 1)
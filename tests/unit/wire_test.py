@@ -0,0 +1,35 @@
+import numpy as np
+
+from periphery.utils import wire
+
+def test_round_trip():
+    tensors = {
+        "hidden": np.random.rand(2, 3, 5).astype(np.float32),
+        "ids": np.arange(7, dtype=np.int64),
+        "scalar": np.array(1.5),
+        "strided": np.arange(10)[::3],
+        "empty": np.zeros((0, 4), dtype=np.float16),
+    }
+
+    decoded = wire.decode_tensors(bytes(wire.pack_tensors(tensors)))
+
+    assert list(decoded) == list(tensors)
+    for name, value in tensors.items():
+        assert decoded[name].dtype == value.dtype
+        assert decoded[name].shape == value.shape
+        np.testing.assert_array_equal(decoded[name], value)
+
+def test_decode_is_zero_copy():
+    buffer = wire.pack_tensors({"x": np.arange(16, dtype=np.float32)})
+
+    decoded = wire.decode_tensors(buffer)
+    decoded["x"][0] = 42
+
+    assert wire.decode_tensors(buffer)["x"][0] == 42
+
+def test_frames_match_packed():
+    tensors = {"a": np.ones((3, 3)), "b": np.zeros(5, dtype=np.int8)}
+
+    frames = wire.encode_tensors(tensors)
+
+    assert b"".join(bytes(x) for x in frames) == bytes(wire.pack_tensors(tensors))